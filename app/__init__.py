@@ -1,15 +1,13 @@
 import os
 from flask import Flask
-from .core.gemma_client import OllamaGemmaClient
+from kombu import Queue
 # from .api.polygons import bp as polygons_bps
-from .extensions import db, migrate, celery_init_app
+from .extensions import db, celery_init_app, gemma, batch_status, map_events, scheduler, uploads, INFERENCE_QUEUE
 from .models import *
 from .routes import main as main_bp
 
-gemma = OllamaGemmaClient()
 
-
-def create_app():
+def create_app(config=None):
     app = Flask(__name__,
             template_folder='web/templates',
             static_folder='web/static')
@@ -17,28 +15,137 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = os.path.abspath(
         os.path.join(os.path.dirname(__file__), 'data', 'input_images'))
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+    app.config['SQLITE_BUSY_TIMEOUT'] = 30      # seconds a writer waits for the lock (thread-pool workers write concurrently)
+
+    # Chunked uploads (/api/uploads): files stream to UPLOAD_FOLDER/.partial, then move to <sha256><ext>
+    app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024   # chunk size suggested to clients
+    app.config['UPLOAD_MAX_CHUNK_BYTES'] = 64 * 1024 * 1024
+    app.config['UPLOAD_MAX_FILE_BYTES'] = 2 * 1024 ** 3
+    app.config['UPLOAD_PARTIAL_TTL'] = 24 * 3600   # idle seconds before an unfinished upload is discarded
     app.config['CELERY'] = {
         "broker_url": "redis://localhost:6379/0",
-        "result_backend": "redis://localhost:6379/0"
+        "result_backend": "redis://localhost:6379/0",
+        # Staged pipeline: a worker started without -Q consumes all of these;
+        # dedicated workers pick stages with -Q (see README, "Worker layout")
+        "task_queues": [Queue("celery"), Queue("preprocess"), Queue(INFERENCE_QUEUE),
+                        Queue("postprocess"), Queue("aggregate")],
+        "task_routes": {
+            "app.tasks.preprocess_image_task": {"queue": "preprocess"},
+            "app.tasks.infer_image_task": {"queue": INFERENCE_QUEUE},
+            "app.tasks.analyze_image_task": {"queue": INFERENCE_QUEUE},
+            "app.tasks.analyze_batch_task": {"queue": INFERENCE_QUEUE},
+            "app.tasks.postprocess_image_task": {"queue": "postprocess"},
+            "app.tasks.aggregate_image_task": {"queue": "aggregate"},
+            "app.tasks.compact_combined_polygons": {"queue": "aggregate"},
+            "app.tasks.trigger_map_update": {"queue": "aggregate"},
+        },
+        # Inference tasks run for minutes: never hold a second one back in a busy process
+        "worker_prefetch_multiplier": 1,
+        # Workers import the tasks at startup; the web app only on its first upload
+        "imports": ("app.tasks",),
     }
+    app.config['MIGRATIONS_ENABLED'] = True     # registers `flask db`; workers skip it (alembic is slow to import)
+    app.config['PIPELINE_STAGED'] = True        # queue images as preprocess -> infer -> postprocess -> aggregate
+
+    # Fair-share scheduling: uploads wait in per-batch queues, at most N images are in Celery at once
+    app.config['SCHEDULER_ENABLED'] = True
+    app.config['SCHEDULER_REDIS_URL'] = app.config['CELERY']['broker_url']  # None = per process
+    app.config['SCHEDULER_MAX_IN_FLIGHT'] = 4   # about the inference concurrency across all workers
+    app.config['SCHEDULER_SMALL_FIRST'] = True  # within a batch, fewest pixels first
+    app.config['SCHEDULER_DEFAULT_PRIORITY'] = 1
+    app.config['SCHEDULER_MAX_PRIORITY'] = 10   # a priority-p batch gets p images per image of a priority-1 batch
+    app.config['SCHEDULER_IN_FLIGHT_TIMEOUT'] = 3600  # free the slot of an image whose task was lost
+    app.config['SCHEDULER_RECLAIM_INTERVAL'] = 60  # seconds between worker dispatches that refill expired slots
+    app.config['SCHEDULER_DEFAULT_SERVICE_TIME'] = 60  # seconds per image for wait estimates until measured
+
+    # Ollama client: one pooled keep-alive session per worker process
+    app.config['OLLAMA_URL'] = "http://localhost:11434/api/generate"
+    app.config['OLLAMA_URLS'] = None            # e.g. ["http://jetson-1:11434", "http://jetson-2:11434"]
+    app.config['OLLAMA_HEALTH_INTERVAL'] = 30   # seconds between /api/tags probes
+    app.config['OLLAMA_ENDPOINT_RETRY_AFTER'] = 30  # seconds a failing endpoint stays out of rotation
+    app.config['OLLAMA_MODEL'] = "gemma3n:e4b"
+    app.config['OLLAMA_TIMEOUT'] = 600
+    app.config['OLLAMA_POOL_CONNECTIONS'] = 2   # per-host pools kept
+    app.config['OLLAMA_POOL_MAXSIZE'] = 4       # connections kept alive per host
+    app.config['OLLAMA_POOL_BLOCK'] = False
+    app.config['OLLAMA_KEEPALIVE_IDLE'] = 60    # seconds before TCP keep-alive probes
+    app.config['OLLAMA_IMAGE_MAX_EDGE'] = 1024  # long edge sent to the model (None sends raw file)
+    app.config['OLLAMA_IMAGE_QUALITY'] = 85     # JPEG quality of the downscaled image
+    app.config['OLLAMA_STREAM'] = False         # persist features as the token stream produces them
+    app.config['OLLAMA_MODEL_KEEP_ALIVE'] = "30m"  # Ollama keep_alive sent with every request
+    app.config['OLLAMA_WARMUP_ON_START'] = True  # load the model when a worker starts
+    app.config['OLLAMA_KEEP_WARM_INTERVAL'] = 240  # ping while tasks are queued (0 disables)
+    app.config['OLLAMA_COLD_LOAD_THRESHOLD'] = 1.0  # load_duration (s) that marks a cold request
+    app.config['OLLAMA_CONNECT_TIMEOUT'] = 10
+    app.config['OLLAMA_ADAPTIVE_TIMEOUT'] = True  # read timeout from observed latency, capped at OLLAMA_TIMEOUT
+    app.config['OLLAMA_TIMEOUT_PERCENTILE'] = 95
+    app.config['OLLAMA_TIMEOUT_MULTIPLIER'] = 2.0
+    app.config['OLLAMA_TIMEOUT_MIN'] = 60
+    app.config['OLLAMA_TIMEOUT_MIN_SAMPLES'] = 20  # samples per model/size bucket before adapting
+    app.config['OLLAMA_CIRCUIT_FAILURES'] = 5   # backend failures ...
+    app.config['OLLAMA_CIRCUIT_WINDOW'] = 60    # ... within this many seconds open the circuit
+    app.config['OLLAMA_CIRCUIT_COOLDOWN'] = 60  # seconds the circuit stays open
+    app.config['OLLAMA_CIRCUIT_HALF_OPEN_TTL'] = 3600  # seconds half-open without a trial verdict before it closes
+    app.config['OLLAMA_REDIS_URL'] = app.config['CELERY']['broker_url']  # shares breaker/latency state; None = per process
+    app.config['TASK_RETRY_BACKOFF'] = 30       # first retry delay, doubled per attempt, full jitter
+    app.config['TASK_RETRY_BACKOFF_MAX'] = 900
+    app.config['DEAD_LETTER_QUEUE'] = "dead_letter"  # where images go after their last retry
+    app.config['OLLAMA_BATCH_MODE'] = False     # analyze multi-image uploads in one async task
+    app.config['OLLAMA_ASYNC_CONCURRENCY'] = 2  # images in flight per batch task
+
+    # Tiled inference for high-resolution UAV frames
+    app.config['TILING_ENABLED'] = False
+    app.config['TILE_SIZE'] = 1024              # full-resolution pixels per tile edge
+    app.config['TILE_OVERLAP'] = 128            # pixels shared by neighbouring tiles
+    app.config['TILE_MERGE_OVERLAP'] = 0.3      # same-class overlap ratio treated as a duplicate
+    app.config['TILE_CONCURRENCY'] = 2          # tiles in flight per image
+
+    # Georeferencing: camera intrinsics come from EXIF, the flight altitude does not
+    app.config['GEOREF_FLIGHT_ALTITUDE_M'] = 120  # above ground; EXIF GPSAltitude is above sea level
 
+    # Live map updates: Server-Sent Events fed by Redis pub/sub
+    app.config['MAP_EVENTS_REDIS_URL'] = app.config['CELERY']['broker_url']  # None = per process
+    app.config['MAP_EVENTS_CHANNEL'] = "map:events"
+    app.config['MAP_EVENTS_HEARTBEAT'] = 15     # seconds between keep-alive comments
+    app.config['MAP_VIEWPORT_MAX_FEATURES'] = 5000  # cap for /api/polygons?bbox=... responses
+
+    # Batch status: Redis hashes shared by web app and workers, expiring after the TTL
+    app.config['BATCH_STATUS_REDIS_URL'] = app.config['CELERY']['broker_url']  # None = per process
+    app.config['BATCH_STATUS_TTL'] = 7 * 24 * 3600
+    app.config['BATCH_STATUS_SNAPSHOT_DIR'] = None  # e.g. "batch_status" to export JSON on map updates
+    app.config['BATCH_STATUS_PAGE_SIZE'] = 50
+    app.config['BATCH_STATUS_MAX_PAGE_SIZE'] = 500
+
+    # Inference result cache: disk LRU, plus optional Redis tier shared by workers
+    app.config['INFERENCE_CACHE_ENABLED'] = True
+    app.config['INFERENCE_CACHE_DIR'] = os.path.join(app.instance_path, 'inference_cache')
+    app.config['INFERENCE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+    app.config['INFERENCE_CACHE_REDIS_URL'] = None  # e.g. "redis://localhost:6379/1"
+    app.config['INFERENCE_CACHE_TTL'] = 7 * 24 * 3600
+
+    # Overrides (benchmarks, tests, deployments) win over the defaults above
+    if config:
+        app.config.update(config)
+
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engine_options.setdefault('connect_args', {}).setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT'])
     db.init_app(app)
-    migrate.init_app(app, db)
+    gemma.init_app(app)
+    batch_status.init_app(app)
+    map_events.init_app(app)
+    scheduler.init_app(app)
+    uploads.init_app(app)
+    if app.config['MIGRATIONS_ENABLED']:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     celery_init_app(app)
 
     # app.register_blueprint(polygons_bp)
     app.register_blueprint(main_bp)
 
+    # Uploaded images may still have queued tasks: never delete them here (see `python manage.py clear-uploads`)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-        fp = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.isfile(fp):
-            os.remove(fp)
 
     return app
 
-app = create_app()
-celery = app.extensions["celery"]
-
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,126 @@
+# app/core/async_gemma_client.py
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+from .gemma_client import OllamaGemmaClient
+
+
+class AsyncOllamaGemmaClient:
+    """
+    Analyzes many images concurrently against Ollama with httpx.
+
+    Wraps an OllamaGemmaClient for its configuration, prompt templates,
+    response parsing and inference cache. At most ``max_concurrency`` images
+    are in flight; file reads and base64 encoding run in worker threads, so
+    they overlap with the network waits of the other images.
+    """
+
+    def __init__(self, client: OllamaGemmaClient = None, max_concurrency: int = 2,
+                 keepalive_expiry: float = 60.0):
+        self.client = client or OllamaGemmaClient()
+        self.max_concurrency = max_concurrency
+        self.keepalive_expiry = keepalive_expiry
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_config(cls, client: OllamaGemmaClient, config):
+        return cls(client, max_concurrency=config.get("OLLAMA_ASYNC_CONCURRENCY", 2),
+                   keepalive_expiry=config.get("OLLAMA_KEEPALIVE_IDLE", 60.0))
+
+    def _http_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency,
+                              keepalive_expiry=self.keepalive_expiry)
+        timeout = httpx.Timeout(self.client.timeout, connect=self.client.connect_timeout)
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def analyze_disaster_image(self, http: httpx.AsyncClient, image_path,
+                                     prompt_template: str = "disaster_assessment") -> dict:
+        """Async counterpart of OllamaGemmaClient.analyze_disaster_image."""
+        client = self.client
+        cache_key, cached = await asyncio.to_thread(client.lookup_cache, image_path, prompt_template)
+        if cached is not None:
+            self.logger.info(f"Inference cache hit for {image_path}")
+            return cached
+
+        payload, image_size, error = await asyncio.to_thread(
+            client._prepare_request, image_path, prompt_template, False)
+        if error:
+            return error
+
+        bucket, read_timeout = await asyncio.to_thread(client._begin_request, image_size)
+        try:
+            with client.endpoints.acquire() as endpoint:
+                start = time.monotonic()
+                response = await http.post(endpoint.generate_url, json=payload,
+                                           timeout=httpx.Timeout(read_timeout, connect=client.connect_timeout))
+                response.raise_for_status()
+                response_json = response.json()
+        except httpx.TimeoutException as e:
+            await asyncio.to_thread(client._end_request, bucket, read_timeout, e)
+            raise
+        except httpx.HTTPError as e:
+            await asyncio.to_thread(client._end_request, bucket, None, e)
+            raise
+        await asyncio.to_thread(client._end_request, bucket, time.monotonic() - start)
+        client._record_load(response_json, time.monotonic() - start, endpoint)
+
+        if "response" in response_json:
+            parsed_json = client._parse_feature_collection(response_json["response"])
+            if parsed_json is not None:
+                parsed_json["image_size"] = image_size
+                if client.cache is not None and cache_key:
+                    await asyncio.to_thread(client.cache.set, cache_key, parsed_json)
+                return parsed_json
+
+        response_json["image_size"] = image_size
+        return response_json
+
+    async def iter_analyze_images(self, image_paths, prompt_template: str = "disaster_assessment"):
+        """
+        Yields (image_path, response) as each image finishes, in completion order.
+        A failing image yields (image_path, exception) instead of aborting the batch.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._http_client() as http:
+            async def run(path):
+                async with semaphore:
+                    try:
+                        return path, await self.analyze_disaster_image(http, path, prompt_template)
+                    except Exception as e:
+                        self.logger.error(f"Async analysis failed for {path}: {e}")
+                        return path, e
+
+            for next_done in asyncio.as_completed([run(path) for path in image_paths]):
+                yield await next_done
+
+    async def analyze_images(self, image_paths, prompt_template: str = "disaster_assessment") -> list:
+        """Returns [(image_path, response_or_exception), ...] in completion order."""
+        return [item async for item in self.iter_analyze_images(image_paths, prompt_template)]
+
+    def analyze_batch(self, image_paths, prompt_template: str = "disaster_assessment") -> list:
+        """Blocking wrapper around analyze_images for synchronous callers."""
+        return asyncio.run(self.analyze_images(image_paths, prompt_template))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Analyze several images concurrently with Ollama Gemma")
+    parser.add_argument("image_paths", nargs="+", help="Paths to the disaster image files")
+    parser.add_argument("--concurrency", type=int, default=2, help="Images in flight at once")
+    args = parser.parse_args()
+
+    async_client = AsyncOllamaGemmaClient(max_concurrency=args.concurrency)
+
+    async def main():
+        async for path, result in async_client.iter_analyze_images(args.image_paths):
+            if isinstance(result, Exception):
+                result = {"error": str(result), "status": "failed"}
+            print(json.dumps({"image_path": str(path), "result": result}))
+
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+# app/core/batch_status.py
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("total_expected", "completed_count", "failed_count", "total_polygons")
+
+
+class _LocalHashes:
+    """In-process stand-in for the Redis hash commands below (one process only, e.g. the dev server)."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        values, expires = self._hashes.get(key, ({}, None))
+        if expires is not None and expires <= time.time():
+            self._hashes.pop(key, None)
+            return {}
+        return values
+
+    def update(self, key, mapping, increments, ttl):
+        with self._lock:
+            values = dict(self._live(key))
+            values.update(mapping)
+            for field, amount in increments.items():
+                values[field] = int(values.get(field, 0)) + amount
+            self._hashes[key] = (values, time.time() + ttl)
+
+    def get(self, key):
+        with self._lock:
+            return dict(self._live(key))
+
+
+class _RedisHashes:
+    def __init__(self, redis_url):
+        import redis
+        self.redis = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2,
+                                          decode_responses=True)
+
+    def update(self, key, mapping, increments, ttl):
+        """HSET and HINCRBY in one MULTI/EXEC, refreshing the TTL."""
+        pipe = self.redis.pipeline()
+        if mapping:
+            pipe.hset(key, mapping={k: str(v) for k, v in mapping.items()})
+        for field, amount in increments.items():
+            pipe.hincrby(key, field, amount)
+        pipe.expire(key, int(ttl))
+        pipe.execute()
+
+    def get(self, key):
+        return self.redis.hgetall(key)
+
+
+class BatchStatusStore:
+    """
+    Per-batch progress in Redis hashes (``batch:<id>:status``), shared by the
+    web app and every worker. Counters are bumped atomically with HINCRBY and
+    every write refreshes the TTL, so finished batches expire on their own.
+    Redis errors are logged and swallowed: status is advisory and must never
+    fail an analysis.
+    """
+
+    def __init__(self, redis_url=None, ttl=7 * 24 * 3600, snapshot_dir=None, namespace="batch"):
+        self.hashes = _RedisHashes(redis_url) if redis_url else _LocalHashes()
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir    # export a JSON file per batch on map updates; None disables
+        self.namespace = namespace
+
+    def init_app(self, app):
+        """Configure from ``BATCH_STATUS_*`` keys."""
+        config = app.config
+        redis_url = config.get("BATCH_STATUS_REDIS_URL")
+        self.hashes = _RedisHashes(redis_url) if redis_url else _LocalHashes()
+        self.ttl = config.get("BATCH_STATUS_TTL", self.ttl)
+        self.snapshot_dir = config.get("BATCH_STATUS_SNAPSHOT_DIR", self.snapshot_dir)
+
+    def _key(self, batch_id):
+        return f"{self.namespace}:{batch_id}:status"
+
+    def _update(self, batch_id, mapping=None, increments=None):
+        mapping = {**(mapping or {}), "last_updated": datetime.now().isoformat()}
+        try:
+            self.hashes.update(self._key(batch_id), mapping, increments or {}, self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not update status of batch {batch_id}: {e}")
+
+    def start(self, batch_id, total_expected):
+        """Registers an upload of ``total_expected`` images."""
+        self._update(batch_id, {"batch_id": batch_id, "status": "processing"},
+                     {"total_expected": total_expected})
+
+    def record_result(self, batch_id, status, polygons=0):
+        """Counts one finished image: completed/partial with its polygons, or failed."""
+        if status in ("completed", "partial"):
+            self._update(batch_id, increments={"completed_count": 1, "total_polygons": polygons})
+        else:
+            self._update(batch_id, increments={"failed_count": 1})
+
+    def set(self, batch_id, **fields):
+        """Sets plain (non-counter) fields, e.g. ``status`` or ``last_map_update``."""
+        self._update(batch_id, fields)
+
+    def seed(self, batch_id, counts: dict):
+        """Replaces the counters, e.g. rebuilt from the database after the hash expired."""
+        values = {k: counts.get(k, 0) for k in COUNTERS}
+        if not any(values.values()):
+            return values   # unknown batch: nothing worth storing
+        self._update(batch_id, {"batch_id": batch_id, **values})
+        return self.get(batch_id) or values
+
+    def get(self, batch_id) -> dict:
+        """The batch's status, counters as ints; {} when unknown or expired."""
+        try:
+            values = self.hashes.get(self._key(batch_id))
+        except Exception as e:
+            logger.warning(f"Could not read status of batch {batch_id}: {e}")
+            return {}
+        for field in COUNTERS:
+            if field in values:
+                values[field] = int(values[field])
+        return values
+
+    def export_snapshot(self, batch_id, directory=None):
+        """Writes the current status to ``<directory>/<batch_id>.json`` for offline use. Returns the path."""
+        directory = directory or self.snapshot_dir
+        if not directory:
+            return None
+        status = self.get(batch_id)
+        if not status:
+            return None
+        try:
+            path = Path(directory)
+            path.mkdir(parents=True, exist_ok=True)
+            status_file = path / f"{batch_id}.json"
+            with open(status_file, "w") as f:
+                json.dump(status, f, indent=2)
+            return status_file
+        except OSError as e:
+            logger.error(f"Error exporting batch status snapshot: {e}")
+            return None
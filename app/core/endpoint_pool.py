@@ -0,0 +1,206 @@
+# app/core/endpoint_pool.py
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import requests
+
+from .resilience import make_store
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the box is unreachable (not merely slow), for both HTTP clients
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class Endpoint:
+    """One Ollama server and this process's counters for it (routing uses the shared ones)."""
+
+    def __init__(self, url: str):
+        url = url.rstrip("/")
+        if url.endswith("/api/generate"):
+            url = url[: -len("/api/generate")]
+        self.base_url = url
+        self.generate_url = f"{url}/api/generate"
+        self.in_flight = 0
+        self.healthy = True
+        self.retry_at = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+        self.last_error = None
+
+    def available(self, now: float) -> bool:
+        """Healthy, or out of rotation long enough to be retried."""
+        return self.healthy or now >= self.retry_at
+
+    def stats(self) -> dict:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.consecutive_failures,
+            "avg_latency": self.total_latency / self.requests if self.requests else None,
+            "last_latency": self.last_latency,
+            "last_error": self.last_error,
+        }
+
+
+class EndpointPool:
+    """
+    Routes requests across several Ollama servers.
+    - Each request goes to the available endpoint with the fewest in-flight requests,
+      counted across all workers when ``store`` is backed by Redis (prefork children
+      would otherwise each see their own zero). Counters expire ``in_flight_ttl``
+      seconds after their last change, so a killed worker's requests are forgotten.
+    - A connection error takes the endpoint out of rotation for ``retry_after`` seconds.
+    - A background thread (one per process) probes ``/api/tags`` every
+      ``health_interval`` seconds and puts recovered endpoints back.
+    """
+
+    def __init__(self, urls, health_interval=30, retry_after=30, probe_timeout=5, store=None, in_flight_ttl=900,
+                 namespace="gemma:endpoints"):
+        if not urls:
+            raise ValueError("At least one Ollama endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.retry_after = retry_after
+        self.probe_timeout = probe_timeout
+        self.store = store or make_store()
+        self.in_flight_ttl = in_flight_ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._health_pid = None
+
+    def choose(self) -> Endpoint:
+        """Least-loaded available endpoint; raises ConnectionError when none is."""
+        self._ensure_health_checks()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep.available(now)]
+        if not candidates:
+            raise requests.exceptions.ConnectionError("No healthy Ollama endpoints available")
+        load = {ep.base_url: self._shared_load(ep) for ep in candidates}
+        endpoint = min(candidates, key=lambda ep: load[ep.base_url])
+        self._count(endpoint, "in_flight", 1, self.in_flight_ttl)
+        with self._lock:
+            endpoint.in_flight += 1
+        return endpoint
+
+    def _key(self, endpoint: Endpoint, counter: str) -> str:
+        return f"{self.namespace}:{endpoint.base_url}:{counter}"
+
+    def _shared_load(self, endpoint: Endpoint):
+        """(in flight, requests served) across all workers; this process's counts if the store fails."""
+        try:
+            in_flight = self.store.get(self._key(endpoint, "in_flight")) or 0
+            served = self.store.get(self._key(endpoint, "requests")) or 0
+            return max(0, in_flight), served
+        except Exception as e:
+            logger.warning(f"Shared endpoint counters unavailable, routing on local ones: {e}")
+            return endpoint.in_flight, endpoint.requests
+
+    def _count(self, endpoint: Endpoint, counter: str, amount: int, ttl: float):
+        try:
+            self.store.add(self._key(endpoint, counter), amount, ttl)
+        except Exception as e:
+            logger.warning(f"Shared endpoint counter update failed: {e}")
+
+    @contextmanager
+    def acquire(self):
+        """Yields an endpoint for one request and records its latency and errors."""
+        endpoint = self.choose()
+        start = time.monotonic()
+        try:
+            yield endpoint
+        except CONNECTION_ERRORS as e:
+            self._record(endpoint, start, error=e)
+            self.mark_down(endpoint, e)
+            raise
+        except Exception as e:
+            self._record(endpoint, start, error=e)
+            raise
+        else:
+            self._record(endpoint, start)
+
+    def _record(self, endpoint: Endpoint, start: float, error=None):
+        latency = time.monotonic() - start
+        self._count(endpoint, "in_flight", -1, self.in_flight_ttl)
+        self._count(endpoint, "requests", 1, 24 * 3600)
+        if error is None and not endpoint.healthy:
+            # Retried after retry_after and answered: back in rotation without waiting for the prober
+            self.mark_up(endpoint)
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.requests += 1
+            endpoint.total_latency += latency
+            endpoint.last_latency = latency
+            if error is None:
+                endpoint.consecutive_failures = 0
+            else:
+                endpoint.errors += 1
+                endpoint.consecutive_failures += 1
+                endpoint.last_error = f"{type(error).__name__}: {error}"
+
+    def mark_down(self, endpoint: Endpoint, error=None):
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.retry_at = time.monotonic() + self.retry_after
+        logger.warning(f"Ollama endpoint {endpoint.base_url} out of rotation for {self.retry_after}s: {error}")
+
+    def mark_up(self, endpoint: Endpoint):
+        with self._lock:
+            was_down = not endpoint.healthy
+            endpoint.healthy = True
+            endpoint.retry_at = 0.0
+        if was_down:
+            logger.info(f"Ollama endpoint {endpoint.base_url} back in rotation")
+
+    def probe(self, endpoint: Endpoint) -> bool:
+        """Checks one endpoint with a cheap /api/tags call."""
+        try:
+            response = requests.get(f"{endpoint.base_url}/api/tags", timeout=self.probe_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if endpoint.healthy:
+                self.mark_down(endpoint, e)
+            return False
+        self.mark_up(endpoint)
+        return True
+
+    def probe_all(self):
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+
+    def _ensure_health_checks(self):
+        # Threads do not survive fork, so each worker process starts its own prober
+        if not self.health_interval or self._health_pid == os.getpid():
+            return
+        with self._lock:
+            if self._health_pid == os.getpid():
+                return
+            self._health_pid = os.getpid()
+        thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Ollama health probe failed: {e}")
+
+    def stats(self) -> list:
+        with self._lock:
+            stats = [ep.stats() for ep in self.endpoints]
+        for ep, row in zip(self.endpoints, stats):
+            row["in_flight_all_workers"], _ = self._shared_load(ep)
+        return stats
@@ -3,93 +3,488 @@ import requests
 import base64
 import logging
 import json
+import io
+import socket
+import threading
+import time
+from collections import deque
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from .endpoint_pool import EndpointPool
+from .resilience import AdaptiveTimeout, CircuitBreaker, is_backend_failure, make_store
+from .inference_cache import InferenceCache, hash_file
+from .json_extract import extract_feature_collection
+from .stream_parser import FeatureStreamParser
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that turns on TCP keep-alive for every pooled connection."""
+
+    def __init__(self, keepalive_idle=60, **kwargs):
+        # Must be set before super().__init__, which builds the pool manager
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        if self.keepalive_idle:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            if hasattr(socket, "TCP_KEEPIDLE"):  # not available on macOS
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class ModelLoadStats:
+    """
+    Cold-start vs warm request latency. A request counts as cold when Ollama
+    reports a ``load_duration`` above the threshold, i.e. it had to load the model.
+    """
+
+    def __init__(self, cold_threshold=1.0, window=200):
+        self.cold_threshold = cold_threshold
+        self._samples = {"cold": deque(maxlen=window), "warm": deque(maxlen=window)}
+        self._counts = {"cold": 0, "warm": 0}
+        self._lock = threading.Lock()
+
+    def record(self, response_json: dict, latency: float) -> bool:
+        """Records one generate call; returns True if it paid a model load."""
+        load_seconds = (response_json.get("load_duration") or 0) / 1e9
+        kind = "cold" if load_seconds >= self.cold_threshold else "warm"
+        with self._lock:
+            self._samples[kind].append((latency, load_seconds))
+            self._counts[kind] += 1
+        return kind == "cold"
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for kind, samples in self._samples.items():
+                latencies = [latency for latency, _ in samples]
+                result[kind] = {
+                    "count": self._counts[kind],
+                    "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+                    "max_latency": max(latencies) if latencies else None,
+                    "mean_load": sum(load for _, load in samples) / len(samples) if samples else None,
+                }
+            return result
+
 
 class OllamaGemmaClient:
 
-    def __init__(self):
-        self.model = "gemma3n:e4b"
-        self.ollama_url = "http://localhost:11434/api/generate"
-        self.timeout = 600  # Increased to 10 minutes
+    def __init__(self, ollama_url="http://localhost:11434/api/generate", model="gemma3n:e4b",
+                 timeout=600, pool_connections=2, pool_maxsize=4, pool_block=False,
+                 keepalive_idle=60, image_max_edge=1024, image_quality=85, stream=False,
+                 ollama_urls=None, health_interval=30, endpoint_retry_after=30, keep_alive="30m",
+                 warmup_on_start=True, keep_warm_interval=240, cold_load_threshold=1.0, connect_timeout=10):
+        self.model = model
+        # Several Ollama boxes can share the load; a single URL is a pool of one
+        self.endpoints = EndpointPool(ollama_urls or [ollama_url], health_interval=health_interval,
+                                      retry_after=endpoint_retry_after)
+        self.timeout = timeout  # Increased to 10 minutes; the adaptive read timeout never exceeds it
+        self.connect_timeout = connect_timeout
+        self.timeouts = AdaptiveTimeout(maximum=timeout)
+        self.breaker = CircuitBreaker()
+        self.pool_connections = pool_connections  # number of per-host pools kept
+        self.pool_maxsize = pool_maxsize          # connections kept alive per host
+        self.pool_block = pool_block              # wait for a free connection instead of opening extras
+        self.keepalive_idle = keepalive_idle      # seconds before TCP keep-alive probes start
+        self.image_max_edge = image_max_edge      # long edge sent to the model; falsy sends the raw file
+        self.image_quality = image_quality        # JPEG quality of the re-encoded image
+        self.stream = stream                      # consume the token stream and emit features incrementally
+        self.keep_alive = keep_alive              # how long Ollama keeps the model loaded after a request
+        self.warmup_on_start = warmup_on_start    # load the model when a worker starts
+        self.keep_warm_interval = keep_warm_interval  # seconds between pings while work is queued; 0 disables
+        self.load_stats = ModelLoadStats(cold_load_threshold)
+        self.options = {"temperature": 0.1, "top_p": 0.9}
+        self.cache = None                         # InferenceCache, set up by init_app
         self.logger = logging.getLogger(__name__)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the client from the Flask app config (``OLLAMA_*`` keys).
+        The pooled session is rebuilt lazily on the next request.
+        """
+        config = app.config
+        store = make_store(config.get("OLLAMA_REDIS_URL"))
+        self.model = config.get("OLLAMA_MODEL", self.model)
+        self.timeout = config.get("OLLAMA_TIMEOUT", self.timeout)
+        self.endpoints = EndpointPool(
+            config.get("OLLAMA_URLS") or [config.get("OLLAMA_URL", self.endpoints.endpoints[0].generate_url)],
+            health_interval=config.get("OLLAMA_HEALTH_INTERVAL", self.endpoints.health_interval),
+            retry_after=config.get("OLLAMA_ENDPOINT_RETRY_AFTER", self.endpoints.retry_after),
+            store=store,
+            in_flight_ttl=self.timeout + 60,   # outlives the longest request
+        )
+        self.pool_connections = config.get("OLLAMA_POOL_CONNECTIONS", self.pool_connections)
+        self.pool_maxsize = config.get("OLLAMA_POOL_MAXSIZE", self.pool_maxsize)
+        self.pool_block = config.get("OLLAMA_POOL_BLOCK", self.pool_block)
+        self.keepalive_idle = config.get("OLLAMA_KEEPALIVE_IDLE", self.keepalive_idle)
+        self.image_max_edge = config.get("OLLAMA_IMAGE_MAX_EDGE", self.image_max_edge)
+        self.image_quality = config.get("OLLAMA_IMAGE_QUALITY", self.image_quality)
+        self.stream = config.get("OLLAMA_STREAM", self.stream)
+        self.keep_alive = config.get("OLLAMA_MODEL_KEEP_ALIVE", self.keep_alive)
+        self.warmup_on_start = config.get("OLLAMA_WARMUP_ON_START", self.warmup_on_start)
+        self.keep_warm_interval = config.get("OLLAMA_KEEP_WARM_INTERVAL", self.keep_warm_interval)
+        self.load_stats = ModelLoadStats(config.get("OLLAMA_COLD_LOAD_THRESHOLD", self.load_stats.cold_threshold))
+        self.connect_timeout = config.get("OLLAMA_CONNECT_TIMEOUT", self.connect_timeout)
+        self.timeouts = AdaptiveTimeout(
+            store,
+            enabled=config.get("OLLAMA_ADAPTIVE_TIMEOUT", True),
+            percentile=config.get("OLLAMA_TIMEOUT_PERCENTILE", 95),
+            multiplier=config.get("OLLAMA_TIMEOUT_MULTIPLIER", 2.0),
+            minimum=config.get("OLLAMA_TIMEOUT_MIN", 60),
+            maximum=self.timeout,
+            min_samples=config.get("OLLAMA_TIMEOUT_MIN_SAMPLES", 20),
+        )
+        self.breaker = CircuitBreaker(
+            store,
+            failure_threshold=config.get("OLLAMA_CIRCUIT_FAILURES", 5),
+            failure_window=config.get("OLLAMA_CIRCUIT_WINDOW", 60),
+            cooldown=config.get("OLLAMA_CIRCUIT_COOLDOWN", 60),
+            half_open_ttl=config.get("OLLAMA_CIRCUIT_HALF_OPEN_TTL", 3600),
+        )
+        self.cache = InferenceCache.from_config(config)
+        self.reset_session()
+        app.extensions["gemma"] = self
+
+    @property
+    def session(self) -> requests.Session:
+        """Pooled keep-alive session, created on first use in the current process."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = KeepAliveHTTPAdapter(
+            keepalive_idle=self.keepalive_idle,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
-    def analyze_disaster_image(self, image_path: str, prompt_template: str = "disaster_assessment") -> dict:
+    def reset_session(self, close: bool = True):
+        """
+        Drop the pooled session so the next request opens a fresh one.
+        Forked workers pass ``close=False``: the inherited sockets belong to the parent.
+        """
+        with self._session_lock:
+            if self._session is not None and close:
+                self._session.close()
+            self._session = None
+
+    def cache_key(self, image_path, prompt_template: str = "disaster_assessment", variant: dict = None,
+                  image_hash: str = None) -> str:
+        """
+        Content-addressed key: image bytes hash + model + prompt + generation options.
+        ``variant`` adds caller-side settings that change the result (e.g. tiling).
+        ``image_hash`` skips rehashing when the caller already has it (ImageContext).
+        """
+        return InferenceCache.make_key(
+            image_hash or hash_file(image_path),
+            self.model,
+            self._get_prompt_template(prompt_template),
+            {
+                "options": self.options,
+                "image_max_edge": self.image_max_edge,
+                "image_quality": self.image_quality,
+                **(variant or {}),
+            },
+        )
+
+    def lookup_cache(self, image_path, prompt_template: str = "disaster_assessment", variant: dict = None,
+                     image_hash: str = None):
+        """
+        Returns (cache_key, cached_response). cached_response is None on a miss;
+        both are None when caching is disabled or the image cannot be read.
+        """
+        if self.cache is None:
+            return None, None
+        try:
+            key = self.cache_key(image_path, prompt_template, variant, image_hash)
+        except OSError as e:
+            self.logger.warning(f"Could not hash {image_path} for cache lookup: {e}")
+            return None, None
+        cached = self.cache.get(key)
+        if cached is not None:
+            cached["cached"] = True
+        return key, cached
+
+    def analyze_disaster_image(self, image_path: str, prompt_template: str = "disaster_assessment",
+                               cache_key: str = None) -> dict:
         """
         Analyzes a disaster image using the Gemma model via Ollama's API.
 
         Args:
             image_path (str): The file path to the image to be analyzed.
             prompt_template (str, optional): The name of the prompt template to use.
+            cache_key (str, optional): Key from lookup_cache(). When given, the caller
+                already missed the cache, so the result is only stored.
 
         Returns:
             dict: The JSON response from the Ollama API, with validated geometry.
+                  ``image_size`` holds the original and model-input (width, height),
+                  so pixel coordinates can be mapped back to full resolution.
+        """
+        if cache_key is None:
+            cache_key, cached = self.lookup_cache(image_path, prompt_template)
+            if cached is not None:
+                self.logger.info(f"Inference cache hit for {image_path}")
+                return cached
+
+        payload, image_size, error = self._prepare_request(image_path, prompt_template, stream=False)
+        if error:
+            return error
+        return self._generate(payload, image_size, cache_key)
+
+    def analyze_image_bytes(self, image_bytes: bytes, image_size: dict,
+                            prompt_template: str = "disaster_assessment") -> dict:
+        """
+        Analyzes an already encoded image (e.g. one tile of a larger frame).
+        ``image_size`` is passed through to the response unchanged. Not cached.
+        """
+        prompt = self._get_prompt_template(prompt_template)
+        payload = self._build_payload(image_bytes, prompt, stream=False)
+        return self._generate(payload, image_size, None)
+
+    def _generate(self, payload: dict, image_size: dict, cache_key: str = None) -> dict:
+        """Posts a non-streaming generate request and parses the FeatureCollection."""
+        bucket, read_timeout = self._begin_request(image_size)
+        try:
+            with self.endpoints.acquire() as endpoint:
+                start = time.monotonic()
+                response = self.session.post(endpoint.generate_url, json=payload,
+                                             timeout=(self.connect_timeout, read_timeout))
+                response.raise_for_status()
+                response_json = response.json()
+                self._end_request(bucket, time.monotonic() - start)
+                self._record_load(response_json, time.monotonic() - start, endpoint)
+
+            if "response" in response_json:
+                parsed_json = self._parse_feature_collection(response_json["response"])
+                if parsed_json is not None:
+                    parsed_json["image_size"] = image_size
+                    if self.cache is not None and cache_key:
+                        self.cache.set(cache_key, parsed_json)
+                    self.logger.info("Successfully received and validated response from Ollama API.")
+                    return parsed_json
+
+            self.logger.info("Successfully received response from Ollama API (no structured JSON parsed).")
+            response_json["image_size"] = image_size
+            return response_json
+
+        except requests.exceptions.Timeout as e:
+            self._end_request(bucket, read_timeout, e)
+            self.logger.error(f"Ollama request timed out after {read_timeout:.0f} seconds")
+            raise
+        except requests.exceptions.ConnectionError as e:
+            self._end_request(bucket, None, e)
+            self.logger.error("Failed to connect to Ollama server")
+            raise
+        except requests.exceptions.RequestException as e:
+            self._end_request(bucket, None, e)
+            self.logger.error(f"Ollama request failed: {e}")
+            raise
+
+    def analyze_disaster_image_stream(self, image_path: str, on_feature,
+                                      prompt_template: str = "disaster_assessment",
+                                      cache_key: str = None) -> dict:
+        """
+        Streaming variant of analyze_disaster_image.
+
+        Consumes Ollama's token stream and calls ``on_feature(feature, image_size)``
+        for every validated feature as soon as its object closes. If the stream
+        breaks, the exception propagates; features already delivered stay delivered.
+
+        Returns:
+            dict: The full response, as analyze_disaster_image would return it.
         """
+        payload, image_size, error = self._prepare_request(image_path, prompt_template, stream=True)
+        if error:
+            return error
+
+        parser = FeatureStreamParser()
+        chunks = []
+        bucket, read_timeout = self._begin_request(image_size)
+        try:
+            start = time.monotonic()
+            with self.endpoints.acquire() as endpoint, \
+                    self.session.post(endpoint.generate_url, json=payload,
+                                      timeout=(self.connect_timeout, read_timeout), stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if "error" in message:
+                        raise requests.exceptions.RequestException(message["error"])
+                    text = message.get("response", "")
+                    chunks.append(text)
+                    for feature in parser.feed(text):
+                        feature = self._validate_feature(feature)
+                        if feature is not None:
+                            on_feature(feature, image_size)
+                    if message.get("done"):
+                        self._end_request(bucket, time.monotonic() - start)
+                        self._record_load(message, time.monotonic() - start, endpoint)
+                        break
+        except requests.exceptions.RequestException as e:
+            self._end_request(bucket, read_timeout if isinstance(e, requests.exceptions.Timeout) else None, e)
+            self.logger.error(f"Ollama stream broke after {parser.features_seen} features: {e}")
+            raise
+
+        response_text = "".join(chunks)
+        parsed_json = self._parse_feature_collection(response_text)
+        if parsed_json is None:
+            self.logger.info("Ollama stream finished (no structured JSON parsed).")
+            return {"response": response_text, "image_size": image_size}
+
+        parsed_json["image_size"] = image_size
+        if self.cache is not None and cache_key:
+            self.cache.set(cache_key, parsed_json)
+        self.logger.info(f"Ollama stream finished: {parser.features_seen} features.")
+        return parsed_json
+
+    def _prepare_request(self, image_path, prompt_template: str, stream: bool):
+        """Returns (payload, image_size, error); error is a failure dict or None."""
         image_path = Path(image_path)
         if not image_path.exists():
             self.logger.error(f"Image file not found: {image_path}")
-            return {"error": f"Image file not found: {image_path}", "status": "failed"}
+            return None, None, {"error": f"Image file not found: {image_path}", "status": "failed"}
         if not image_path.is_file():
             self.logger.error(f"Path is not a file: {image_path}")
-            return {"error": f"Path is not a file: {image_path}", "status": "failed"}
+            return None, None, {"error": f"Path is not a file: {image_path}", "status": "failed"}
 
         try:
-            with open(image_path, "rb") as f:
-                image_data = base64.b64encode(f.read()).decode("utf-8")
-        except IOError as e:
+            image_bytes, original_size, model_size = self._load_image(image_path)
+        except (IOError, OSError) as e:
             self.logger.error(f"Error reading image file {image_path}: {e}")
-            return {"error": f"Error reading image file: {e}", "status": "failed"}
+            return None, None, {"error": f"Error reading image file: {e}", "status": "failed"}
 
         prompt = self._get_prompt_template(prompt_template)
         if not prompt:
             self.logger.error(f"Prompt template '{prompt_template}' not found.")
-            return {"error": f"Prompt template '{prompt_template}' not found.", "status": "failed"}
+            return None, None, {"error": f"Prompt template '{prompt_template}' not found.", "status": "failed"}
+
+        payload = self._build_payload(image_bytes, prompt, stream)
+        image_size = {"original": list(original_size), "model": list(model_size)}
+        return payload, image_size, None
 
-        payload = {
+    def _build_payload(self, image_bytes: bytes, prompt: str, stream: bool) -> dict:
+        return {
             "model": self.model,
             "prompt": prompt,
-            "images": [image_data],
-            "stream": False,
-            "options": {
-                "temperature": 0.1,
-                "top_p": 0.9
-            }
+            "images": [base64.b64encode(image_bytes).decode("utf-8")],
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": self.options
         }
 
-        try:
-            response = requests.post(self.ollama_url, json=payload, timeout=self.timeout)
-            response.raise_for_status()
-            response_json = response.json()
+    def _begin_request(self, image_size: dict):
+        """
+        Fails fast with CircuitOpenError while the breaker is open.
+        Returns (latency bucket, read timeout) for the request.
+        """
+        bucket = self.timeouts.bucket(self.model, image_size)
+        read_timeout = self.timeouts.timeout_for(bucket)
+        self.breaker.check(trial_timeout=read_timeout)
+        return bucket, read_timeout
 
-            if "response" in response_json:
-                response_text = response_json["response"]
-                # Attempt to extract JSON
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_text = response_text[start_idx:end_idx]
-                    try:
-                        parsed_json = json.loads(json_text)
-                        # Validate geometries
-                        parsed_json["features"] = [
-                            self._validate_feature(f) for f in parsed_json.get("features", [])
-                        ]
-                        self.logger.info("Successfully received and validated response from Ollama API.")
-                        return parsed_json
-                    except json.JSONDecodeError:
-                        self.logger.warning("Could not parse JSON from model response. Returning raw text.")
+    def _end_request(self, bucket: str, latency: float = None, error=None):
+        """Feeds the outcome of a request to the adaptive timeout and the circuit breaker."""
+        if latency is not None:
+            self.timeouts.observe(bucket, latency)
+        if error is None:
+            self.breaker.record_success()
+        elif is_backend_failure(error):
+            self.breaker.record_failure()
 
-            self.logger.info("Successfully received response from Ollama API (no structured JSON parsed).")
-            return response_json
+    def _record_load(self, response_json: dict, latency: float, endpoint):
+        if self.load_stats.record(response_json, latency):
+            load_seconds = (response_json.get("load_duration") or 0) / 1e9
+            self.logger.warning(f"Cold model load on {endpoint.base_url}: {load_seconds:.1f}s "
+                                f"of a {latency:.1f}s request")
 
-        except requests.exceptions.Timeout:
-            self.logger.error(f"Ollama request timed out after {self.timeout} seconds")
-            raise
-        except requests.exceptions.ConnectionError:
-            self.logger.error("Failed to connect to Ollama server")
-            raise
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f"Ollama request failed: {e}")
-            raise
+    def warm_up(self):
+        """
+        Loads the model on every endpoint with an empty generate call, so the
+        first real image does not pay the load. Also refreshes ``keep_alive``.
+        """
+        payload = {"model": self.model, "prompt": "", "stream": False, "keep_alive": self.keep_alive}
+        for endpoint in self.endpoints.endpoints:
+            start = time.monotonic()
+            try:
+                response = self.session.post(endpoint.generate_url, json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                cold = self.load_stats.record(response.json(), time.monotonic() - start)
+            except requests.exceptions.RequestException as e:
+                self.logger.warning(f"Warm-up of {self.model} on {endpoint.base_url} failed: {e}")
+                continue
+            self.logger.info(f"Warm-up of {self.model} on {endpoint.base_url}: {time.monotonic() - start:.1f}s "
+                             f"({'cold load' if cold else 'already loaded'})")
+
+    def start_keep_warm(self, has_pending_work, interval: float = None):
+        """
+        Starts a daemon thread that calls warm_up() every ``interval`` seconds
+        while ``has_pending_work()`` is true, so queued batches never hit an unloaded model.
+        """
+        interval = interval or self.keep_warm_interval
+        if not interval:
+            return None
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if has_pending_work():
+                        self.warm_up()
+                except Exception as e:
+                    self.logger.error(f"Keep-warm ping failed: {e}")
+
+        thread = threading.Thread(target=loop, name="ollama-keep-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def _parse_feature_collection(self, response_text: str):
+        """Extracts the FeatureCollection from model text; None if it cannot be parsed."""
+        repairs = []
+        parsed_json = extract_feature_collection(response_text, repairs)
+        if parsed_json is None:
+            self.logger.warning("Could not parse JSON from model response. Returning raw text.")
+            return None
+        if repairs:
+            self.logger.warning(f"Repaired malformed model JSON: {', '.join(repairs)}")
+        # Validate geometries
+        parsed_json["features"] = [
+            self._validate_feature(f) for f in parsed_json.get("features", [])
+        ]
+        return parsed_json
+
+    def _load_image(self, image_path: Path):
+        """
+        Returns (image_bytes, original_size, model_size) for the model input.
+        Downscales with draft-mode decoding unless image_max_edge is disabled.
+        """
+        # PIL is loaded by the first inference, not when the app starts
+        from PIL import Image
+        from .metadata_process import prepare_image_for_inference
+        if self.image_max_edge:
+            return prepare_image_for_inference(image_path, self.image_max_edge, self.image_quality)
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            size = img.size
+        return image_bytes, size, size
 
     def _validate_feature(self, feature):
         """
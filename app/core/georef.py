@@ -0,0 +1,165 @@
+# app/core/georef.py
+import itertools
+import logging
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320.0
+
+# Fallbacks when EXIF lacks intrinsics (the original hardcoded survey setup)
+FLIGHT_ALTITUDE_M = 120
+SENSOR_WIDTH_MM = 6.3
+FOCAL_LENGTH_MM = 4.73
+REFERENCE_WIDTH_PX = 4000
+FILM_35MM_WIDTH_MM = 36.0
+
+
+@dataclass(frozen=True)
+class CameraModel:
+    """Ground sample distance of one camera: full-resolution metres per pixel at flight altitude."""
+    meters_per_pixel: float
+    source: str                 # "exif_35mm", "exif_focal" or "default"
+
+
+@lru_cache(maxsize=64)
+def camera_model(make=None, model=None, focal_length_mm=None, focal_length_35mm=None, width=None,
+                 altitude_m=FLIGHT_ALTITUDE_M) -> CameraModel:
+    """
+    Per-camera model from EXIF intrinsics, cached by camera and frame width.
+    - 35mm-equivalent focal length: the sensor width follows from the 36 mm film frame.
+    - Focal length only: the default sensor width is assumed.
+    - Neither: the original constants (6.3 mm sensor, 4.73 mm lens, 4000 px frame).
+    Altitude is the flight altitude above ground, not EXIF GPSAltitude (sea level).
+    """
+    if focal_length_35mm and width:
+        return CameraModel(FILM_35MM_WIDTH_MM * altitude_m / (focal_length_35mm * width), "exif_35mm")
+    if focal_length_mm and width:
+        return CameraModel(SENSOR_WIDTH_MM * altitude_m / (focal_length_mm * width), "exif_focal")
+    return CameraModel(SENSOR_WIDTH_MM * altitude_m / (FOCAL_LENGTH_MM * REFERENCE_WIDTH_PX), "default")
+
+
+def camera_for(image, altitude_m=FLIGHT_ALTITUDE_M) -> CameraModel:
+    """CameraModel for an ImageContext (None gives the defaults)."""
+    if image is None:
+        return camera_model(altitude_m=altitude_m)
+    return camera_model(image.make, image.model, image.focal_length_mm, image.focal_length_35mm,
+                        image.size[0], altitude_m)
+
+
+@dataclass(frozen=True)
+class GeoAffine:
+    """lon = lon_scale * x + lon_offset, lat = lat_scale * y + lat_offset, for model pixel (x, y)."""
+    lon_scale: float
+    lon_offset: float
+    lat_scale: float
+    lat_offset: float
+
+    @classmethod
+    def for_image(cls, camera: CameraModel, image_size, center_lat, center_lon, model_size=None):
+        """
+        Composes model-pixel -> full-resolution pixel -> metres from the frame
+        center -> degrees around (center_lat, center_lon) into one affine map.
+        """
+        width, height = image_size
+        scale_x = width / float(model_size[0]) if model_size else 1.0
+        scale_y = height / float(model_size[1]) if model_size else 1.0
+        m_lon = camera.meters_per_pixel / (METERS_PER_DEGREE * math.cos(math.radians(center_lat)))
+        m_lat = camera.meters_per_pixel / METERS_PER_DEGREE
+        return cls(
+            lon_scale=scale_x * m_lon,
+            lon_offset=center_lon - width / 2 * m_lon,
+            lat_scale=scale_y * m_lat,
+            lat_offset=center_lat - height / 2 * m_lat,
+        )
+
+    def apply(self, points: np.ndarray) -> np.ndarray:
+        """Transforms an (N, 2) array of pixel coordinates in one operation."""
+        out = np.empty_like(points)
+        np.multiply(points[:, 0], self.lon_scale, out=out[:, 0])
+        out[:, 0] += self.lon_offset
+        np.multiply(points[:, 1], self.lat_scale, out=out[:, 1])
+        out[:, 1] += self.lat_offset
+        return out
+
+
+def _ring_points(ring):
+    """Coordinate pairs of one ring as floats; short pairs are dropped, z values ignored."""
+    return [[float(pair[0]), float(pair[1])] for pair in ring if len(pair) >= 2]
+
+
+def georeference_rings(coords_list, affine: GeoAffine):
+    """
+    Transforms the polygon rings of many features at once.
+
+    ``coords_list`` holds one GeoJSON Polygon ``coordinates`` value (a list of
+    rings) per feature. All vertices are stacked into one array, transformed
+    by ``affine`` in a single NumPy operation and split back per ring. Rings
+    come back as (N, 2) arrays; serialize them with dumps_rings(). Entries
+    that are not lists of rings of pairs come back as None.
+    """
+    flat, layout = [], []
+    for coords in coords_list:
+        if not isinstance(coords, list) or not all(
+                isinstance(ring, list) and (not ring or isinstance(ring[0], (list, tuple))) for ring in coords):
+            layout.append(None)
+            continue
+        layout.append([len(ring) for ring in coords])
+        for ring in coords:
+            flat.extend(ring)
+
+    try:
+        if flat and set(map(len, flat)) != {2}:
+            raise ValueError("vertices that are not (x, y) pairs")
+        points = np.fromiter(itertools.chain.from_iterable(flat), dtype=np.float64, count=2 * len(flat))
+    except (TypeError, ValueError):
+        # Short, 3D or non-numeric vertices somewhere: clean each feature on its own
+        return [_georeference_one(coords, affine) if rings is not None else None
+                for coords, rings in zip(coords_list, layout)]
+    return _split(affine.apply(points.reshape(-1, 2)), layout)
+
+
+def dumps_rings(rings) -> str:
+    """JSON for georeferenced rings, serializing the arrays without converting them to lists."""
+    return orjson.dumps(rings, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+
+def rings_bbox(rings):
+    """(minx, miny, maxx, maxy) of georeferenced rings, None when they hold no finite point."""
+    try:
+        points = np.concatenate([np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings])
+    except (TypeError, ValueError):
+        return None
+    if not len(points) or not np.isfinite(points).all():
+        return None
+    (minx, miny), (maxx, maxy) = points.min(axis=0), points.max(axis=0)
+    return float(minx), float(miny), float(maxx), float(maxy)
+
+
+def _georeference_one(coords, affine):
+    try:
+        rings = [_ring_points(ring) for ring in coords]
+    except (TypeError, ValueError, IndexError) as e:
+        logger.error(f"Unreadable model coordinates: {e}")
+        return None
+    points = np.asarray([pair for ring in rings for pair in ring], dtype=np.float64).reshape(-1, 2)
+    return _split(affine.apply(points), [[len(ring) for ring in rings]])[0]
+
+
+def _split(transformed, layout):
+    results, pos = [], 0
+    for rings in layout:
+        if rings is None:
+            results.append(None)
+            continue
+        feature_rings = []
+        for count in rings:
+            feature_rings.append(transformed[pos:pos + count])
+            pos += count
+        results.append(feature_rings)
+    return results
@@ -0,0 +1,124 @@
+# app/core/image_context.py
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, replace
+
+from PIL import Image
+
+from .inference_cache import hash_file
+from .metadata_process import get_exif_data, extract_lat_lon
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_SIZE = 256  # images kept per process
+
+
+def _ratio(value):
+    """EXIF rational (IFDRational or (num, den) tuple) as float, or None."""
+    try:
+        if isinstance(value, tuple):
+            return float(value[0]) / float(value[1]) if value[1] else None
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+@dataclass
+class ImageContext:
+    """
+    Everything the pipeline needs to know about one image, read once from its
+    header: pixel size, decoded EXIF, GPS position and camera fields.
+    Passed from stage to stage instead of reopening the file.
+    """
+    path: str
+    content_hash: str
+    size: tuple                             # (width, height) of the full-resolution frame
+    lat: float = None
+    lon: float = None
+    altitude_m: float = None                # GPSAltitude, metres (negative below sea level)
+    focal_length_mm: float = None
+    focal_length_35mm: float = None
+    make: str = None
+    model: str = None
+    exif: dict = field(default=None, repr=False, compare=False)  # decoded tags; not serialized
+
+    @classmethod
+    def from_path(cls, path, content_hash=None):
+        """Builds the context from a single header read (pixels are never decoded)."""
+        with Image.open(path) as image:
+            size = image.size
+            try:
+                exif = get_exif_data(image)
+            except Exception as e:
+                logger.warning(f"Could not read EXIF from {path}: {e}")
+                exif = {}
+        lat, lon = extract_lat_lon(exif)
+        gps = exif.get("GPSInfo") or {}
+        altitude = _ratio(gps.get(6))
+        if altitude is not None and gps.get(5) in (1, b"\x01"):
+            altitude = -altitude
+        return cls(
+            path=str(path),
+            content_hash=content_hash or hash_file(path),
+            size=tuple(size),
+            lat=lat,
+            lon=lon,
+            altitude_m=altitude,
+            focal_length_mm=_ratio(exif.get("FocalLength")),
+            focal_length_35mm=_ratio(exif.get("FocalLengthIn35mmFilm")),
+            make=str(exif["Make"]).strip("\x00 ") if exif.get("Make") else None,
+            model=str(exif["Model"]).strip("\x00 ") if exif.get("Model") else None,
+            exif=exif,
+        )
+
+    @property
+    def has_gps(self) -> bool:
+        return self.lat is not None and self.lon is not None
+
+    def to_dict(self) -> dict:
+        """JSON-safe form for Celery messages (raw EXIF left out)."""
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "exif"}
+        data["size"] = list(self.size)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**{**data, "size": tuple(data["size"])})
+
+
+_contexts = OrderedDict()   # content hash -> ImageContext
+_hashes = {}                # (path, mtime_ns, size) -> content hash
+_lock = threading.Lock()
+
+
+def load_image_context(path) -> ImageContext:
+    """
+    ImageContext for ``path``, cached by content hash. A retry for an unchanged
+    file (same path, size and mtime) neither rehashes nor reopens it.
+    """
+    path = str(path)
+    stat = os.stat(path)
+    file_key = (path, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        content_hash = _hashes.get(file_key)
+    if content_hash is None:
+        content_hash = hash_file(path)
+
+    with _lock:
+        context = _contexts.get(content_hash)
+    if context is None:
+        context = ImageContext.from_path(path, content_hash)
+    elif context.path != path:
+        context = replace(context, path=path)  # same bytes uploaded under another name
+
+    with _lock:
+        _hashes[file_key] = content_hash
+        _contexts[content_hash] = context
+        _contexts.move_to_end(content_hash)
+        while len(_contexts) > CONTEXT_CACHE_SIZE:
+            _contexts.popitem(last=False)
+        if len(_hashes) > CONTEXT_CACHE_SIZE * 4:
+            _hashes.clear()
+    return context
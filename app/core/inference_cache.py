@@ -0,0 +1,186 @@
+# app/core/inference_cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE) -> str:
+    """SHA-256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    """
+    Content-addressed cache of parsed Gemma responses.
+    - Disk tier: one JSON file per key, evicted least-recently-used once the
+      directory grows past max_bytes (file mtime is bumped on every hit).
+    - Redis tier (optional): shared between workers, entries expire after ttl.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, redis_url=None, ttl=7 * 24 * 3600,
+                 namespace="gemma:cache"):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.namespace = namespace
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._counters = {"hits": 0, "misses": 0, "disk_hits": 0, "redis_hits": 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a cache from INFERENCE_CACHE_* config keys, or None when disabled."""
+        if not config.get("INFERENCE_CACHE_ENABLED", True) or not config.get("INFERENCE_CACHE_DIR"):
+            return None
+        return cls(
+            config["INFERENCE_CACHE_DIR"],
+            max_bytes=config.get("INFERENCE_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+            redis_url=config.get("INFERENCE_CACHE_REDIS_URL"),
+            ttl=config.get("INFERENCE_CACHE_TTL", 7 * 24 * 3600),
+        )
+
+    @staticmethod
+    def make_key(image_hash: str, model: str, prompt: str, options: dict) -> str:
+        """Key = image bytes hash + model + prompt text + generation/preprocessing options."""
+        digest = hashlib.sha256()
+        digest.update(image_hash.encode("utf-8"))
+        digest.update(b"\0" + model.encode("utf-8"))
+        digest.update(b"\0" + prompt.encode("utf-8"))
+        digest.update(b"\0" + json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                for name in names:
+                    pipe.hincrby(f"{self.namespace}:stats", name, 1)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Could not update shared cache counters: {e}")
+
+    def get(self, key: str):
+        """Returns the cached response dict, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+            self._count("hits", "disk_hits")
+            return value
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path.name}: {e}")
+            path.unlink(missing_ok=True)
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f"Redis cache lookup failed: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._write_disk(key, raw if isinstance(raw, str) else raw.decode("utf-8"))
+                self._count("hits", "redis_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: dict):
+        """Stores a response in the disk tier (and Redis when configured)."""
+        raw = json.dumps(value)
+        self._write_disk(key, raw)
+        if self.redis is not None:
+            try:
+                self.redis.set(self._redis_key(key), raw, ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Redis cache store failed: {e}")
+
+    def _write_disk(self, key: str, raw: str):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(raw)
+            os.replace(tmp_path, path)  # atomic, readers never see partial files
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {path.name}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Removes least-recently-used entries until the disk tier fits max_bytes."""
+        if not self.max_bytes:
+            return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        """Hit/miss counters (shared across workers when Redis is configured) and disk usage."""
+        with self._lock:
+            counters = dict(self._counters)
+        if self.redis is not None:
+            try:
+                shared = self.redis.hgetall(f"{self.namespace}:stats")
+                counters = {name: int(shared.get(name.encode(), 0)) for name in counters}
+            except Exception as e:
+                logger.warning(f"Could not read shared cache counters: {e}")
+        entries = self._entries()
+        lookups = counters["hits"] + counters["misses"]
+        counters.update({
+            "hit_ratio": counters["hits"] / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "redis": self.redis is not None,
+        })
+        return counters
@@ -0,0 +1,203 @@
+# app/core/json_extract.py
+import logging
+import re
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Characters that matter outside strings, and inside them
+_STRUCTURAL = re.compile(r'["{}\[\],/]')
+_STRING_END = re.compile(r'["\\]')
+_WHITESPACE = re.compile(r"\s*")
+_CLOSERS = {"{": "}", "[": "]"}
+_MAX_RESCANS = 3
+
+
+class _Candidate:
+    """One top-level {...} object found in the text, plus what is needed to repair it."""
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None             # index after the closing brace; None when truncated
+        self.has_features = False
+        self.drops = []             # (start, end) ranges to remove: trailing commas, comments
+        self.safe_cut = None        # index after the last complete feature
+        self.safe_stack = None      # containers still open at safe_cut
+
+
+def _scan(text, pos):
+    """
+    Single pass over text from pos: matches braces while skipping strings,
+    records root objects, the "features" array, trailing commas and comments.
+    """
+    candidates = []
+    stack = []
+    current = None
+    key_start = None            # start of the last string read at root level
+    last_string = None
+    features_level = None
+    length = len(text)
+
+    while True:
+        match = _STRUCTURAL.search(text, pos)
+        if match is None:
+            break
+        i = match.start()
+        ch = text[i]
+        pos = i + 1
+
+        if ch == '"':
+            if not stack:
+                continue
+            # Jump to the closing quote, honouring escapes
+            j = pos
+            while True:
+                m = _STRING_END.search(text, j)
+                if m is None:
+                    j = length
+                    break
+                if text[m.start()] == "\\":
+                    j = m.start() + 2
+                    continue
+                j = m.start()
+                break
+            if len(stack) == 1:
+                last_string = text[pos:j]
+                key_start = i
+            pos = j + 1
+            continue
+
+        if not stack:
+            if ch == "{":
+                current = _Candidate(i)
+                stack.append("{")
+                last_string = None
+                features_level = None
+            continue
+
+        if ch == "{" or ch == "[":
+            if (ch == "[" and len(stack) == 1 and last_string == "features"
+                    and text[key_start:i].rstrip().endswith(":")):
+                features_level = 2
+                current.has_features = True
+            stack.append(ch)
+        elif ch == "}" or ch == "]":
+            stack.pop()
+            if features_level is not None and len(stack) == features_level and ch == "}":
+                current.safe_cut = pos
+                current.safe_stack = list(stack)
+            elif features_level is not None and len(stack) < features_level:
+                features_level = None
+            if not stack:
+                current.end = pos
+                candidates.append(current)
+                current = None
+        elif ch == ",":
+            # Trailing comma: "...}, ]" or "..., }", possibly with a comment in between
+            ws = _WHITESPACE.match(text, pos).end()
+            while text.startswith("//", ws):
+                newline = text.find("\n", ws)
+                ws = length if newline == -1 else _WHITESPACE.match(text, newline).end()
+            if ws < length and text[ws] in "}]":
+                current.drops.append((i, pos))
+        elif ch == "/":
+            if text.startswith("//", i):
+                newline = text.find("\n", i)
+                end = length if newline == -1 else newline
+                current.drops.append((i, end))
+                pos = end
+
+    if current is not None:
+        candidates.append(current)  # truncated: never closed
+    return candidates
+
+
+def _assemble(text, start, end, drops):
+    if not drops:
+        return text[start:end]
+    parts, pos = [], start
+    for a, b in drops:
+        if a >= end:
+            break
+        parts.append(text[pos:a])
+        pos = b
+    parts.append(text[pos:end])
+    return "".join(parts)
+
+
+def _loads(raw):
+    try:
+        value = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _repair(text, candidate, repairs):
+    """Parses a candidate, applying comma/comment cleanup and truncation repair as needed."""
+    if candidate.end is not None:
+        value = _loads(text[candidate.start:candidate.end])
+        if value is not None:
+            return value
+        if candidate.drops:
+            value = _loads(_assemble(text, candidate.start, candidate.end, candidate.drops))
+            if value is not None:
+                repairs.append("trailing_commas_or_comments")
+                return value
+
+    # Truncated or otherwise broken: keep every feature that closed cleanly
+    if candidate.safe_cut is None:
+        return None
+    closers = "".join(_CLOSERS[c] for c in reversed(candidate.safe_stack))
+    raw = _assemble(text, candidate.start, candidate.safe_cut, candidate.drops) + closers
+    value = _loads(raw)
+    if value is not None:
+        repairs.append("truncated")
+    return value
+
+
+def extract_feature_collection(text: str, repairs: list = None):
+    """
+    Finds and parses the FeatureCollection in raw model output.
+
+    Tolerates markdown fences and surrounding prose, braces inside strings,
+    stray braces before the JSON, trailing commas, ``//`` comments and a
+    truncated final feature (the complete features before it are kept).
+    When several FeatureCollections appear (e.g. the prompt example echoed
+    back before the answer), the last parseable one wins. Repairs that were
+    needed are appended to ``repairs`` when given.
+
+    Returns:
+        dict or None: The parsed object with a ``features`` list, or None.
+    """
+    if repairs is None:
+        repairs = []
+    if not text:
+        return None
+
+    # Fast path: well-formed output, possibly fenced, parses in one orjson call
+    start_idx = text.find("{")
+    end_idx = text.rfind("}") + 1
+    if start_idx != -1 and end_idx > start_idx:
+        value = _loads(text[start_idx:end_idx])
+        if value is not None and isinstance(value.get("features"), list):
+            return value
+
+    pos = 0
+    for _ in range(_MAX_RESCANS):
+        candidates = _scan(text, pos)
+        # The answer follows any echoed prompt example, so try the last one first
+        for candidate in reversed(candidates):
+            if not candidate.has_features:
+                continue
+            value = _repair(text, candidate, repairs)
+            if value is not None and isinstance(value.get("features"), list):
+                return value
+        # A stray unmatched "{" swallows the real object; retry after it
+        unclosed = [c for c in candidates if c.end is None]
+        if not unclosed:
+            break
+        pos = unclosed[0].start + 1
+        repairs.append("stray_brace")
+    return None
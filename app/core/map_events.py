@@ -0,0 +1,108 @@
+# app/core/map_events.py
+import logging
+import queue
+import threading
+import time
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: str, data) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode('utf-8')}\n\n"
+
+
+class _LocalChannel:
+    """In-process fan-out standing in for Redis pub/sub (dev server with eager Celery only)."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message: bytes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            q.put(message)
+
+    def listen(self, timeout):
+        q = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.add(q)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=timeout)
+                except queue.Empty:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
+
+
+class _RedisChannel:
+    def __init__(self, redis_url, channel):
+        import redis
+        self.redis = redis.Redis.from_url(redis_url, socket_connect_timeout=2)
+        self.channel = channel
+
+    def publish(self, message: bytes):
+        self.redis.publish(self.channel, message)
+
+    def listen(self, timeout):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            while True:
+                message = pubsub.get_message(timeout=timeout)
+                yield message["data"] if message else None
+        finally:
+            pubsub.close()
+
+
+class MapEventBus:
+    """
+    Live map updates: workers publish batch progress and newly added features
+    on one Redis pub/sub channel; every open SSE connection subscribes to it.
+    Publishing never fails a task; subscribers that miss events (e.g. while
+    reconnecting) reload the full layer from /api/polygons.
+    """
+
+    def __init__(self, redis_url=None, channel="map:events", heartbeat=15):
+        self.bus = _RedisChannel(redis_url, channel) if redis_url else _LocalChannel()
+        self.channel = channel
+        self.heartbeat = heartbeat      # seconds between keep-alive comments on idle streams
+
+    def init_app(self, app):
+        """Configure from ``MAP_EVENTS_*`` keys."""
+        config = app.config
+        self.channel = config.get("MAP_EVENTS_CHANNEL", self.channel)
+        redis_url = config.get("MAP_EVENTS_REDIS_URL")
+        self.bus = _RedisChannel(redis_url, self.channel) if redis_url else _LocalChannel()
+        self.heartbeat = config.get("MAP_EVENTS_HEARTBEAT", self.heartbeat)
+
+    def publish(self, event: str, data: dict):
+        try:
+            self.bus.publish(orjson.dumps({"event": event, "data": data}))
+        except Exception as e:
+            logger.warning(f"Could not publish map event '{event}': {e}")
+
+    def stream(self, batch_id=None):
+        """
+        SSE text for one client: every event (or only ``batch_id``'s), with a
+        comment line after ``heartbeat`` idle seconds so proxies keep it open.
+        """
+        yield f"retry: 5000\n: connected {time.time():.0f}\n\n"
+        for raw in self.bus.listen(self.heartbeat):
+            if raw is None:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                message = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                continue
+            if batch_id and message["data"].get("batch_id") != batch_id:
+                continue
+            yield format_sse(message["event"], message["data"])
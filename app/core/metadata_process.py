@@ -1,5 +1,6 @@
 # app/core/metadata_process.py
 from PIL import Image, ExifTags
+import io
 import json
 import math
 import os
@@ -66,6 +67,49 @@ def create_circle_polygon(lat, lon, radius=50, points=36):
     coords.append(coords[0])
     return coords
 
+def resize_image(image, size):
+    """Resizes image to (width, height) with LANCZOS resampling."""
+    try:
+        # Pillow >= 10
+        return image.resize(size, Image.Resampling.LANCZOS)
+    except AttributeError:
+        # Pillow < 10 fallback
+        return image.resize(size, Image.ANTIALIAS)
+
+
+def fit_long_edge(size, max_edge):
+    """Returns (width, height) scaled down so the long edge is at most max_edge, keeping aspect."""
+    width, height = size
+    long_edge = max(width, height)
+    if not max_edge or long_edge <= max_edge:
+        return width, height
+    scale = max_edge / long_edge
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image_for_inference(image_path, max_edge=1024, quality=85):
+    """
+    Decodes an image at reduced scale and re-encodes it as JPEG for the model.
+    - JPEGs are decoded with draft mode (DCT scaling), so a 4000px frame is
+      never fully materialized in memory.
+    - The long edge is capped at max_edge, then re-encoded at the given quality.
+    Returns (jpeg_bytes, original_size, model_size); sizes are (width, height).
+    """
+    with Image.open(image_path) as image:
+        original_size = image.size
+        target_size = fit_long_edge(original_size, max_edge)
+        if image.format == "JPEG" and target_size != original_size:
+            # Picks the largest 1/2, 1/4, 1/8 scale that still covers target_size
+            image.draft("RGB", target_size)
+        image = image.convert("RGB")
+        if image.size != target_size:
+            image = resize_image(image, target_size)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), original_size, image.size
+
+
 def process_image(image_path):
     """
     - Reads EXIF GPS, resizes image to 512px width, keeps aspect.
@@ -81,12 +125,7 @@ def process_image(image_path):
 
     width = 512
     height = int(image.size[1] * (512 / image.size[0]))
-    try:
-        # Pillow >= 10
-        image = image.resize((width, height), Image.Resampling.LANCZOS)
-    except AttributeError:
-        # Pillow < 10 fallback
-        image = image.resize((width, height), Image.ANTIALIAS)
+    image = resize_image(image, (width, height))
 
     polygon = create_circle_polygon(lat, lon)
     feature = {
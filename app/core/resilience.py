@@ -0,0 +1,318 @@
+# app/core/resilience.py
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Errors that say the Ollama backend itself is unhealthy (not a bad image or a parse failure)
+BACKEND_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                  httpx.TimeoutException, httpx.ConnectError)
+
+
+def is_backend_failure(error) -> bool:
+    """Timeouts, refused connections and 5xx answers count towards the circuit breaker."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, BACKEND_ERRORS):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code >= 500
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling Ollama while the circuit breaker is open."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Ollama circuit breaker open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class _LocalStore:
+    """In-process stand-in for the few Redis commands used below (one worker process only)."""
+
+    def __init__(self):
+        self._values = {}
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        value, expires = self._values.get(key, (None, None))
+        if expires is not None and expires <= now:
+            del self._values[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key, value, ttl=None, nx=False):
+        with self._lock:
+            now = time.time()
+            if nx and self._live(key, now) is not None:
+                return False
+            self._values[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def incr(self, key, ttl):
+        """Increments a counter; the expiry is set when the counter is created."""
+        with self._lock:
+            now = time.time()
+            value = self._live(key, now)
+            if value is None:
+                self._values[key] = (1, now + ttl)
+                return 1
+            self._values[key] = (value + 1, self._values[key][1])
+            return value + 1
+
+    def add(self, key, amount, ttl):
+        """Adds ``amount`` to a counter and restarts its expiry."""
+        with self._lock:
+            now = time.time()
+            value = (self._live(key, now) or 0) + amount
+            self._values[key] = (value, now + ttl)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def push(self, key, value, maxlen):
+        with self._lock:
+            self._lists.setdefault(key, deque(maxlen=maxlen)).appendleft(value)
+
+    def items(self, key):
+        with self._lock:
+            return list(self._lists.get(key, ()))
+
+
+class _RedisStore:
+    """The same commands against Redis, so every worker shares the state."""
+
+    def __init__(self, redis_url):
+        import redis
+        self.redis = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, key):
+        value = self.redis.get(key)
+        return None if value is None else float(value)
+
+    def set(self, key, value, ttl=None, nx=False):
+        return bool(self.redis.set(key, value, ex=int(math.ceil(ttl)) if ttl else None, nx=nx))
+
+    def incr(self, key, ttl):
+        value = self.redis.incr(key)
+        if value == 1:
+            self.redis.expire(key, int(math.ceil(ttl)))
+        return value
+
+    def add(self, key, amount, ttl):
+        pipe = self.redis.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, int(math.ceil(ttl)))
+        return pipe.execute()[0]
+
+    def delete(self, *keys):
+        self.redis.delete(*keys)
+
+    def push(self, key, value, maxlen):
+        pipe = self.redis.pipeline()
+        pipe.lpush(key, value)
+        pipe.ltrim(key, 0, maxlen - 1)
+        pipe.execute()
+
+    def items(self, key):
+        return [float(v) for v in self.redis.lrange(key, 0, -1)]
+
+
+def make_store(redis_url=None):
+    return _RedisStore(redis_url) if redis_url else _LocalStore()
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around Ollama, shared by all workers when backed by Redis.
+    - closed: requests flow; ``failure_threshold`` backend failures within
+      ``failure_window`` seconds open the circuit.
+    - open: requests fail fast with CircuitOpenError for ``cooldown`` seconds.
+    - half-open: after the cooldown one trial request is let through; success
+      closes the circuit, failure opens it again. A circuit left half-open for
+      ``half_open_ttl`` seconds without a verdict closes on its own.
+    Redis errors fail open: a broken Redis must not stop inference.
+    """
+
+    def __init__(self, store=None, failure_threshold=5, failure_window=60, cooldown=60, half_open_ttl=3600,
+                 namespace="gemma:circuit"):
+        self.store = store or _LocalStore()
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.cooldown = cooldown
+        self.half_open_ttl = half_open_ttl
+        self._failures = f"{namespace}:failures"
+        self._open_until = f"{namespace}:open_until"
+        self._tripped = f"{namespace}:tripped"
+        self._trial = f"{namespace}:trial"
+
+    def state(self) -> str:
+        try:
+            if self.store.get(self._open_until) is not None:
+                return "open"
+            return "half_open" if self.store.get(self._tripped) is not None else "closed"
+        except Exception as e:
+            logger.warning(f"Circuit breaker state unavailable, assuming closed: {e}")
+            return "closed"
+
+    def retry_in(self) -> float:
+        """Seconds until the circuit may let a request through again."""
+        try:
+            open_until = self.store.get(self._open_until)
+        except Exception:
+            return 0.0
+        return max(0.0, open_until - time.time()) if open_until is not None else 0.0
+
+    def check(self, trial_timeout: float = 600, claim: bool = True):
+        """
+        Raises CircuitOpenError unless this request may go to Ollama. When
+        half-open, the caller that gets through holds the one trial; with
+        ``claim=False`` (a fail-fast check ahead of the request itself) the
+        trial is only looked at, so the request that follows can still take it.
+        """
+        state = self.state()
+        if state == "closed":
+            return
+        if state == "half_open":
+            try:
+                if not claim:
+                    if self.store.get(self._trial) is None:
+                        return
+                elif self.store.set(self._trial, 1, ttl=trial_timeout, nx=True):
+                    logger.info("Ollama circuit half-open: sending a trial request")
+                    return
+            except Exception:
+                return
+        raise CircuitOpenError(self.retry_in() or self.cooldown)
+
+    def record_success(self):
+        try:
+            if self.store.get(self._tripped) is not None:
+                logger.info("Ollama circuit closed")
+            self.store.delete(self._failures, self._tripped, self._trial)
+        except Exception as e:
+            logger.warning(f"Circuit breaker update failed: {e}")
+
+    def record_failure(self):
+        try:
+            half_open = self.store.get(self._tripped) is not None and self.store.get(self._open_until) is None
+            failures = self.store.incr(self._failures, self.failure_window)
+            if half_open or failures >= self.failure_threshold:
+                self.trip()
+        except Exception as e:
+            logger.warning(f"Circuit breaker update failed: {e}")
+
+    def trip(self):
+        """Opens the circuit for ``cooldown`` seconds."""
+        self.store.set(self._open_until, time.time() + self.cooldown, ttl=self.cooldown)
+        # Backstop: a trial whose outcome is never recorded must not keep the circuit half-open forever
+        self.store.set(self._tripped, 1, ttl=self.cooldown + self.half_open_ttl)
+        self.store.delete(self._failures, self._trial)
+        logger.warning(f"Ollama circuit opened for {self.cooldown}s")
+
+    def watch(self, on_change, interval=5):
+        """
+        Starts a daemon thread calling ``on_change(is_open)`` whenever the circuit
+        opens or stops being open (used to pause and resume queue consumption).
+        """
+        def loop():
+            was_open = False
+            while True:
+                time.sleep(interval)
+                is_open = self.state() == "open"
+                if is_open != was_open:
+                    try:
+                        on_change(is_open)
+                    except Exception as e:
+                        logger.error(f"Circuit breaker watcher failed: {e}")
+                        continue
+                    was_open = is_open
+
+        thread = threading.Thread(target=loop, name="ollama-circuit-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {"state": self.state(), "retry_in": self.retry_in(), "failure_threshold": self.failure_threshold,
+                "failure_window": self.failure_window, "cooldown": self.cooldown}
+
+
+class AdaptiveTimeout:
+    """
+    Read timeouts derived from observed latency, per model and input size.
+
+    The timeout is ``multiplier`` times the ``percentile`` latency of the last
+    ``window`` requests in the same bucket, clamped to [minimum, maximum].
+    Until ``min_samples`` requests have been seen, ``maximum`` is used.
+    Timed-out requests are recorded at the timeout they hit, so a slower
+    backend pushes the timeout up instead of timing out in a loop.
+    """
+
+    def __init__(self, store=None, enabled=True, percentile=95, multiplier=2.0, minimum=60, maximum=600,
+                 min_samples=20, window=200, refresh_interval=30, namespace="gemma:latency"):
+        self.store = store or _LocalStore()
+        self.enabled = enabled          # False always uses ``maximum`` (the fixed OLLAMA_TIMEOUT)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_samples = min_samples
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.namespace = namespace
+        self._timeouts = {}             # bucket -> (timeout, computed_at)
+        self._lock = threading.Lock()
+
+    def bucket(self, model: str, image_size: dict) -> str:
+        """Model name plus the model-input long edge rounded up to 256 px."""
+        size = (image_size or {}).get("model") or (0, 0)
+        edge = int(math.ceil(max(size) / 256.0)) * 256
+        return f"{model}:{edge}"
+
+    def observe(self, bucket: str, seconds: float):
+        try:
+            self.store.push(f"{self.namespace}:{bucket}", round(seconds, 3), self.window)
+        except Exception as e:
+            logger.warning(f"Could not record latency sample: {e}")
+
+    def timeout_for(self, bucket: str) -> float:
+        if not self.enabled:
+            return self.maximum
+        now = time.monotonic()
+        with self._lock:
+            cached = self._timeouts.get(bucket)
+        if cached is not None and now - cached[1] < self.refresh_interval:
+            return cached[0]
+        timeout = self._compute(bucket)
+        with self._lock:
+            self._timeouts[bucket] = (timeout, now)
+        return timeout
+
+    def _compute(self, bucket: str) -> float:
+        try:
+            samples = sorted(self.store.items(f"{self.namespace}:{bucket}"))
+        except Exception as e:
+            logger.warning(f"Could not read latency samples: {e}")
+            return self.maximum
+        if len(samples) < self.min_samples:
+            return self.maximum
+        index = min(len(samples) - 1, int(math.ceil(self.percentile / 100.0 * len(samples))) - 1)
+        return min(self.maximum, max(self.minimum, samples[index] * self.multiplier))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {bucket: round(timeout, 1) for bucket, (timeout, _) in self._timeouts.items()}
@@ -0,0 +1,297 @@
+# app/core/scheduler.py
+import logging
+import math
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def image_pixels(path) -> int:
+    """Pixel count from the image header (0 if unreadable: such images fail fast anyway)."""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+        return width * height
+    except Exception:
+        return 0
+
+
+class _LocalRedis:
+    """In-process stand-in for the Redis commands used below (one process only, e.g. eager Celery)."""
+
+    def __init__(self):
+        self._zsets = {}
+        self._hashes = {}
+        self._values = {}
+        self._lock = threading.RLock()
+        self._scheduler_lock = threading.Lock()
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            self._zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._zsets.get(key, {})
+            for member in members:
+                zset.pop(member, None)
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._zsets.get(key, {}))
+
+    def zrange(self, key, start, end, withscores=False):
+        with self._lock:
+            ordered = sorted(self._zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+        ordered = ordered[start:None if end == -1 else end + 1]
+        return ordered if withscores else [member for member, _ in ordered]
+
+    def zremrangebyscore(self, key, low, high):
+        with self._lock:
+            zset = self._zsets.get(key, {})
+            for member in [m for m, score in zset.items() if low <= score <= high]:
+                del zset[member]
+
+    def hset(self, key, field, value):
+        with self._lock:
+            self._hashes.setdefault(key, {})[field] = value
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._hashes.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+    def hdel(self, key, field):
+        with self._lock:
+            self._hashes.get(key, {}).pop(field, None)
+
+    def get(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return self._scheduler_lock
+
+
+class FairShareScheduler:
+    """
+    Sits between uploads and the Celery queues, so a large survey flight cannot
+    starve a small urgent batch.
+
+    - Each batch has its own queue; with ``small_first`` its images are ordered
+      by pixel count (cheapest inference first), otherwise by upload order.
+    - Batches share the workers by stride scheduling: every dispatch advances
+      the batch's virtual time by ``1 / priority``. The batch with the lowest
+      virtual time goes next, so equal priorities alternate round-robin and a
+      priority-4 batch gets four images for every one of a priority-1 batch.
+    - At most ``max_in_flight`` images are in Celery at once, so ordering
+      is decided here and not by a long FIFO in the broker. A slot is freed
+      when an image finishes or fails for good, or after ``in_flight_timeout``
+      if its task was lost; workers dispatch every ``reclaim_interval`` seconds
+      so a reclaimed slot is refilled without waiting for the next upload.
+
+    All state lives in Redis so the web app and every worker share one schedule.
+    """
+
+    def __init__(self, redis_url=None, max_in_flight=4, small_first=True, default_priority=1, max_priority=10,
+                 in_flight_timeout=3600, default_service_time=60.0, reclaim_interval=60, namespace="sched"):
+        self.redis = self._connect(redis_url)
+        self.max_in_flight = max_in_flight
+        self.small_first = small_first
+        self.default_priority = default_priority
+        self.max_priority = max_priority
+        self.in_flight_timeout = in_flight_timeout
+        self.default_service_time = default_service_time  # seconds per image until one has been measured
+        self.reclaim_interval = reclaim_interval
+        self.namespace = namespace
+        self._local = threading.local()
+
+    @staticmethod
+    def _connect(redis_url):
+        if not redis_url:
+            return _LocalRedis()
+        import redis
+        return redis.Redis.from_url(redis_url, socket_timeout=5, socket_connect_timeout=2, decode_responses=True)
+
+    def init_app(self, app):
+        """Configure from ``SCHEDULER_*`` keys."""
+        config = app.config
+        self.redis = self._connect(config.get("SCHEDULER_REDIS_URL"))
+        self.max_in_flight = config.get("SCHEDULER_MAX_IN_FLIGHT", self.max_in_flight)
+        self.small_first = config.get("SCHEDULER_SMALL_FIRST", self.small_first)
+        self.default_priority = config.get("SCHEDULER_DEFAULT_PRIORITY", self.default_priority)
+        self.max_priority = config.get("SCHEDULER_MAX_PRIORITY", self.max_priority)
+        self.in_flight_timeout = config.get("SCHEDULER_IN_FLIGHT_TIMEOUT", self.in_flight_timeout)
+        self.default_service_time = config.get("SCHEDULER_DEFAULT_SERVICE_TIME", self.default_service_time)
+        self.reclaim_interval = config.get("SCHEDULER_RECLAIM_INTERVAL", self.reclaim_interval)
+
+    def _key(self, *parts):
+        return ":".join((self.namespace,) + parts)
+
+    def _slot(self, batch_id, image):
+        return f"{batch_id}|{Path(image).name}"
+
+    def clamp_priority(self, priority) -> int:
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            return self.default_priority
+        return min(max(priority, 1), self.max_priority)
+
+    def submit(self, batch_id, image_paths, priority=None):
+        """Queues a batch's images. Call dispatch() afterwards to feed the workers."""
+        priority = self.clamp_priority(priority)
+        if self.small_first:
+            order = {str(path): image_pixels(path) for path in image_paths}
+        else:
+            start = time.time()
+            order = {str(path): start + i * 1e-3 for i, path in enumerate(image_paths)}
+        if not order:
+            return
+        with self.redis.lock(self._key("lock"), timeout=30, blocking_timeout=10):
+            self.redis.zadd(self._key("queue", batch_id), order)
+            self.redis.hset(self._key("priority"), batch_id, priority)
+            # A new batch starts at the current virtual time: it neither jumps ahead nor owes anything
+            if self._virtual_time(batch_id) is None:
+                self.redis.zadd(self._key("batches"), {batch_id: self._virtual_time()})
+        logger.info(f"Scheduled {len(order)} images of batch {batch_id} at priority {priority}")
+
+    def _virtual_time(self, batch_id=None):
+        active = self.redis.zrange(self._key("batches"), 0, -1, withscores=True)
+        if batch_id is not None:
+            return dict(active).get(batch_id)
+        if active:
+            return float(active[0][1])
+        return float(self.redis.get(self._key("vtime")) or 0.0)
+
+    def dispatch(self, send) -> int:
+        """
+        Hands images to ``send(image_path, batch_id)`` until ``max_in_flight``
+        are out or every batch queue is empty. Returns how many were sent.
+        Re-entrant calls (eager Celery finishing an image inside ``send``) only
+        ask the outer call to look again.
+        """
+        if getattr(self._local, "active", False):
+            self._local.again = True
+            return 0
+        self._local.active = True
+        sent = 0
+        try:
+            while True:
+                self._local.again = False
+                claimed = self._claim()
+                for image_path, batch_id in claimed:
+                    try:
+                        send(image_path, batch_id)
+                    except Exception as e:
+                        logger.error(f"Could not queue {image_path} of batch {batch_id}: {e}")
+                        self.finished(batch_id, image_path)
+                sent += len(claimed)
+                if not claimed and not self._local.again:
+                    return sent
+        finally:
+            self._local.active = False
+
+    def _claim(self):
+        """Picks the next images under the scheduler lock and marks them in flight."""
+        claimed = []
+        with self.redis.lock(self._key("lock"), timeout=30, blocking_timeout=10):
+            now = time.time()
+            in_flight_key = self._key("in_flight")
+            self.redis.zremrangebyscore(in_flight_key, 0, now - self.in_flight_timeout)
+            free = self.max_in_flight - self.redis.zcard(in_flight_key)
+            priorities = self.redis.hgetall(self._key("priority"))
+            while free > 0:
+                head = self.redis.zrange(self._key("batches"), 0, 0, withscores=True)
+                if not head:
+                    break
+                batch_id, vtime = head[0]
+                queue_key = self._key("queue", batch_id)
+                images = self.redis.zrange(queue_key, 0, 0)
+                if images:
+                    self.redis.zrem(queue_key, images[0])
+                    self.redis.zadd(in_flight_key, {self._slot(batch_id, images[0]): now})
+                    claimed.append((images[0], batch_id))
+                    free -= 1
+                    weight = self.clamp_priority(priorities.get(batch_id))
+                    self.redis.zadd(self._key("batches"), {batch_id: float(vtime) + 1.0 / weight})
+                    self.redis.set(self._key("vtime"), float(vtime))
+                if not images or self.redis.zcard(queue_key) == 0:
+                    self.redis.zrem(self._key("batches"), batch_id)
+                    self.redis.hdel(self._key("priority"), batch_id)
+        return claimed
+
+    def finished(self, batch_id, image):
+        """Frees an image's slot (done, dead-lettered or failed to queue) and updates the service time."""
+        slot = self._slot(batch_id, image)
+        try:
+            in_flight_key = self._key("in_flight")
+            started = dict(self.redis.zrange(in_flight_key, 0, -1, withscores=True)).get(slot)
+            self.redis.zrem(in_flight_key, slot)
+            if started is not None:
+                # Exponentially weighted seconds per image, from dispatch to finish
+                previous = self.redis.get(self._key("service_time"))
+                elapsed = max(0.0, time.time() - float(started))
+                value = elapsed if previous is None else 0.8 * float(previous) + 0.2 * elapsed
+                self.redis.set(self._key("service_time"), value)
+        except Exception as e:
+            logger.warning(f"Could not release scheduler slot {slot}: {e}")
+
+    def watch(self, dispatch):
+        """
+        Starts a daemon thread calling ``dispatch()`` every ``reclaim_interval``
+        seconds: slots of lost tasks expire in _claim, which only runs on a dispatch.
+        """
+        def loop():
+            while True:
+                time.sleep(self.reclaim_interval)
+                try:
+                    dispatch()
+                except Exception as e:
+                    logger.warning(f"Periodic scheduler dispatch failed: {e}")
+
+        thread = threading.Thread(target=loop, name="scheduler-reclaim", daemon=True)
+        thread.start()
+        return thread
+
+    def estimate(self, batch_id) -> dict:
+        """
+        Queue position and expected wait for a batch. ``expected_wait_s`` is
+        the time until its last queued image finishes, given how the other
+        active batches share the workers with it.
+        """
+        try:
+            in_flight = self.redis.zrange(self._key("in_flight"), 0, -1)
+            queued = self.redis.zcard(self._key("queue", batch_id))
+            priorities = self.redis.hgetall(self._key("priority"))
+            service = float(self.redis.get(self._key("service_time")) or self.default_service_time)
+            weight = self.clamp_priority(priorities.get(batch_id))
+            ahead = 0   # other batches' images dispatched before this batch's last one
+            for other in self.redis.zrange(self._key("batches"), 0, -1):
+                if other == batch_id:
+                    continue
+                share = math.ceil(queued * self.clamp_priority(priorities.get(other)) / weight)
+                ahead += min(self.redis.zcard(self._key("queue", other)), share)
+        except Exception as e:
+            logger.warning(f"Scheduler estimate unavailable for batch {batch_id}: {e}")
+            return {}
+        own_in_flight = sum(1 for slot in in_flight if slot.startswith(f"{batch_id}|"))
+        remaining = queued + ahead + len(in_flight) if queued else own_in_flight
+        return {
+            "queued": queued,
+            "in_flight": own_in_flight,
+            "priority": weight if queued else None,
+            "images_ahead": ahead + len(in_flight) - own_in_flight if queued else 0,
+            "seconds_per_image": round(service, 1),
+            "expected_wait_s": round(remaining * service / max(1, self.max_in_flight)),
+        }
@@ -0,0 +1,85 @@
+# app/core/stream_parser.py
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureStreamParser:
+    """
+    Incrementally extracts Feature objects from a streamed FeatureCollection.
+
+    Text is fed as it arrives from the model; every object that closes directly
+    inside the top-level ``"features": [...]`` array is decoded and returned.
+    Braces inside JSON strings are ignored, and anything outside the root
+    object (markdown fences, chatter) is skipped.
+    """
+
+    def __init__(self):
+        self._stack = []           # open containers: '{' or '['
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []    # current string, only kept for root-level keys
+        self._last_string = None
+        self._key = None           # last key seen in the root object
+        self._features_level = None
+        self._capture = None       # chars of the feature being read
+        self.features_seen = 0
+
+    def feed(self, text: str) -> list:
+        """Consumes a chunk of model output; returns features completed by it."""
+        completed = []
+        for ch in text:
+            if self._capture is not None:
+                self._capture.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = "".join(self._string_chars)
+                elif len(self._stack) == 1:
+                    self._string_chars.append(ch)
+                continue
+
+            if ch == '"':
+                if self._stack:
+                    self._in_string = True
+                    self._string_chars = []
+            elif ch == ":":
+                if len(self._stack) == 1:
+                    self._key = self._last_string
+            elif ch == "{":
+                if self._features_level is not None and len(self._stack) == self._features_level:
+                    self._capture = ["{"]
+                self._stack.append(ch)
+            elif ch == "[":
+                if len(self._stack) == 1 and self._key == "features":
+                    self._features_level = 2
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == "]" and self._features_level is not None and len(self._stack) == 1:
+                    self._features_level = None
+                elif (ch == "}" and self._capture is not None
+                        and len(self._stack) == self._features_level):
+                    feature = self._decode("".join(self._capture))
+                    self._capture = None
+                    if feature is not None:
+                        completed.append(feature)
+        return completed
+
+    def _decode(self, text: str):
+        try:
+            feature = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping undecodable streamed feature: {e}")
+            return None
+        self.features_seen += 1
+        return feature
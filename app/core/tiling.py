@@ -0,0 +1,175 @@
+# app/core/tiling.py
+import io
+import logging
+from dataclasses import dataclass
+
+from PIL import Image
+
+from .metadata_process import fit_long_edge, resize_image
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Tile:
+    """A crop box of the full frame, in full-resolution pixels."""
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    @property
+    def size(self):
+        return self.right - self.left, self.bottom - self.top
+
+
+def tile_boxes(size, tile_size=1024, overlap=128):
+    """
+    Splits a (width, height) frame into overlapping tiles covering every pixel.
+    Edge tiles are shifted inwards rather than shrunk, so all tiles share one size.
+    """
+    width, height = size
+    if overlap >= tile_size:
+        raise ValueError("Tile overlap must be smaller than the tile size")
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = tile_size - overlap
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        Tile(left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def encode_tile(image, tile: Tile, max_edge=None, quality=85):
+    """Crops a tile from a loaded image and JPEG-encodes it. Returns (bytes, model_size)."""
+    crop = image.crop((tile.left, tile.top, tile.right, tile.bottom))
+    target_size = fit_long_edge(crop.size, max_edge)
+    if target_size != crop.size:
+        crop = resize_image(crop, target_size)
+    buffer = io.BytesIO()
+    crop.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), crop.size
+
+
+def load_frame(image_path):
+    """Opens and fully decodes a frame as RGB so tiles can be cropped from several threads."""
+    with Image.open(image_path) as image:
+        frame = image.convert("RGB")
+    frame.load()
+    return frame
+
+
+def offset_features(features, tile: Tile, model_size):
+    """Maps a tile's model pixel coordinates back to full-frame pixel coordinates."""
+    scale_x = tile.size[0] / float(model_size[0])
+    scale_y = tile.size[1] / float(model_size[1])
+
+    def shift(pair):
+        return [float(pair[0]) * scale_x + tile.left, float(pair[1]) * scale_y + tile.top]
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            return shift(coords)
+        return [walk(c) for c in coords]
+
+    shifted = []
+    for feat in features:
+        if not feat:
+            continue
+        geom = feat.get("geometry") or {}
+        coords = geom.get("coordinates")
+        if not coords:
+            continue
+        try:
+            geom["coordinates"] = walk(coords)
+        except (TypeError, ValueError, IndexError) as e:
+            logger.warning(f"Dropping tile feature with malformed coordinates: {e}")
+            continue
+        shifted.append(feat)
+    return shifted
+
+
+def merge_tile_features(features, min_overlap=0.3):
+    """
+    Merges polygons detected twice in overlapping tiles.
+
+    Two polygons of the same class are considered the same object when their
+    intersection covers at least ``min_overlap`` of the smaller one. Candidates
+    come from an STRtree; each group is replaced by the union of its polygons,
+    keeping the properties of the most confident member. Points and lines pass
+    through unchanged.
+    """
+    from shapely.geometry import shape, mapping
+    from shapely.geometry.polygon import orient
+    from shapely.strtree import STRtree
+
+    polygons, shapes, passthrough = [], [], []
+    for feat in features:
+        geom = feat.get("geometry") or {}
+        if geom.get("type") != "Polygon":
+            passthrough.append(feat)
+            continue
+        try:
+            poly = shape(geom)
+            if not poly.is_valid:
+                poly = poly.buffer(0)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable tile polygon: {e}")
+            continue
+        if poly.is_empty:
+            continue
+        polygons.append(feat)
+        shapes.append(poly)
+
+    if not shapes:
+        return passthrough
+
+    # Union-find over overlapping same-class pairs
+    parent = list(range(len(shapes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tree = STRtree(shapes)
+    for i, poly in enumerate(shapes):
+        cls = polygons[i].get("properties", {}).get("class")
+        for j in tree.query(poly):
+            j = int(j)
+            if j <= i or polygons[j].get("properties", {}).get("class") != cls:
+                continue
+            smaller = min(poly.area, shapes[j].area)
+            if smaller > 0 and poly.intersection(shapes[j]).area / smaller >= min_overlap:
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(shapes)):
+        groups.setdefault(find(i), []).append(i)
+
+    merged = []
+    for members in groups.values():
+        if len(members) == 1:
+            merged.append(polygons[members[0]])
+            continue
+        best = max(members, key=lambda k: float(polygons[k].get("properties", {}).get("confidence", 0.0) or 0.0))
+        union = shapes[members[0]]
+        for k in members[1:]:
+            union = union.union(shapes[k])
+        if union.geom_type != "Polygon":
+            union = union.convex_hull
+        feature = dict(polygons[best])
+        feature["geometry"] = mapping(orient(union, sign=1.0))
+        feature["geometry"]["coordinates"] = [[list(pt) for pt in ring] for ring in feature["geometry"]["coordinates"]]
+        merged.append(feature)
+
+    logger.info(f"Tile merge: {len(shapes)} polygons -> {len(merged)}")
+    return merged + passthrough
@@ -0,0 +1,244 @@
+# app/core/uploads.py
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+PARTIAL_DIR = ".partial"
+
+
+class UploadError(Exception):
+    """A request the upload cannot accept; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def content_path(directory, digest, filename) -> Path:
+    """Where a file with this SHA-256 is stored: the same bytes always land on the same path."""
+    return Path(directory) / f"{digest}{Path(secure_filename(filename) or '').suffix.lower()}"
+
+
+def _copy(stream, f, digest, limit):
+    """Copies up to ``limit`` bytes from ``stream`` to ``f``, hashing as it writes. Returns the byte count."""
+    written = 0
+    while written < limit:
+        block = stream.read(min(BLOCK_SIZE, limit - written))
+        if not block:
+            break
+        f.write(block)
+        digest.update(block)
+        written += len(block)
+    return written
+
+
+def _place(partial, directory, digest, filename) -> Path:
+    """Moves a fully written file to its content address (dropping it when those bytes are already stored)."""
+    final = content_path(directory, digest, filename)
+    if final.exists():
+        partial.unlink()
+    else:
+        os.replace(partial, final)
+    return final
+
+
+def save_stream(stream, directory, filename) -> Path:
+    """Writes a whole file (e.g. a multipart form field) to its content address in one pass."""
+    partial_dir = Path(directory) / PARTIAL_DIR
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    partial = partial_dir / f"{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    try:
+        with open(partial, "wb") as f:
+            _copy(stream, f, digest, float("inf"))
+    except Exception:
+        partial.unlink(missing_ok=True)
+        raise
+    return _place(partial, directory, digest.hexdigest(), filename)
+
+
+class ChunkedUploadStore:
+    """
+    Resumable uploads for large survey flights over unreliable links.
+
+    - ``create`` opens an upload for one file of known size; the client then
+      sends its bytes in order with ``append`` (any chunk size up to
+      ``max_chunk_bytes``), each tagged with the offset it starts at.
+    - Chunks stream straight to ``<directory>/.partial/<upload_id>.part``
+      and are hashed while written. The partial file's size is the upload's
+      offset, so after a dropped connection the client asks for it and goes on
+      from there; a chunk cut off half way keeps the bytes that arrived.
+    - The last chunk moves the file to ``<directory>/<sha256><ext>``, so
+      identical images share one file and different ones never overwrite
+      each other.
+
+    Upload state is a JSON file next to the partial file and appends are
+    serialized with flock, so any web process can serve any chunk.
+    """
+
+    def __init__(self, directory=None, max_chunk_bytes=64 * 1024 * 1024, max_file_bytes=2 * 1024 ** 3,
+                 ttl=24 * 3600):
+        self.directory = Path(directory) if directory else None
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_file_bytes = max_file_bytes
+        self.ttl = ttl                  # seconds an upload may sit idle before it is discarded
+        self._hashers = {}              # upload_id -> (offset, sha256 state), this process only
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from ``UPLOAD_*`` keys."""
+        config = app.config
+        self.directory = Path(config["UPLOAD_FOLDER"])
+        self.max_chunk_bytes = config.get("UPLOAD_MAX_CHUNK_BYTES", self.max_chunk_bytes)
+        self.max_file_bytes = config.get("UPLOAD_MAX_FILE_BYTES", self.max_file_bytes)
+        self.ttl = config.get("UPLOAD_PARTIAL_TTL", self.ttl)
+
+    @property
+    def partial_dir(self) -> Path:
+        return self.directory / PARTIAL_DIR
+
+    def _paths(self, upload_id):
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadError("Unknown upload", 404)
+        return self.partial_dir / f"{upload_id}.json", self.partial_dir / f"{upload_id}.part"
+
+    def _load(self, upload_id) -> dict:
+        meta_path, _ = self._paths(upload_id)
+        try:
+            return json.loads(meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            raise UploadError("Unknown upload", 404)
+
+    def _save(self, meta):
+        meta_path, _ = self._paths(meta["upload_id"])
+        tmp = meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_path)
+
+    def create(self, filename, size, batch_id, priority=None) -> dict:
+        """Opens an upload of ``size`` bytes. Returns its state (``offset`` 0)."""
+        name = secure_filename(filename or "")
+        if not name:
+            raise UploadError("A filename is required")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError("The file size is required")
+        if size <= 0 or size > self.max_file_bytes:
+            raise UploadError(f"File size must be between 1 and {self.max_file_bytes} bytes", 413)
+        self.expire_stale()
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        meta = {"upload_id": uuid.uuid4().hex, "filename": name, "size": size, "batch_id": batch_id,
+                "priority": priority, "created_at": time.time(), "sha256": None, "path": None}
+        self._paths(meta["upload_id"])[1].touch()
+        self._save(meta)
+        logger.info(f"Upload {meta['upload_id']} opened: {name}, {size} bytes, batch {batch_id}")
+        return {**meta, "offset": 0, "complete": False}
+
+    def status(self, upload_id) -> dict:
+        """Upload state with the offset the next chunk must start at."""
+        meta = self._load(upload_id)
+        if meta["path"]:
+            return {**meta, "offset": meta["size"], "complete": True}
+        _, part_path = self._paths(upload_id)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        return {**meta, "offset": offset, "complete": False}
+
+    def append(self, upload_id, offset, stream, length=None) -> dict:
+        """
+        Writes one chunk starting at ``offset``. Returns the upload state;
+        ``finished`` is True only for the call that completed the file, so the
+        caller queues it exactly once. A wrong offset raises a 409 carrying the
+        current one.
+        """
+        meta = self._load(upload_id)
+        _, part_path = self._paths(upload_id)
+        if meta["path"]:
+            if offset != meta["size"]:
+                raise UploadError("Upload already complete", 409, meta["size"])
+            return {**meta, "offset": meta["size"], "complete": True, "finished": False}
+        if length is not None and length > self.max_chunk_bytes:
+            raise UploadError(f"Chunks may be at most {self.max_chunk_bytes} bytes", 413)
+
+        with open(part_path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            meta = self._load(upload_id)    # another process may have finished it meanwhile
+            if meta["path"]:
+                part_path.unlink(missing_ok=True)   # just recreated by open()
+                return {**meta, "offset": meta["size"], "complete": True, "finished": False}
+            os.utime(self._paths(upload_id)[0])  # an upload in progress never expires
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError("Offset does not match the bytes received", 409, current)
+            remaining = meta["size"] - current
+            limit = min(self.max_chunk_bytes, remaining if length is None else length)
+            if length is not None and length > remaining:
+                raise UploadError("Chunk runs past the declared file size", 413, current)
+            digest = self._hasher(upload_id, part_path, current)
+            written = 0
+            try:
+                written = _copy(stream, f, digest, limit)
+            finally:
+                # Whatever arrived stays: a cut-off chunk resumes from the new size
+                f.flush()
+                with self._lock:
+                    self._hashers[upload_id] = (current + written, digest)
+            offset = current + written
+            if offset < meta["size"]:
+                return {**meta, "offset": offset, "complete": False, "finished": False}
+            os.fsync(f.fileno())
+            return self._finish(meta, part_path, digest)
+
+    def _hasher(self, upload_id, part_path, offset):
+        """SHA-256 state after ``offset`` bytes: kept from the previous chunk, else rebuilt from the partial file."""
+        with self._lock:
+            cached_offset, digest = self._hashers.pop(upload_id, (None, None))
+        if cached_offset == offset:
+            return digest
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            _copy(f, _Discard, digest, offset)
+        return digest
+
+    def _finish(self, meta, part_path, digest) -> dict:
+        with self._lock:
+            self._hashers.pop(meta["upload_id"], None)
+        sha256 = digest.hexdigest()
+        final = _place(part_path, self.directory, sha256, meta["filename"])
+        # Kept until expiry, so a client retrying the last chunk learns it is done
+        meta.update(sha256=sha256, path=str(final), completed_at=time.time())
+        self._save(meta)
+        logger.info(f"Upload {meta['upload_id']} complete: {meta['filename']} -> {final.name}")
+        return {**meta, "offset": meta["size"], "complete": True, "finished": True}
+
+    def expire_stale(self):
+        """Deletes uploads (finished or not) untouched for longer than ``ttl``."""
+        if not self.partial_dir.is_dir():
+            return
+        cutoff = time.time() - self.ttl
+        for path in self.partial_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+class _Discard:
+    """File-like sink for re-hashing a partial file without copying it."""
+
+    @staticmethod
+    def write(block):
+        pass
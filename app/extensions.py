@@ -1,14 +1,128 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from celery import Celery, Task
+from celery.signals import worker_init, worker_process_init, worker_ready
+from amqp.exceptions import ChannelError
+import threading
+
+from .core.batch_status import BatchStatusStore
+from .core.gemma_client import OllamaGemmaClient
+from .core.map_events import MapEventBus
+from .core.scheduler import FairShareScheduler
+from .core.uploads import ChunkedUploadStore
+
+# Queue of the tasks that call Ollama; only workers consuming it warm the model up
+INFERENCE_QUEUE = "inference"
+# Pools that run all their tasks in one process (-P names and module names)
+IO_POOLS = ("threads", "thread", "gevent", "eventlet")
 
 db = SQLAlchemy()
-migrate = Migrate()
+gemma = OllamaGemmaClient()
+batch_status = BatchStatusStore()
+map_events = MapEventBus()
+scheduler = FairShareScheduler()
+uploads = ChunkedUploadStore()
+
+
+@worker_init.connect
+def _size_ollama_pool(sender=None, **kwargs):
+    """
+    Thread and gevent workers share one Ollama session between ``concurrency``
+    tasks: keep a pooled connection per task instead of reconnecting.
+    """
+    if sender is None or worker_pool_name(sender) not in IO_POOLS:
+        return
+    if gemma.pool_maxsize < sender.concurrency:
+        gemma.pool_maxsize = sender.concurrency
+        gemma.reset_session()
+    sender.app.log.get_default_logger().info(
+        f"{worker_pool_name(sender)} pool: {sender.concurrency} tasks share one process, "
+        f"Ollama pool size {gemma.pool_maxsize}")
+
+
+@worker_process_init.connect
+def _reset_gemma_session(**kwargs):
+    """Give each prefork child its own Ollama connection pool, reused by all its tasks."""
+    gemma.reset_session(close=False)
+
+
+@worker_ready.connect
+def _warm_up_gemma(sender=None, **kwargs):
+    """Load the model once the worker is up, and keep it loaded while work is queued."""
+    if sender is None or not _consumes_inference(sender):
+        return
+    if gemma.warmup_on_start:
+        threading.Thread(target=gemma.warm_up, name="ollama-warm-up", daemon=True).start()
+    if gemma.keep_warm_interval:
+        queues = consumed_queues(sender)
+        gemma.start_keep_warm(lambda: queued_messages(sender.app, queues) > 0)
+
+
+@worker_ready.connect
+def _pause_while_circuit_open(sender=None, **kwargs):
+    """Stop taking inference tasks from the broker while the Ollama circuit breaker is open."""
+    if sender is None or not _consumes_inference(sender):
+        return
+    # CPU-only stages keep flowing; the default queue may still carry monolithic tasks
+    queues = [name for name in consumed_queues(sender) if name in (INFERENCE_QUEUE, "celery")]
+
+    def on_change(is_open):
+        for name in queues:
+            if is_open:
+                sender.app.control.cancel_consumer(name, destination=[sender.hostname], reply=False)
+            else:
+                sender.app.control.add_consumer(name, destination=[sender.hostname], reply=False)
+        sender.app.log.get_default_logger().warning(
+            f"{'Paused' if is_open else 'Resumed'} consuming {', '.join(queues)}: Ollama circuit "
+            f"{'open' if is_open else 'no longer open'}")
+
+    gemma.breaker.watch(on_change)
+
+
+@worker_ready.connect
+def _reclaim_scheduler_slots(sender=None, **kwargs):
+    """Refill scheduler slots freed by expiry, which no upload or finished image would notice."""
+    if sender is None or not _consumes_inference(sender) or not scheduler.reclaim_interval:
+        return
+    # Called in-process: FlaskTask gives the dispatch its app context
+    scheduler.watch(sender.app.tasks["app.tasks.dispatch_scheduled_images"])
+
+
+def worker_pool_name(worker) -> str:
+    """The worker's pool as named on the command line: "prefork", "threads", "gevent", ..."""
+    pool = worker.pool_cls
+    return pool if isinstance(pool, str) else pool.__module__.rsplit(".", 1)[-1]
+
+
+def consumed_queues(consumer) -> list:
+    """Names of the queues a worker consumes, as started (e.g. never the dead-letter queue)."""
+    return [queue.name for queue in consumer.task_consumer.queues]
+
+
+def _consumes_inference(consumer) -> bool:
+    queues = consumed_queues(consumer)
+    return INFERENCE_QUEUE in queues or "celery" in queues
+
+
+def queued_messages(celery_app: Celery, queues=None) -> int:
+    """Number of messages waiting in the broker across the given (default: all the app's) queues."""
+    total = 0
+    with celery_app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for name in queues or celery_app.amqp.queues:
+            try:
+                total += channel.queue_declare(queue=name, passive=True).message_count
+            except ChannelError:
+                pass  # the broker has not created the queue yet: nothing queued
+    return total
+
 
 def celery_init_app(app: Flask) -> Celery:
     class FlaskTask(Task):
         def __call__(self, *args: object, **kwargs: object) -> object:
+            # Every task gets its own app context, and so its own db.session: Flask-SQLAlchemy
+            # scopes sessions to the app context, which is thread- and greenlet-local. The
+            # session is removed (its connection back in the pool) when the task returns.
             with app.app_context():
                 return self.run(*args, **kwargs)
 
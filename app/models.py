@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import ForeignKey
+from sqlalchemy import DDL, ForeignKey, event
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from typing import List
 from .extensions import db
@@ -8,12 +8,15 @@ class AnalysisResult(db.Model):
     __tablename__ = "analysis_results"
 
     id = db.Column(db.Integer, primary_key=True)
-    batch_id = db.Column(db.String, nullable=False)
+    batch_id = db.Column(db.String, nullable=False, index=True)
     image_filename = db.Column(db.String, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     center_lat = db.Column(db.Float, nullable=True)
     center_lon = db.Column(db.Float, nullable=True)
     processing_status = db.Column(db.String, nullable=False)
+    idempotency_key = db.Column(db.String, nullable=True, unique=True, index=True)  # "<batch_id>:<image hash>"
+    stage = db.Column(db.String, nullable=False, default="created", server_default="created")
+    raw_response = db.deferred(db.Column(db.Text, nullable=True))  # model output, checkpointed after inference
 
     polygons = db.relationship("PolygonFeature", back_populates="result", cascade="all, delete-orphan")
 
@@ -22,18 +25,46 @@ class PolygonFeature(db.Model):
     __tablename__ = "polygon_features"
 
     id = db.Column(db.Integer, primary_key=True)
-    result_id = db.Column(db.Integer, db.ForeignKey("analysis_results.id"), nullable=False)
+    result_id = db.Column(db.Integer, db.ForeignKey("analysis_results.id"), nullable=False, index=True)
     polygon_id = db.Column(db.String, nullable=False)
     damage_type = db.Column(db.String)
     confidence = db.Column(db.Float)
     class_label = db.Column(db.String)
     notes = db.Column(db.String)
     coordinates = db.Column(db.Text)
+    # Bounding box of the coordinates (lon/lat), mirrored into polygon_features_rtree on SQLite
+    minx = db.Column(db.Float, nullable=True)
+    miny = db.Column(db.Float, nullable=True)
+    maxx = db.Column(db.Float, nullable=True)
+    maxy = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
 
     result = db.relationship("AnalysisResult", back_populates="polygons")
 
 
+# SQLite R*Tree over the polygon bounding boxes, rowid = polygon_features.id. It is a
+# virtual table, so it lives outside db.metadata (create_all and autogenerate skip it)
+# and is created next to polygon_features instead.
+polygon_rtree = db.Table(
+    "polygon_features_rtree", db.MetaData(),
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("minx", db.Float), db.Column("maxx", db.Float),
+    db.Column("miny", db.Float), db.Column("maxy", db.Float),
+)
+
+CREATE_POLYGON_RTREE = ("CREATE VIRTUAL TABLE IF NOT EXISTS polygon_features_rtree "
+                        "USING rtree(id, minx, maxx, miny, maxy)")
+
+event.listen(PolygonFeature.__table__, "after_create", DDL(CREATE_POLYGON_RTREE).execute_if(dialect="sqlite"))
+event.listen(PolygonFeature.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS polygon_features_rtree").execute_if(dialect="sqlite"))
+
+
+def combined_layer_name(batch_id) -> str:
+    """PolygonJSON name of a batch's combined map layer (one row per batch)."""
+    return f"batch:{batch_id}"
+
+
 class PolygonJSON(db.Model):
     __tablename__ = "polygon_json"
 
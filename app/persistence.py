@@ -0,0 +1,296 @@
+# app/persistence.py
+import logging
+from datetime import datetime
+
+import orjson
+from sqlalchemy import and_, delete, func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .models import AnalysisResult, PolygonFeature, polygon_rtree
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "partial")
+FAILED_STATUSES = ("failed", "dead_letter")
+# Pipeline stages an image's row has completed, in order; retries resume after the last one
+STAGES = ("created", "inferred", "persisted", "aggregated")
+
+
+def idempotency_key(batch_id, content_hash) -> str:
+    """The same image uploaded twice in one batch maps to the same result row."""
+    return f"{batch_id}:{content_hash}"
+
+
+def claim_result(batch_id, image_filename, key):
+    """
+    The image's result row, created on first sight. Returns (result_id, stage,
+    checkpointed response or None). A row still at "created" belonged to an
+    attempt that died before its checkpoint: polygons it streamed are dropped.
+    """
+    row = db.session.execute(
+        select(AnalysisResult.id, AnalysisResult.stage, AnalysisResult.raw_response)
+        .where(AnalysisResult.idempotency_key == key)
+    ).first()
+    if row is None:
+        try:
+            result_id = db.session.execute(
+                insert(AnalysisResult).values(
+                    batch_id=batch_id, image_filename=image_filename, processing_status="processing",
+                    idempotency_key=key, stage="created", created_at=datetime.now())
+            ).inserted_primary_key[0]
+            db.session.commit()
+            return result_id, "created", None
+        except IntegrityError:
+            # Another delivery of the same image won the insert
+            db.session.rollback()
+            return claim_result(batch_id, image_filename, key)
+
+    result_id, stage, raw = row
+    if stage == "created":
+        _delete_polygons(result_id)
+    if stage in ("created", "inferred"):
+        db.session.execute(update(AnalysisResult).where(AnalysisResult.id == result_id)
+                           .values(processing_status="processing"))
+    db.session.commit()
+    logger.info(f"Resuming result {result_id} after stage '{stage}'")
+    return result_id, stage, orjson.loads(raw) if raw else None
+
+
+def discard_polygons(result_id) -> int:
+    """
+    Drops the polygons an interrupted streaming attempt persisted and puts the
+    result back to "processing", before the stream is replayed. Returns how many were dropped.
+    """
+    try:
+        dropped = _delete_polygons(result_id)
+        db.session.execute(update(AnalysisResult).where(AnalysisResult.id == result_id)
+                           .values(processing_status="processing"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return dropped
+
+
+def checkpoint_response(result_id, response):
+    """Stores the raw model response, so a retry never pays for inference again."""
+    try:
+        db.session.execute(
+            update(AnalysisResult).where(AnalysisResult.id == result_id)
+            .values(raw_response=orjson.dumps(response).decode("utf-8"), stage="inferred"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def resume_persisted(result_id):
+    """Final status and polygon count of a result whose polygons an earlier attempt already saved."""
+    status, count = db.session.execute(
+        select(AnalysisResult.processing_status, func.count(PolygonFeature.id))
+        .outerjoin(PolygonFeature, PolygonFeature.result_id == AnalysisResult.id)
+        .where(AnalysisResult.id == result_id)
+        .group_by(AnalysisResult.id)
+    ).one()
+    status = "partial" if status == "partial" else "completed"
+    set_stage(result_id, None, processing_status=status)
+    return status, count
+
+
+def set_stage(result_id, stage, **values):
+    if stage is not None:
+        values["stage"] = stage
+    try:
+        db.session.execute(update(AnalysisResult).where(AnalysisResult.id == result_id).values(**values))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def save_result(result_id, status, polygons=(), center_lat=None, center_lon=None):
+    """
+    Finishes an image in one transaction: the result row's status and center
+    are updated and all its polygons are bulk-inserted with a single
+    executemany, instead of one ORM INSERT per polygon and a commit per step.
+    ``polygons`` are column dicts from polygon_row().
+    """
+    values = {"processing_status": status, "stage": "persisted" if status in FINISHED_STATUSES else "created"}
+    if center_lat is not None and center_lon is not None:
+        values.update(center_lat=center_lat, center_lon=center_lon)
+    try:
+        db.session.execute(update(AnalysisResult).where(AnalysisResult.id == result_id).values(**values))
+        _insert_polygons(result_id, polygons)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def create_result(batch_id, image_filename, status, polygons=(), center_lat=None, center_lon=None, key=None):
+    """
+    Inserts a finished result row and its polygons in one transaction.
+    Returns the new result id, or None when ``key`` already has a row.
+    """
+    try:
+        result_id = db.session.execute(
+            insert(AnalysisResult).values(
+                batch_id=batch_id, image_filename=image_filename, processing_status=status,
+                center_lat=center_lat, center_lon=center_lon, created_at=datetime.now(),
+                idempotency_key=key, stage="persisted")
+        ).inserted_primary_key[0]
+        _insert_polygons(result_id, polygons)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    except Exception:
+        db.session.rollback()
+        raise
+    return result_id
+
+
+def add_polygons(result_id, polygons, center_lat=None, center_lon=None):
+    """Appends polygons to a result that is still processing (streaming mode), in one transaction."""
+    save_result(result_id, "processing", polygons, center_lat, center_lon)
+
+
+def polygon_row(polygon_id, damage_type, confidence, class_label, notes, coordinates, bbox=None) -> dict:
+    """
+    Column values of one PolygonFeature; result_id and created_at are filled in on insert.
+    ``bbox`` is (minx, miny, maxx, maxy), computed from the ``coordinates`` JSON when not given.
+    """
+    if bbox is None:
+        bbox = coordinates_bbox(coordinates)
+    minx, miny, maxx, maxy = bbox or (None, None, None, None)
+    return {"polygon_id": polygon_id, "damage_type": damage_type, "confidence": confidence,
+            "class_label": class_label, "notes": notes, "coordinates": coordinates,
+            "minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy}
+
+
+def coordinates_bbox(coordinates):
+    """(minx, miny, maxx, maxy) of a rings JSON string or list, None when it holds no point."""
+    try:
+        rings = orjson.loads(coordinates) if isinstance(coordinates, (str, bytes)) else coordinates
+        xs, ys = zip(*((float(x), float(y)) for ring in rings for x, y, *_ in ring))
+    except (TypeError, ValueError, orjson.JSONDecodeError):
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _spatial_index() -> bool:
+    """The R*Tree mirror exists only on SQLite; elsewhere bbox queries use the columns."""
+    return db.session.get_bind().dialect.name == "sqlite"
+
+
+def _insert_polygons(result_id, polygons):
+    if not polygons:
+        return
+    now = datetime.now()
+    last_id = db.session.scalar(select(func.max(PolygonFeature.id))) or 0
+    db.session.execute(insert(PolygonFeature), [{**row, "result_id": result_id, "created_at": now} for row in polygons])
+    if _spatial_index():
+        # Mirror the new rows' boxes in the same transaction; OR REPLACE covers a reused rowid
+        db.session.execute(text(
+            "INSERT OR REPLACE INTO polygon_features_rtree (id, minx, maxx, miny, maxy) "
+            "SELECT id, minx, maxx, miny, maxy FROM polygon_features "
+            "WHERE result_id = :result_id AND id > :last_id AND minx IS NOT NULL"
+        ), {"result_id": result_id, "last_id": last_id})
+
+
+def _delete_polygons(result_id):
+    if _spatial_index():
+        db.session.execute(delete(polygon_rtree).where(polygon_rtree.c.id.in_(
+            select(PolygonFeature.id).where(PolygonFeature.result_id == result_id))))
+    return db.session.execute(delete(PolygonFeature).where(PolygonFeature.result_id == result_id)).rowcount
+
+
+def bbox_filter(bbox):
+    """
+    WHERE clause for polygons whose bounding box intersects ``bbox``
+    (west, south, east, north). On SQLite the R*Tree finds the candidate ids,
+    so only the polygons in view are read; elsewhere it compares the columns.
+    """
+    west, south, east, north = bbox
+    if _spatial_index():
+        return PolygonFeature.id.in_(
+            select(polygon_rtree.c.id).where(polygon_rtree.c.minx <= east, polygon_rtree.c.maxx >= west,
+                                             polygon_rtree.c.miny <= north, polygon_rtree.c.maxy >= south))
+    return and_(PolygonFeature.minx <= east, PolygonFeature.maxx >= west,
+                PolygonFeature.miny <= north, PolygonFeature.maxy >= south)
+
+
+def batch_polygons(batch_id, after_id=0, bbox=None, limit=None) -> list:
+    """
+    A batch's polygons in id order: those after ``after_id``, and with
+    ``bbox`` only those inside that viewport. ``batch_id`` None means every batch.
+    """
+    query = db.session.query(PolygonFeature).filter(PolygonFeature.id > after_id)
+    if batch_id is not None:
+        query = query.join(AnalysisResult).filter(AnalysisResult.batch_id == batch_id)
+    if bbox is not None:
+        query = query.filter(bbox_filter(bbox))
+    query = query.order_by(PolygonFeature.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def batch_centers(batch_id) -> list:
+    """(id, center_lat, center_lon) rows of the batch's results that have an image center, in id order."""
+    return db.session.execute(
+        select(AnalysisResult.id, AnalysisResult.center_lat, AnalysisResult.center_lon)
+        .where(AnalysisResult.batch_id == batch_id, AnalysisResult.center_lat.is_not(None),
+               AnalysisResult.center_lon.is_not(None))
+        .order_by(AnalysisResult.id)
+    ).all()
+
+
+def latest_batch_id():
+    """The batch of the most recently created result, None before the first upload."""
+    return db.session.scalar(select(AnalysisResult.batch_id).order_by(AnalysisResult.id.desc()).limit(1))
+
+
+def batch_summary(batch_id) -> dict:
+    """
+    Per-status result counts and the polygon count of finished results, from
+    two aggregate queries (no result or polygon rows are loaded).
+    """
+    status_counts = dict(db.session.execute(
+        select(AnalysisResult.processing_status, func.count(AnalysisResult.id))
+        .where(AnalysisResult.batch_id == batch_id)
+        .group_by(AnalysisResult.processing_status)
+    ).all())
+    total_polygons = db.session.scalar(
+        select(func.count(PolygonFeature.id))
+        .join(AnalysisResult, PolygonFeature.result_id == AnalysisResult.id)
+        .where(AnalysisResult.batch_id == batch_id,
+               AnalysisResult.processing_status.in_(FINISHED_STATUSES))
+    )
+    return {
+        "total_results": sum(status_counts.values()),
+        "completed_count": sum(status_counts.get(s, 0) for s in FINISHED_STATUSES),
+        "failed_count": sum(status_counts.get(s, 0) for s in FAILED_STATUSES),
+        "total_polygons": total_polygons or 0,
+        "status_counts": status_counts,
+    }
+
+
+def batch_results_page(batch_id, page=1, per_page=50, limit=None) -> list:
+    """
+    One page of a batch's results (oldest first), each with its polygon count.
+    ``limit`` (default ``per_page``) may ask for more rows than the page holds,
+    e.g. one extra to tell whether another page follows, without moving the offset.
+    """
+    rows = db.session.execute(
+        select(AnalysisResult.id, AnalysisResult.image_filename, AnalysisResult.processing_status,
+               func.count(PolygonFeature.id))
+        .outerjoin(PolygonFeature, PolygonFeature.result_id == AnalysisResult.id)
+        .where(AnalysisResult.batch_id == batch_id)
+        .group_by(AnalysisResult.id)
+        .order_by(AnalysisResult.id)
+        .limit(per_page if limit is None else limit)
+        .offset((page - 1) * per_page)
+    ).all()
+    return [{"id": r[0], "filename": r[1], "status": r[2], "polygons": r[3]} for r in rows]
@@ -1,15 +1,15 @@
 import os
 import json
 import uuid
-from pathlib import Path
 
-from flask import Blueprint, render_template, redirect, url_for, request, current_app, jsonify
+from flask import Blueprint, Response, render_template, redirect, url_for, request, current_app, jsonify, stream_with_context
 from sqlalchemy import select
 from werkzeug.utils import secure_filename
 
-from .tasks import analyze_image_task
-from .models import AnalysisResult, PolygonJSON
-from .extensions import db
+from .models import PolygonJSON, combined_layer_name
+from .persistence import batch_polygons, batch_results_page, batch_summary, latest_batch_id
+from .extensions import db, gemma, batch_status, map_events, scheduler, uploads
+from .core.uploads import UploadError, save_stream
 
 main = Blueprint('main', __name__)
 
@@ -29,42 +29,148 @@ def index():
         upload_path = current_app.config['UPLOAD_FOLDER']
         processed_files = []
 
+        batch_mode = current_app.config.get('OLLAMA_BATCH_MODE', False)
+        file_paths = []
+        batch_status.start(batch_id, sum(1 for file in files if file and file.filename != ''))
+
         for file in files:
             if file and file.filename != '':
                 filename = secure_filename(file.filename)
-                file_path = os.path.join(upload_path, filename)
-                file.save(file_path)
-
-                # Asynchronous analysis with batch tracking
-                analyze_image_task.delay(file_path, batch_id)
+                # Stored by content hash: same-named images from different flights never collide
+                file_paths.append(str(save_stream(file.stream, upload_path, filename)))
                 processed_files.append(filename)
 
+        # Imported on first upload: the tasks pull in shapely, numpy and the georeferencing code
+        from .tasks import analyze_batch_task, schedule_images
+        if batch_mode and file_paths:
+            # One task keeps several Ollama requests in flight for the whole upload
+            analyze_batch_task.delay(file_paths, batch_id)
+        elif file_paths:
+            # Asynchronous analysis with batch tracking, interleaved with other uploads by priority
+            schedule_images(file_paths, batch_id, request.form.get('priority'))
+
         # Return immediate upload response
         return render_template("index.html", results={
             "status": f"upload {batch_id}",
             "files_count": len(processed_files),
-            "files": processed_files
+            "files": processed_files,
+            "schedule": scheduler.estimate(batch_id)
         })
 
     return render_template("index.html", results=None)
 
 
+# === Chunked Uploads ===
+def _upload_state(state):
+    return {key: state.get(key) for key in ("upload_id", "batch_id", "filename", "size", "offset", "complete",
+                                            "sha256")}
+
+
+@main.errorhandler(UploadError)
+def upload_error(e):
+    body = {"error": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+
+@main.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    Opens a resumable upload: ``{"filename", "size", "batch_id"?, "priority"?}``.
+    Without a ``batch_id`` a new batch is started; pass the returned one for
+    the other files of the same upload.
+    """
+    body = request.get_json(silent=True) or {}
+    batch_id = body.get('batch_id') or str(uuid.uuid4())
+    state = uploads.create(body.get('filename'), body.get('size'), batch_id, body.get('priority'))
+    # The file joins total_expected when it completes: a retried or abandoned POST adds nothing
+    batch_status.start(batch_id, 0)
+    return jsonify({**_upload_state(state), "chunk_size": current_app.config['UPLOAD_CHUNK_SIZE']}), 201
+
+
+@main.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Where to resume: the next chunk must start at ``offset`` (also sent as the Upload-Offset header)."""
+    state = uploads.status(upload_id)
+    return jsonify(_upload_state(state)), 200, {'Upload-Offset': str(state["offset"]), 'Cache-Control': 'no-store'}
+
+
+@main.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """
+    One chunk as the raw request body, starting at the ``Upload-Offset``
+    header. The chunk that completes the file queues it for analysis.
+    """
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        raise UploadError("Upload-Offset header is required")
+    state = uploads.append(upload_id, offset, request.stream, request.content_length)
+    if state["finished"]:
+        batch_status.start(state["batch_id"], 1)
+        from .tasks import schedule_images
+        schedule_images([state["path"]], state["batch_id"], state["priority"])
+    body = _upload_state(state)
+    if state["complete"]:
+        body["schedule"] = scheduler.estimate(state["batch_id"])
+    return jsonify(body), 200, {'Upload-Offset': str(state["offset"])}
+
+
 # === Batch Status ===
 @main.route('/api/batch/<batch_id>/status', methods=['GET'])
-def batch_status(batch_id):
-    # Query database for analysis result entries
-    results = db.session.scalars(
-        select(AnalysisResult).filter_by(batch_id=batch_id)
-    ).all()
+def get_batch_status(batch_id):
+    # Counters come from the batch status store; rebuilt from the database once it has expired
+    status = batch_status.get(batch_id) or batch_status.seed(batch_id, batch_summary(batch_id))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', current_app.config['BATCH_STATUS_PAGE_SIZE'], type=int)
+    per_page = min(max(per_page, 1), current_app.config['BATCH_STATUS_MAX_PAGE_SIZE'])
+    results = batch_results_page(batch_id, page, per_page, limit=per_page + 1)
 
     return jsonify({
         "batch_id": batch_id,
-        "total_expected": request.args.get('total', 0),
-        "completed": len(results),
-        "results": [{"id": r.id, "filename": r.image_filename} for r in results]
+        "status": status.get("status", "unknown"),
+        "total_expected": status.get("total_expected") or request.args.get('total', 0, type=int),
+        "completed": status.get("completed_count", 0),
+        "failed": status.get("failed_count", 0),
+        "total_polygons": status.get("total_polygons", 0),
+        "last_updated": status.get("last_updated"),
+        "schedule": scheduler.estimate(batch_id),
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(results) > per_page,
+        "results": results[:per_page]
     })
 
 
+# === Live Map Events (SSE) ===
+@main.route('/api/map/events', methods=['GET'])
+def map_event_stream():
+    """
+    Server-Sent Events: ``progress`` (batch counters) and ``features`` (polygons
+    newly added to the map), for every batch or only ``?batch_id=``.
+    """
+    return Response(
+        stream_with_context(map_events.stream(request.args.get('batch_id'))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+# === Inference Cache Stats ===
+@main.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    if gemma.cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **gemma.cache.stats()})
+
+
+# === Ollama Endpoint Stats ===
+@main.route('/api/ollama/endpoints', methods=['GET'])
+def ollama_endpoints():
+    return jsonify({"endpoints": gemma.endpoints.stats(), "model_load": gemma.load_stats.stats(),
+                    "circuit": gemma.breaker.stats(), "timeouts": gemma.timeouts.stats()})
+
+
 # === Polygons Endpoint ===
 def feature_has_valid_coords(feature):
     try:
@@ -77,12 +183,35 @@ def feature_has_valid_coords(feature):
     except Exception:
         return False
 
+def parse_bbox(value):
+    """(west, south, east, north) from "west,south,east,north"; None if malformed or out of range."""
+    try:
+        west, south, east, north = (float(v) for v in value.split(","))
+    except ValueError:
+        return None
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        return None
+    return west, south, east, north
+
+
 @main.route('/api/polygons', methods=['GET'])
 def get_polygons():
     """
-    Returns the latest combined polygons GeoJSON from PolygonJSON table.
+    Returns a batch's combined polygons GeoJSON from the PolygonJSON table:
+    ?batch_id=, else the most recently updated batch.
+    With ?bbox=west,south,east,north, returns only the polygons inside that
+    viewport, read through the spatial index (?batch_id= defaults to the newest batch).
     """
-    polygon_json = db.session.scalar(select(PolygonJSON).order_by('created_at'))
+    if request.args.get('bbox') is not None:
+        return get_polygons_in_bbox()
+
+    batch_id = request.args.get('batch_id')
+    if batch_id:
+        polygon_json = db.session.scalar(select(PolygonJSON).filter_by(name=combined_layer_name(batch_id)))
+        if polygon_json is None:
+            return jsonify({"type": "FeatureCollection", "features": []})
+    else:
+        polygon_json = db.session.scalar(select(PolygonJSON).order_by(PolygonJSON.created_at.desc()).limit(1))
     if polygon_json:
         try:
             geojson = json.loads(polygon_json.geojson)
@@ -101,3 +230,20 @@ def get_polygons():
         return jsonify(polygons_json)
 
     return jsonify({"type": "FeatureCollection", "features": []})
+
+
+def get_polygons_in_bbox():
+    from .tasks import _combined_features
+
+    bbox = parse_bbox(request.args['bbox'])
+    if bbox is None:
+        return jsonify({"error": "bbox must be west,south,east,north in degrees"}), 400
+    batch_id = request.args.get('batch_id') or latest_batch_id()
+    limit = current_app.config['MAP_VIEWPORT_MAX_FEATURES']
+    polys = batch_polygons(batch_id, bbox=bbox, limit=limit + 1) if batch_id else []
+    features = [f for f in _combined_features(polys[:limit]) if feature_has_valid_coords(f)]
+    return jsonify({
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": {"batch_id": batch_id, "bbox": list(bbox), "truncated": len(polys) > limit},
+    })
@@ -1,55 +1,204 @@
+import asyncio
 import json
 import uuid
-import math
+import random
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from datetime import datetime
 from pathlib import Path
-from celery import shared_task
+from celery import chain, shared_task
+from flask import current_app
 from celery.exceptions import SoftTimeLimitExceeded, Retry
-from PIL import Image
-from PIL.ExifTags import TAGS
+from celery.utils.time import get_exponential_backoff_interval
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+import orjson
 import requests
-from shapely.geometry import shape
-from shapely.geometry.polygon import orient
 
 
-from .core.metadata_process import get_exif_data, extract_lat_lon, create_circle_polygon
-
-from .core.gemma_client import OllamaGemmaClient
-from .models import db, AnalysisResult, PolygonFeature, PolygonJSON
+from .core.async_gemma_client import AsyncOllamaGemmaClient
+from .core.georef import FLIGHT_ALTITUDE_M, GeoAffine, camera_for, dumps_rings, georeference_rings, rings_bbox
+from .core.image_context import ImageContext, load_image_context
+from .core.resilience import CircuitOpenError
+from .core.tiling import tile_boxes, encode_tile, load_frame, offset_features, merge_tile_features
+from .core.batch_status import COUNTERS
+from .extensions import gemma, batch_status, map_events, scheduler
+from .models import db, AnalysisResult, PolygonJSON, combined_layer_name
+from .persistence import (add_polygons, batch_centers, batch_polygons, batch_summary, checkpoint_response,
+                          claim_result, create_result, discard_polygons, idempotency_key, polygon_row,
+                          resume_persisted, save_result, set_stage)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+STREAM_MAP_UPDATE_INTERVAL = 5  # seconds between map refreshes while streaming
+MAP_EVENT_MAX_FEATURES = 500   # features per live map event
+COMBINED_UPDATE_ATTEMPTS = 3    # compare-and-swap attempts before leaving the append to the next update
+
+
+class DeadLettered(Exception):
+    """The task exhausted its retries and is already on the dead-letter queue: handlers re-raise it as is."""
+
 
 @shared_task(bind=True, soft_time_limit=600, time_limit=720, max_retries=3)
 def analyze_image_task(self, image_path: str, batch_id: str = ""):
-    result = None
+    """All four pipeline stages in one task, for single-queue deployments and eager runs."""
+    context = None
     try:
-        gemma_client = OllamaGemmaClient()
+        # Fail fast before touching the DB while Ollama is known to be down
+        gemma.breaker.check(claim=False)
         self.update_state(state='PROGRESS', meta={'status': 'Starting image analysis...'})
+        context = _preprocess(image_path, batch_id)
+        context = _infer(self, context)
+        context = _postprocess(context)
+        return _aggregate(context)
+
+    except (Retry, DeadLettered):
+        raise
+    except SoftTimeLimitExceeded:
+        _handle_error(_context_result(context), "Processing time limit exceeded")
+        _release_scheduled(batch_id, image_path)
+        raise
+    except CircuitOpenError as exc:
+        raise _defer_while_circuit_open(self, exc)
+    except Exception as exc:
+        raise _retry_with_backoff(self, _context_result(context), exc)
+
+
+def queue_image_analysis(image_path: str, batch_id: str = ""):
+    """Queues one image: as the staged chain when PIPELINE_STAGED is set, else as analyze_image_task."""
+    if current_app.config.get("PIPELINE_STAGED", True):
+        return analyze_image_pipeline(image_path, batch_id).delay()
+    return analyze_image_task.delay(image_path, batch_id)
 
-        # Create DB entry
-        result = AnalysisResult(
-            batch_id=batch_id,
-            image_filename=Path(image_path).name,
-            processing_status="processing"
-        )
-        db.session.add(result)
-        db.session.commit()
 
-        # --- Gemma AI inference ---
-        logger.info(f"Starting analysis for {image_path}")
+def analyze_image_pipeline(image_path: str, batch_id: str = ""):
+    """
+    preprocess -> infer -> postprocess -> aggregate as a Celery chain. Each
+    stage is routed to its own queue (CELERY task_routes), so cheap CPU stages
+    never wait behind GPU-bound inference calls.
+    """
+    return chain(
+        preprocess_image_task.s(image_path, batch_id),
+        infer_image_task.s(),
+        postprocess_image_task.s(),
+        aggregate_image_task.s(),
+    )
+
+
+@shared_task(bind=True, soft_time_limit=60, time_limit=120, max_retries=3)
+def preprocess_image_task(self, image_path: str, batch_id: str = ""):
+    try:
+        return _preprocess(image_path, batch_id)
+    except (Retry, DeadLettered):
+        raise
+    except Exception as exc:
+        raise _retry_with_backoff(self, None, exc)
+
+
+@shared_task(bind=True, soft_time_limit=600, time_limit=720, max_retries=3)
+def infer_image_task(self, context: dict):
+    try:
+        gemma.breaker.check(claim=False)
+        return _infer(self, context)
+    except (Retry, DeadLettered):
+        raise
+    except SoftTimeLimitExceeded:
+        # The chain ends here: let the next scheduled image in
+        _release_scheduled(context["batch_id"], context["image_path"])
+        raise
+    except CircuitOpenError as exc:
+        raise _defer_while_circuit_open(self, exc)
+    except Exception as exc:
+        raise _retry_with_backoff(self, _context_result(context), exc)
+
+
+@shared_task(bind=True, soft_time_limit=120, time_limit=180, max_retries=3)
+def postprocess_image_task(self, context: dict):
+    try:
+        return _postprocess(context)
+    except (Retry, DeadLettered):
+        raise
+    except Exception as exc:
+        raise _retry_with_backoff(self, _context_result(context), exc)
+
+
+@shared_task(bind=True, soft_time_limit=300, time_limit=360)
+def aggregate_image_task(self, context: dict):
+    try:
+        return _aggregate(context)
+    except Exception:
+        _release_scheduled(context["batch_id"], context["image_path"])
+        raise
+
+
+def _preprocess(image_path, batch_id):
+    """
+    Claims the image's result row (keyed by batch and image hash, so retries and
+    redeliveries reuse it) and checks the inference cache, unless an earlier
+    attempt already checkpointed the model response. Returns the pipeline context.
+    """
+    logger.info(f"Starting analysis for {image_path}")
+    image = load_image_context(image_path)
+    result_id, stage, response = claim_result(batch_id, Path(image_path).name,
+                                              idempotency_key(batch_id, image.content_hash))
+    tiling = _tiling_settings(current_app.config)
+    cache_key = None
+    if stage == "created":
+        cache_key, response = gemma.lookup_cache(image_path, variant=tiling, image_hash=image.content_hash)
+        if response is not None:
+            logger.info(f"Inference cache hit for {image_path}")
+    return {"image_path": image_path, "batch_id": batch_id, "result_id": result_id, "image": image.to_dict(),
+            "tiling": tiling, "cache_key": cache_key, "response": response, "streamed": 0, "stage": stage}
+
+
+def _infer(task, context):
+    """
+    Gemma inference (skipped on a cache hit or a checkpoint); adds ``response``
+    to the context and checkpoints it on the result row.
+    """
+    if context.get("stage", "created") != "created":
+        return context
+    image_path, batch_id = context["image_path"], context["batch_id"]
+    result = _context_result(context)
+    response = context["response"]
+    streamed = []  # polygons already persisted by streaming mode
+    if response is None:
+        # Hand the connection back to the pool for the minutes Ollama takes (the row reloads
+        # on next access): thread and gevent workers run many inferences in one process
+        db.session.commit()
         try:
-            self.update_state(state='PROGRESS', meta={'status': 'Calling Ollama API...'})
-            response = gemma_client.analyze_disaster_image(image_path)
+            task.update_state(state='PROGRESS', meta={'status': 'Calling Ollama API...'})
+            if context["tiling"]:
+                response = _tiled_inference(gemma, image_path, context["tiling"], context["cache_key"])
+            elif gemma.stream:
+                if discard_polygons(result.id):
+                    # A retry of a broken stream: replay it from scratch, without the first attempt's polygons
+                    logger.info(f"Discarded polygons of an earlier stream for {image_path}")
+                    rebuild_combined_polygons(batch_id)
+                response = _stream_inference(task, gemma, result, ImageContext.from_dict(context["image"]),
+                                             batch_id, context["cache_key"], streamed)
+            else:
+                response = gemma.analyze_disaster_image(image_path, cache_key=context["cache_key"])
             logger.info(f"Ollama request completed for {image_path}")
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-            _handle_error(result, f"Ollama API error: {e}")
-            raise self.retry(countdown=60, exc=e)
+        except requests.exceptions.RequestException as e:
+            if streamed:
+                # Keep what the broken stream already delivered instead of retrying
+                logger.warning(f"Ollama stream broke for {image_path}, "
+                               f"keeping {len(streamed)} streamed polygons: {e}")
+                response = {"features": [], "partial": True}
+            elif isinstance(e, CircuitOpenError):
+                _handle_error(result, f"Ollama API error: {e}")
+                raise _defer_while_circuit_open(task, e)
+            elif isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+                _handle_error(result, f"Ollama API error: {e}")
+                raise _retry_with_backoff(task, result, e)
+            else:
+                _handle_error(result, f"Unexpected Ollama error: {e}")
+                raise
         except SoftTimeLimitExceeded:
             _handle_error(result, "Soft time limit exceeded")
             raise
@@ -57,75 +206,352 @@ def analyze_image_task(self, image_path: str, batch_id: str = ""):
             _handle_error(result, f"Unexpected Ollama error: {e}")
             raise
 
-        features = response.get("features", [])
-        if not features:
-            _handle_error(result, "No features found in response")
-            raise ValueError("No features found in response")
+    if not response.get("features") and not streamed:
+        _handle_error(result, "No features found in response")
+        raise ValueError("No features found in response")
+
+    if not streamed:
+        # Streamed polygons are already rows; a retry before postprocess re-streams instead
+        checkpoint_response(result.id, response)
+        return {**context, "response": response, "stage": "inferred"}
+    return {**context, "response": response, "streamed": len(streamed)}
+
+
+def _postprocess(context):
+    """Georeferences and persists the polygons (unless streaming already did) with the final status, in one transaction."""
+    if context.get("stage") in ("persisted", "aggregated"):
+        status, polygons_count = resume_persisted(context["result_id"])
+        return {"status": status, "result_id": context["result_id"], "batch_id": context["batch_id"],
+                "image_path": context["image_path"], "polygons_count": polygons_count}
+
+    response = context["response"]
+    status = "partial" if response.get("partial") else "completed"
+    if context["streamed"]:
+        polygons_count = context["streamed"]
+        save_result(context["result_id"], status)
+    else:
+        center_lat, center_lon, polygons = _georeference_response(response, ImageContext.from_dict(context["image"]))
+        save_result(context["result_id"], status, polygons, center_lat, center_lon)
+        polygons_count = len(polygons)
+
+    batch_status.record_result(context["batch_id"], status, polygons_count)
+    logger.info(f"Analysis {status}: {polygons_count} polygons processed")
+    return {"status": status, "result_id": context["result_id"],
+            "batch_id": context["batch_id"], "image_path": context["image_path"], "polygons_count": polygons_count}
+
+
+def _aggregate(summary):
+    """Updates the combined map layer and notifies the map."""
+    update_combined_polygons(summary["batch_id"])
+    set_stage(summary["result_id"], "aggregated")
+    trigger_map_update.delay(summary["batch_id"])
+    _release_scheduled(summary["batch_id"], summary["image_path"])
+    return summary
+
+
+def schedule_images(image_paths, batch_id, priority=None):
+    """Queues an upload through the fair-share scheduler, or straight to Celery when it is disabled."""
+    if not current_app.config.get("SCHEDULER_ENABLED", False):
+        for image_path in image_paths:
+            queue_image_analysis(image_path, batch_id)
+        return
+    try:
+        scheduler.submit(batch_id, image_paths, priority)
+    except Exception as e:
+        # No scheduler state (e.g. Redis down): plain FIFO beats losing the upload
+        logger.error(f"Scheduler unavailable, queuing batch {batch_id} directly: {e}")
+        for image_path in image_paths:
+            queue_image_analysis(image_path, batch_id)
+        return
+    try:
+        scheduler.dispatch(queue_image_analysis)
+    except Exception as e:
+        logger.error(f"Scheduler dispatch for batch {batch_id} failed, images stay scheduled: {e}")
+
 
-        # Compute center of polygons (fallback if EXIF fails)
-        # center_lat, center_lon = calculate_centroid(features)
-        # result.center_lat = center_lat
-        # result.center_lon = center_lon
+@shared_task
+def dispatch_scheduled_images():
+    """Frees the slots of images whose tasks were lost and queues the images waiting behind them."""
+    if not current_app.config.get("SCHEDULER_ENABLED", False):
+        return 0
+    return scheduler.dispatch(queue_image_analysis)
 
-        try:
-            image = Image.open(image_path)
-            exif = get_exif_data(image)
-            lat, lon = extract_lat_lon(exif)
-            if lat is not None and lon is not None:
-                center_lat, center_lon = lat, lon   # <-- Use EXIF GPS here!
-            else:
-                center_lat, center_lon = calculate_centroid(features)  # Fallback
-        except Exception as e:
-            logger.warning(f"Could not extract EXIF GPS: {e}")
-            center_lat, center_lon = calculate_centroid(features)
-        result.center_lat = center_lat
-        result.center_lon = center_lon
-
-        # Process Gemma polygons only
-        polygons = []
-        for i, feat in enumerate(features):
+
+def _task_image(task):
+    """(batch_id, image_path) a pipeline task works on, read from its arguments."""
+    args, kwargs = list(task.request.args or ()), task.request.kwargs or {}
+    if args and isinstance(args[0], dict):
+        return args[0].get("batch_id", ""), args[0].get("image_path")
+    image_path = args[0] if args else kwargs.get("image_path")
+    return (args[1] if len(args) > 1 else kwargs.get("batch_id", "")), image_path
+
+
+def _release_scheduled(batch_id, image_path):
+    """Frees the image's scheduler slot and lets the next scheduled image in."""
+    if not current_app.config.get("SCHEDULER_ENABLED", False):
+        return
+    try:
+        scheduler.finished(batch_id, image_path)
+        scheduler.dispatch(queue_image_analysis)
+    except Exception as e:
+        logger.error(f"Scheduler dispatch after {image_path} failed: {e}")
+
+
+def _context_result(context):
+    if not context:
+        return None
+    return db.session.get(AnalysisResult, context["result_id"])
+
+
+def _retry_with_backoff(task, result, exc):
+    """
+    Schedules a retry after an exponential backoff with full jitter, so failed
+    images do not come back in lockstep. Once retries are exhausted the task is
+    moved to the dead-letter queue and DeadLettered is returned for the caller to raise.
+    """
+    config = current_app.config
+    if task.request.retries >= task.max_retries:
+        _dead_letter(task, result, exc)
+        error = DeadLettered(f"{type(exc).__name__}: {exc}")
+        error.__cause__ = exc
+        return error
+    countdown = get_exponential_backoff_interval(
+        config.get("TASK_RETRY_BACKOFF", 30), task.request.retries,
+        config.get("TASK_RETRY_BACKOFF_MAX", 900), full_jitter=True)
+    logger.info(f"Retrying {task.name} in {countdown}s (attempt {task.request.retries + 1}/{task.max_retries})")
+    return task.retry(exc=exc, countdown=countdown, throw=False)
+
+
+def _defer_while_circuit_open(task, exc):
+    """
+    Re-sends the task for after the circuit breaker cooldown, without spending
+    one of its retries (nor giving back those already spent): an Ollama outage
+    is not the image's fault.
+    """
+    if task.request.is_eager:
+        return _retry_with_backoff(task, None, exc)
+    countdown = exc.retry_in + random.uniform(0, exc.retry_in / 2 + 1)
+    signature = task.signature_from_request(countdown=countdown, retries=task.request.retries)
+    signature.apply_async()
+    logger.info(f"Ollama circuit open, {task.name} deferred by {countdown:.0f}s")
+    return Retry(exc=exc, when=countdown, sig=signature)
+
+
+def _dead_letter(task, result, exc):
+    """Parks a task that exhausted its retries on DEAD_LETTER_QUEUE, which no worker consumes by default."""
+    queue = current_app.config.get("DEAD_LETTER_QUEUE", "dead_letter")
+    reason = f"{type(exc).__name__}: {exc}"
+    logger.error(f"{task.name}{tuple(task.request.args or ())} exhausted {task.max_retries} retries, "
+                 f"moving it to '{queue}': {reason}")
+    batch_id, image_path = _task_image(task)
+    if result is not None:
+        result.processing_status = "dead_letter"
+        result.error_message = reason
+        db.session.commit()
+        batch_id = result.batch_id
+    if image_path is not None:
+        # Also when the image never got a result row (e.g. unreadable in preprocess)
+        batch_status.record_result(batch_id, "dead_letter")
+        _release_scheduled(batch_id, image_path)
+    if not task.request.is_eager:
+        # Same arguments and remaining chain, fresh id and retry budget
+        task.signature_from_request(
+            queue=queue, retries=0, task_id=str(uuid.uuid4()),
+            headers={"dead_letter_reason": reason, "dead_letter_task_id": task.request.id},
+        ).apply_async()
+
+
+@shared_task(bind=True, max_retries=0)
+def analyze_batch_task(self, image_paths: list, batch_id: str = ""):
+    """
+    Analyzes a whole upload in one task with AsyncOllamaGemmaClient, so a
+    single worker slot keeps several Ollama requests in flight. Results are
+    persisted in completion order; images that fail are re-queued through
+    queue_image_analysis, whose tasks own the retry policy.
+    """
+    async_client = AsyncOllamaGemmaClient.from_config(gemma, current_app.config)
+    completed, failed, handled = 0, [], set()
+
+    async def run():
+        nonlocal completed
+        async for image_path, response in async_client.iter_analyze_images(image_paths):
+            handled.add(image_path)
+            if isinstance(response, Exception) or not response.get("features"):
+                failed.append(image_path)
+                continue
             try:
-                props = feat.get("properties", {})
-                coords = feat.get("geometry", {}).get("coordinates", [])
-                if not coords:
-                    logger.warning(f"Empty coordinates for feature {i}")
+                image = load_image_context(image_path)
+                center_lat, center_lon, polygons = _georeference_response(response, image)
+                if create_result(batch_id, Path(image_path).name, "completed", polygons, center_lat, center_lon,
+                                 key=idempotency_key(batch_id, image.content_hash)) is None:
+                    logger.info(f"Batch {batch_id}: {image_path} already has a result, skipping")
                     continue
-
-                # Transform to map coordinates (approx from image space)
-                transformed_coords = transform_coordinates_to_geo(coords, center_lat, center_lon, image_path)
-                polygons.append(
-                    PolygonFeature(
-                        polygon_id=props.get("id", f"poly_{i}"),
-                        damage_type=props.get("damage_type", "unknown"),
-                        confidence=float(props.get("confidence", 0.0)),
-                        class_label=props.get("class", ""),
-                        notes=props.get("notes", ""),
-                        coordinates=json.dumps(transformed_coords)
-                    )
-                )
             except Exception as e:
-                logger.error(f"Error processing feature {i}: {e}")
+                # One bad image must not cost the rest of the upload
+                logger.error(f"Batch {batch_id}: could not persist {image_path}: {e}")
+                failed.append(image_path)
                 continue
+            batch_status.record_result(batch_id, "completed", len(polygons))
+            completed += 1
+            logger.info(f"Batch {batch_id}: {image_path} completed with {len(polygons)} polygons")
+            self.update_state(state='PROGRESS', meta={'status': 'Analyzing batch...',
+                                                      'completed': completed, 'total': len(image_paths)})
+            update_combined_polygons(batch_id)
 
-        result.polygons = polygons
-        result.processing_status = "completed"
-        db.session.commit()
-        logger.info(f"Analysis completed: {len(polygons)} polygons processed")
+    try:
+        asyncio.run(run())
+    finally:
+        # Failed images, and any the batch never got to if it was cut short, get single-image tasks
+        failed.extend(path for path in image_paths if path not in handled)
+        for image_path in failed:
+            logger.warning(f"Batch {batch_id}: re-queuing {image_path} as a single-image task")
+            queue_image_analysis(image_path, batch_id)
+
+    if completed:
+        trigger_map_update.delay(batch_id)
+    return {"status": "completed", "batch_id": batch_id,
+            "completed_count": completed, "requeued_count": len(failed)}
+
+
+def _georeference_response(response, image: ImageContext):
+    """Georeferences a full model response. Returns (center_lat, center_lon, polygon rows)."""
+    # Features the client could not validate come back as None: skip those, keep the others
+    numbered = [(i, feat) for i, feat in enumerate(response.get("features") or []) if isinstance(feat, dict)]
+    features = [feat for _, feat in numbered]
+    if image.has_gps:
+        center_lat, center_lon = image.lat, image.lon   # <-- Use EXIF GPS here!
+    else:
+        center_lat, center_lon = calculate_centroid(features)  # Fallback
+    # Model pixel coordinates refer to the downscaled image sent to Ollama
+    model_size = response.get("image_size", {}).get("model")
+    geo_coords = _georeference_features(features, image, center_lat, center_lon, model_size)
+
+    # Process Gemma polygons only
+    polygons = []
+    for (i, feat), coords in zip(numbered, geo_coords):
+        polygon = _polygon_row(feat, i, coords)
+        if polygon is not None:
+            polygons.append(polygon)
+    return center_lat, center_lon, polygons
+
+
+def _tiling_settings(config):
+    """Tile settings from TILE_* config, or None when tiling is disabled."""
+    if not config.get("TILING_ENABLED", False):
+        return None
+    return {
+        "tile_size": config.get("TILE_SIZE", 1024),
+        "tile_overlap": config.get("TILE_OVERLAP", 128),
+        "tile_merge_overlap": config.get("TILE_MERGE_OVERLAP", 0.3),
+        "tile_concurrency": config.get("TILE_CONCURRENCY", 2),
+    }
+
+
+def _tiled_inference(gemma_client, image_path, tiling, cache_key=None):
+    """
+    Runs inference on overlapping tiles of the full-resolution frame in parallel.
+    Tile coordinates are offset back to full-frame pixels and duplicates across
+    overlaps are merged, so the result looks like a single full-resolution answer.
+    """
+    frame = load_frame(image_path)
+    tiles = tile_boxes(frame.size, tiling["tile_size"], tiling["tile_overlap"])
+    logger.info(f"Tiled inference for {image_path}: {len(tiles)} tiles of {tiling['tile_size']}px")
+
+    def analyze_tile(tile):
+        tile_bytes, model_size = encode_tile(frame, tile, gemma_client.image_max_edge, gemma_client.image_quality)
+        response = gemma_client.analyze_image_bytes(tile_bytes, {"original": list(tile.size),
+                                                                 "model": list(model_size)})
+        return offset_features(response.get("features") or [], tile, model_size)
+
+    features = []
+    with ThreadPoolExecutor(max_workers=tiling["tile_concurrency"]) as pool:
+        for tile_features in pool.map(analyze_tile, tiles):
+            features.extend(tile_features)
+
+    full_size = list(frame.size)
+    response = {
+        "type": "FeatureCollection",
+        "features": merge_tile_features(features, tiling["tile_merge_overlap"]),
+        "image_size": {"original": full_size, "model": full_size},
+        "tiles": len(tiles),
+    }
+    if gemma_client.cache is not None and cache_key:
+        gemma_client.cache.set(cache_key, response)
+    return response
+
+
+def _georeference_features(features, image: ImageContext, center_lat, center_lon, model_size):
+    """
+    Lon/lat coordinates for every feature, transformed in one NumPy pass with
+    the camera model of the image. Coordinates that cannot be transformed are
+    kept as the model returned them.
+    """
+    raw = [_feature_coordinates(feat) for feat in features]
+    # If the center is 0,0 we assume Gemma already outputs relative offsets near 0,0
+    if center_lat == 0.0 and center_lon == 0.0:
+        return raw
+    camera = camera_for(image, current_app.config.get("GEOREF_FLIGHT_ALTITUDE_M", FLIGHT_ALTITUDE_M))
+    affine = GeoAffine.for_image(camera, image.size, center_lat, center_lon, model_size)
+    transformed = georeference_rings(raw, affine)
+    return [geo if geo is not None else coords for geo, coords in zip(transformed, raw)]
 
-        # Update combined polygons for map
-        update_combined_polygons(batch_id)
 
-        # Trigger map update event
-        trigger_map_update.delay(batch_id)
+def _feature_coordinates(feat):
+    """A feature's geometry coordinates, [] when the feature or its geometry is malformed."""
+    geometry = feat.get("geometry") if isinstance(feat, dict) else None
+    coords = geometry.get("coordinates") if isinstance(geometry, dict) else None
+    return coords if isinstance(coords, list) else []
 
-        return {"status": "completed", "result_id": result.id,
-                "batch_id": batch_id, "polygons_count": len(polygons)}
 
-    except SoftTimeLimitExceeded:
-        _handle_error(result, "Processing time limit exceeded")
-        raise
-    except Exception as exc:
-        raise self.retry(exc=exc, countdown=60)
+def _polygon_row(feat, i, transformed_coords):
+    """PolygonFeature column values for a model feature and its georeferenced coordinates; None if unusable."""
+    try:
+        props = feat.get("properties", {})
+        if not transformed_coords:
+            logger.warning(f"Empty coordinates for feature {i}")
+            return None
+
+        return polygon_row(
+            polygon_id=props.get("id", f"poly_{i}"),
+            damage_type=props.get("damage_type", "unknown"),
+            confidence=float(props.get("confidence", 0.0)),
+            class_label=props.get("class", ""),
+            notes=props.get("notes", ""),
+            coordinates=dumps_rings(transformed_coords),
+            bbox=rings_bbox(transformed_coords)
+        )
+    except Exception as e:
+        logger.error(f"Error processing feature {i}: {e}")
+        return None
+
+
+def _stream_inference(task, gemma_client, result, image: ImageContext, batch_id, cache_key, streamed):
+    """
+    Runs streaming inference and persists each feature as soon as it is parsed,
+    appending it to ``streamed``. Georeferencing on the fly needs EXIF GPS;
+    without it, features are post-processed from the full response instead.
+    """
+    center_lat, center_lon = image.lat, image.lon
+    result_id = result.id
+    last_map_update = time.monotonic()
+
+    def on_feature(feat, image_size):
+        nonlocal last_map_update
+        if center_lat is None or center_lon is None:
+            return
+        coords = _georeference_features([feat], image, center_lat, center_lon, image_size["model"])[0]
+        polygon = _polygon_row(feat, len(streamed), coords)
+        if polygon is None:
+            return
+        add_polygons(result_id, [polygon], center_lat, center_lon)
+        streamed.append(polygon)
+        task.update_state(state='PROGRESS', meta={'status': 'Streaming features...',
+                                                  'features_done': len(streamed)})
+        if time.monotonic() - last_map_update >= STREAM_MAP_UPDATE_INTERVAL:
+            update_combined_polygons(batch_id)
+            last_map_update = time.monotonic()
+
+    return gemma_client.analyze_disaster_image_stream(image.path, on_feature, cache_key=cache_key)
 
 
 def _handle_error(result, message):
@@ -137,6 +563,8 @@ def _handle_error(result, message):
 
 
 def extract_gps_coordinates(image_path):
+    from PIL import Image
+    from PIL.ExifTags import TAGS
     try:
         with Image.open(image_path) as image:
             exifdata = image.getexif()
@@ -194,38 +622,26 @@ def is_valid_latlon(lat, lon):
     return -90 <= lat <= 90 and -180 <= lon <= 180
 
 
-def transform_coordinates_to_geo(coords, center_lat, center_lon, image_path):
-    original_width = 4000
-    # resize_width = 512
-    FLIGHT_ALTITUDE_M = 120
-    SENSOR_WIDTH_MM = 6.3
-    FOCAL_LENGTH_MM = 4.73
-    GSD_fullres = (SENSOR_WIDTH_MM * FLIGHT_ALTITUDE_M) / (FOCAL_LENGTH_MM * original_width)
-    # meters_per_pixel = GSD_fullres * (original_width / resize_width)
-    meters_per_pixel = GSD_fullres
-
-
+def transform_coordinates_to_geo(coords, center_lat, center_lon, image_path, model_size=None, image_size=None):
+    """
+    Maps model pixel coordinates to lon/lat around the image center.
+    model_size is the (width, height) the model saw; coordinates are scaled
+    back to the full-resolution frame before applying the ground sample distance.
+    image_size (from ImageContext) avoids reopening image_path to read the frame size.
+    Single-feature form of _georeference_features, with the default camera model.
+    """
     # If the center is 0,0 we assume Gemma already outputs relative offsets near 0,0
     if center_lat == 0.0 and center_lon == 0.0:
         return coords  # keep Gemma's output as-is (already normalized)
 
     try:
-        with Image.open(image_path) as img:
-            original_width, original_height = img.size
-
-        transformed_coords = []
-        for coord_ring in coords:
-            transformed_ring = []
-            for coord_pair in coord_ring:
-                if len(coord_pair) >= 2:
-                    pixel_x, pixel_y = float(coord_pair[0]), float(coord_pair[1])
-                    dx_meters = (pixel_x - original_width / 2) * meters_per_pixel
-                    dy_meters = (pixel_y - original_height / 2) * meters_per_pixel
-                    lat_offset = dy_meters / 111320.0
-                    lon_offset = dx_meters / (111320.0 * math.cos(math.radians(center_lat)))
-                    transformed_ring.append([center_lon + lon_offset, center_lat + lat_offset])
-            transformed_coords.append(transformed_ring)
-        return transformed_coords
+        if not image_size:
+            from PIL import Image
+            with Image.open(image_path) as img:
+                image_size = img.size
+        affine = GeoAffine.for_image(camera_for(None), image_size, center_lat, center_lon, model_size)
+        transformed = georeference_rings([coords], affine)[0]
+        return [ring.tolist() for ring in transformed] if transformed is not None else coords
     except Exception as e:
         logger.error(f"Error transforming coordinates for {image_path}: {e}")
         return coords
@@ -242,94 +658,182 @@ def normalize_polygon(coords):
     return coords
 
 
+def _publish_map_update(batch_id, status):
+    """
+    Pushes the batch's progress and the polygons added since the last push
+    (watermark ``published_polygon_id`` in the batch status) to live map clients.
+    """
+    published = int(status.get("published_polygon_id") or 0)
+    polys = batch_polygons(batch_id, after_id=published)
+    features = _combined_features(polys)
+    for start in range(0, len(features), MAP_EVENT_MAX_FEATURES):
+        map_events.publish("features", {"batch_id": batch_id,
+                                         "features": features[start:start + MAP_EVENT_MAX_FEATURES]})
+    if polys:
+        batch_status.set(batch_id, published_polygon_id=polys[-1].id)
+    map_events.publish("progress", {"batch_id": batch_id, **{k: status.get(k, 0) for k in COUNTERS}})
+
+
 def update_combined_polygons(batch_id):
-    from datetime import datetime
+    """
+    Appends the batch's polygons added since the last update to the batch's
+    combined layer and folds the batch's image centers not counted yet
+    (with or without polygons) into the running center average.
+    Only the new polygons are validated, so an N-image batch costs O(N) overall,
+    however its images interleave with other batches'. Builds the layer when
+    the batch has none yet.
+    """
     try:
-        # Query polygon features for this batch
-        polys = (
-            db.session.query(PolygonFeature)
-            .join(AnalysisResult)
-            .filter(AnalysisResult.batch_id == batch_id)
-            .all()
-        )
+        for _ in range(COMBINED_UPDATE_ATTEMPTS):
+            existing = PolygonJSON.query.filter_by(name=combined_layer_name(batch_id)).first()
+            geojson = orjson.loads(existing.geojson) if existing else {}
+            aggregate = geojson.get("properties", {}).get("aggregate", {})
+            if aggregate.get("batch_id") != batch_id:
+                rebuild_combined_polygons(batch_id)
+                return
+
+            # PolygonFeature ids grow in commit order (SQLite serializes writers)
+            polys = batch_polygons(batch_id, after_id=aggregate["last_polygon_id"])
+            # Centers come from the result rows, so images without polygons count too
+            centers_before = aggregate["center_count"]
+            _add_centers(geojson["properties"], batch_centers(batch_id))
+            if not polys and aggregate["center_count"] == centers_before:
+                return
+
+            features = _combined_features(polys)
+            geojson["features"].extend(features)
+            if polys:
+                aggregate["last_polygon_id"] = polys[-1].id
+
+            # Compare-and-swap on created_at, so concurrent workers never drop each other's append
+            stored = db.session.execute(
+                update(PolygonJSON)
+                .where(PolygonJSON.id == existing.id, PolygonJSON.created_at == existing.created_at)
+                .values(geojson=orjson.dumps(geojson).decode("utf-8"), created_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if stored:
+                logger.info(f"PolygonJSON appended {len(features)} features "
+                            f"({len(geojson['features'])} total)")
+                return
+        logger.warning(f"PolygonJSON kept changing under batch {batch_id}; leaving it to the next update")
+    except Exception as e:
+        logger.error(f"Error updating combined polygons: {e}")
+        db.session.rollback()
 
-        features = []
-        for p in polys:
-            try:
-                coords = normalize_polygon(json.loads(p.coordinates))
-                poly_shape = shape({"type": "Polygon", "coordinates": coords})
-                if not poly_shape.is_valid or poly_shape.is_empty:
-                    logger.warning(f"Skipping invalid polygon id={p.id}")
-                    continue
 
-                poly_shape = orient(poly_shape, sign=1.0)
-                coords = [list(poly_shape.exterior.coords)]
-
-                features.append({
-                    "type": "Feature",
-                    "properties": {
-                        "id": p.polygon_id,
-                        "damage_type": p.damage_type,
-                        "class": p.class_label,
-                        "confidence": p.confidence,
-                        "notes": p.notes,
-                        "created_at": p.created_at.isoformat()
-                    },
-                    "geometry": {"type": "Polygon", "coordinates": coords}
-                })
-            except Exception as e:
-                logger.error(f"Failed to process polygon {p.id}: {e}")
-                continue
+@shared_task(bind=True, soft_time_limit=300, time_limit=360)
+def compact_combined_polygons(self, batch_id):
+    """Rebuilds the combined layer from scratch (e.g. after polygons were edited or deleted)."""
+    rebuild_combined_polygons(batch_id)
+    return {"status": "compacted", "batch_id": batch_id}
+
 
-        geojson = {"type": "FeatureCollection", "features": features}
+def rebuild_combined_polygons(batch_id):
+    """Full rebuild of the batch's combined layer from every polygon of the batch."""
+    try:
+        # Query polygon features for this batch
+        polys = batch_polygons(batch_id)
+        features = _combined_features(polys)
+
+        geojson = {
+            "type": "FeatureCollection",
+            "features": features,
+            "properties": {
+                "aggregate": {"batch_id": batch_id, "last_polygon_id": polys[-1].id if polys else 0,
+                              "center_count": 0, "result_ids": []}
+            },
+        }
 
         # Calculate centroid from all image EXIF centers (from AnalysisResult for this batch)
-        results = db.session.query(AnalysisResult).filter_by(batch_id=batch_id).all()
-        centers = [(r.center_lat, r.center_lon) for r in results
-                   if r.center_lat is not None and r.center_lon is not None]
-        if centers:
-            center_lat = sum(pt[0] for pt in centers) / len(centers)
-            center_lon = sum(pt[1] for pt in centers) / len(centers)
-            geojson["properties"] = {
-                "center_lat": center_lat,
-                "center_lon": center_lon
-            }
-
-        # Update or add to PolygonJSON table
-        existing = PolygonJSON.query.filter_by(name="latest").first()
+        _add_centers(geojson["properties"], batch_centers(batch_id))
+
+        # Update or add the batch's row in the PolygonJSON table
+        name = combined_layer_name(batch_id)
+        existing = PolygonJSON.query.filter_by(name=name).first()
         if existing:
-            existing.geojson = json.dumps(geojson)
+            existing.geojson = orjson.dumps(geojson).decode("utf-8")
             existing.created_at = datetime.utcnow()
         else:
-            db.session.add(PolygonJSON(name="latest", geojson=json.dumps(geojson)))
-        db.session.commit()
-        logger.info(f"PolygonJSON updated: {len(features)} features")
+            db.session.add(PolygonJSON(name=name, geojson=orjson.dumps(geojson).decode("utf-8")))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created the batch's layer first: append to it instead
+            db.session.rollback()
+            update_combined_polygons(batch_id)
+            return
+        logger.info(f"PolygonJSON rebuilt for batch {batch_id}: {len(features)} features")
     except Exception as e:
-        logger.error(f"Error updating combined polygons: {e}")
+        logger.error(f"Error rebuilding combined polygons: {e}")
         db.session.rollback()
 
 
+def _combined_features(polys):
+    """Validated, counter-clockwise GeoJSON features for the map layer."""
+    from shapely.geometry import shape
+    from shapely.geometry.polygon import orient
+    features = []
+    for p in polys:
+        try:
+            coords = normalize_polygon(json.loads(p.coordinates))
+            poly_shape = shape({"type": "Polygon", "coordinates": coords})
+            if not poly_shape.is_valid or poly_shape.is_empty:
+                logger.warning(f"Skipping invalid polygon id={p.id}")
+                continue
+
+            poly_shape = orient(poly_shape, sign=1.0)
+            coords = [list(poly_shape.exterior.coords)]
+
+            features.append({
+                "type": "Feature",
+                "properties": {
+                    "uid": p.id,
+                    "id": p.polygon_id,
+                    "damage_type": p.damage_type,
+                    "class": p.class_label,
+                    "confidence": p.confidence,
+                    "notes": p.notes,
+                    "created_at": p.created_at.isoformat()
+                },
+                "geometry": {"type": "Polygon", "coordinates": coords}
+            })
+        except Exception as e:
+            logger.error(f"Failed to process polygon {p.id}: {e}")
+            continue
+    return features
+
+
+def _add_centers(properties, results):
+    """Folds image EXIF centers not seen yet into the running center_lat/center_lon average."""
+    aggregate = properties["aggregate"]
+    counted = set(aggregate["result_ids"])
+    for r in results:
+        if r.id in counted or r.center_lat is None or r.center_lon is None:
+            continue
+        aggregate["center_count"] += 1
+        n = aggregate["center_count"]
+        lat, lon = properties.get("center_lat", 0.0), properties.get("center_lon", 0.0)
+        properties["center_lat"] = lat + (r.center_lat - lat) / n
+        properties["center_lon"] = lon + (r.center_lon - lon) / n
+        aggregate["result_ids"].append(r.id)
+        counted.add(r.id)
+
+
 @shared_task(bind=True, soft_time_limit=60, time_limit=120)
 def trigger_map_update(self, batch_id):
     try:
         from flask import current_app
-        from sqlalchemy import select
         with current_app.app_context():
-            results = db.session.scalars(
-                select(AnalysisResult).filter_by(batch_id=batch_id, processing_status="completed")
-            ).all()
-
-            if results:
-                batch_summary = {
-                    "batch_id": batch_id,
-                    "completed_count": len(results),
-                    "total_polygons": sum(len(r.polygons) for r in results),
-                    "last_updated": datetime.now().isoformat(),
-                    "status": "updated"
-                }
-                update_batch_status(batch_id, batch_summary)
-                logger.info(f"Map update triggered for batch {batch_id}: {len(results)} results processed")
-                return {"status": "success", "batch_id": batch_id, "results_count": len(results)}
+            status = batch_status.get(batch_id) or batch_status.seed(batch_id, batch_summary(batch_id))
+            completed = status.get("completed_count", 0)
+
+            if completed:
+                batch_status.set(batch_id, status="updated", last_map_update=datetime.now().isoformat())
+                batch_status.export_snapshot(batch_id)
+                _publish_map_update(batch_id, status)
+                logger.info(f"Map update triggered for batch {batch_id}: {completed} results processed")
+                return {"status": "success", "batch_id": batch_id, "results_count": completed}
             else:
                 logger.info(f"No completed results found for batch {batch_id}")
                 return {"status": "no_results", "batch_id": batch_id}
@@ -341,16 +845,3 @@ def trigger_map_update(self, batch_id):
             'batch_id': batch_id
         })
         return {"status": "error", "batch_id": batch_id, "error": str(e)}
-
-
-def update_batch_status(batch_id, status_data):
-    try:
-        from pathlib import Path
-        status_dir = Path("batch_status")
-        status_dir.mkdir(exist_ok=True)
-        status_file = status_dir / f"{batch_id}.json"
-        with open(status_file, 'w') as f:
-            json.dump(status_data, f, indent=2)
-        logger.info(f"Batch status updated: {status_file}")
-    except Exception as e:
-        logger.error(f"Error updating batch status: {e}")
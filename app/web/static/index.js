@@ -80,37 +80,60 @@ function fixFeatures(data) {
     };
 }
 
-function renderMap(data) {
-    const geoLayer = L.geoJSON(data, {
-        pointToLayer: function (feature, latlng) {
-            const clsKey = normalizeClassName(feature.properties.class);
-            return L.circleMarker(latlng, {
-                radius: 6,
-                color: classColorMap[clsKey] || "#FF00FF",
-                fillColor: classColorMap[clsKey] || "#FF00FF",
-                fillOpacity: 0.9
-            });
-        },
-        style: function (feature) {
-            const clsKey = normalizeClassName(feature.properties.class);
-            return {
-                color: classColorMap[clsKey] || "#FF00FF",
-                fillColor: classColorMap[clsKey] || "#FF00FF",
-                fillOpacity: 0.5,
-                weight: 2
-            };
-        },
-        onEachFeature: function (feature, layer) {
-            const props = feature.properties || {};
-            let popup = `<strong>Class:</strong> ${props.class || 'N/A'}`;
-            if (props.confidence !== undefined) popup += `<br><strong>Confidence:</strong> ${props.confidence}`;
-            if (props.notes) popup += `<br><strong>Notes:</strong> ${props.notes}`;
-            if (props.created_at) popup += `<br><small><em>${props.created_at}</em></small>`;
-            layer.bindPopup(popup);
-        }
+// === Map Layer ===
+// One layer for the whole session; live events add to it instead of refetching
+const seenFeatures = new Set();
+
+const geoLayer = L.geoJSON(null, {
+    pointToLayer: function (feature, latlng) {
+        const clsKey = normalizeClassName(feature.properties.class);
+        return L.circleMarker(latlng, {
+            radius: 6,
+            color: classColorMap[clsKey] || "#FF00FF",
+            fillColor: classColorMap[clsKey] || "#FF00FF",
+            fillOpacity: 0.9
+        });
+    },
+    style: function (feature) {
+        const clsKey = normalizeClassName(feature.properties.class);
+        return {
+            color: classColorMap[clsKey] || "#FF00FF",
+            fillColor: classColorMap[clsKey] || "#FF00FF",
+            fillOpacity: 0.5,
+            weight: 2
+        };
+    },
+    onEachFeature: function (feature, layer) {
+        const props = feature.properties || {};
+        let popup = `<strong>Class:</strong> ${props.class || 'N/A'}`;
+        if (props.confidence !== undefined) popup += `<br><strong>Confidence:</strong> ${props.confidence}`;
+        if (props.notes) popup += `<br><strong>Notes:</strong> ${props.notes}`;
+        if (props.created_at) popup += `<br><small><em>${props.created_at}</em></small>`;
+        layer.bindPopup(popup);
+    }
+}).addTo(map);
+
+function addFeatures(features) {
+    // Skip features already on the map (initial fetch and events can overlap)
+    const fresh = features.filter(f => {
+        const uid = f.properties && f.properties.uid;
+        if (uid === undefined) return true;
+        if (seenFeatures.has(uid)) return false;
+        seenFeatures.add(uid);
+        return true;
     });
+    if (fresh.length) geoLayer.addData(fresh);
+    return fresh.length;
+}
+
+function resetLayer() {
+    geoLayer.clearLayers();
+    seenFeatures.clear();
+}
 
-    geoLayer.addTo(map);  // only once
+function renderMap(data) {
+    resetLayer();
+    addFeatures(data.features);
 
     // Centering
     if (data.properties && data.properties.center_lat && data.properties.center_lon) {
@@ -121,36 +144,165 @@ function renderMap(data) {
 
     // Processing status
     const waitingFeature = data.features.find(f => f.properties && f.properties.waiting);
-    if (waitingFeature) {
-        let countdown = 30;
-        uploadStatus.textContent = `Processing analysis ... (${countdown}s)`;
+    if (window.uploadPending) {
+        // Just uploaded: keep the processing status until progress events arrive
+    } else if (waitingFeature) {
+        uploadStatus.textContent = "Processing analysis ...";
         progressSpinner.style.display = "inline-block";
-
-        const timer = setInterval(() => {
-            countdown--;
-            if (countdown > 0) {
-                uploadStatus.textContent = `Processing analysis ... (${countdown}s)`;
-            } else {
-                clearInterval(timer);
-                uploadStatus.textContent = "Still processing ... reload soon.";
-                progressSpinner.style.display = "none";
-            }
-        }, 1000);
     } else {
         uploadStatus.textContent = "Analysis complete.";
         progressSpinner.style.display = "none";
     }
 }
 
+function loadPolygons() {
+    return fetch('/api/polygons')
+        .then(response => response.json())
+        .then(data => {
+            console.log("Polygon data:", data);
+            renderMap(fixFeatures(data));
+        });
+}
+
+
+// === Live Updates (Server-Sent Events) ===
+function applyFeaturesEvent(event) {
+    const data = JSON.parse(event.data);
+    // Batches are processed interleaved: features of every batch join the map, none clears it
+    const wasEmpty = geoLayer.getLayers().length === 0;
+    addFeatures(fixFeatures(data).features);
+    if (wasEmpty && geoLayer.getLayers().length > 0) map.fitBounds(geoLayer.getBounds());
+}
+
+function applyProgressEvent(event) {
+    const p = JSON.parse(event.data);
+    const done = (p.completed_count || 0) + (p.failed_count || 0);
+    const total = p.total_expected || 0;
+    if (total && done >= total) {
+        window.uploadPending = false;
+        uploadStatus.textContent = `Analysis complete: ${p.completed_count} images, ${p.total_polygons} polygons` +
+            (p.failed_count ? `, ${p.failed_count} failed.` : ".");
+        progressSpinner.style.display = "none";
+    } else {
+        uploadStatus.textContent = `Processing analysis ... ${done}/${total || "?"} images, ${p.total_polygons} polygons`;
+        progressSpinner.style.display = "inline-block";
+    }
+}
+
+function subscribeMapEvents() {
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/map/events');
+    let missedEvents = false;
+    source.addEventListener("features", applyFeaturesEvent);
+    source.addEventListener("progress", applyProgressEvent);
+    source.onerror = () => { missedEvents = true; };
+    source.onopen = () => {
+        // Events sent while disconnected are lost: reload the layer once
+        if (missedEvents) {
+            missedEvents = false;
+            loadPolygons().catch(err => console.error("Failed to reload polygons:", err));
+        }
+    };
+}
+
+
+// === Chunked Uploads ===
+// Files go to /api/uploads in chunks; a dropped connection (or a page reload)
+// resumes from the last byte the server has instead of starting over.
+const uploadForm = document.getElementById("uploadForm");
+
+function uploadKey(file) {
+    return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+async function openUpload(file, batchId, priority) {
+    const saved = JSON.parse(localStorage.getItem(uploadKey(file)) || "null");
+    if (saved) {
+        const response = await fetch(`/api/uploads/${saved.upload_id}`, { cache: "no-store" });
+        if (response.ok) return { ...saved, ...(await response.json()) };
+    }
+    const response = await fetch('/api/uploads', {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ filename: file.name, size: file.size, batch_id: batchId, priority: priority })
+    });
+    if (!response.ok) throw new Error((await response.json()).error || response.statusText);
+    const upload = await response.json();
+    localStorage.setItem(uploadKey(file), JSON.stringify(upload));
+    return upload;
+}
+
+async function sendFile(file, upload, onProgress) {
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`/api/uploads/${upload.upload_id}`, {
+                method: "PATCH",
+                headers: { "Upload-Offset": String(offset), "Content-Type": "application/octet-stream" },
+                body: file.slice(offset, offset + upload.chunk_size)
+            });
+            const state = await response.json();
+            if (!response.ok && response.status !== 409) throw new Error(state.error || response.statusText);
+            offset = state.offset;      // on 409 the server says where to continue
+            failures = 0;
+            onProgress(offset);
+        } catch (err) {
+            // Link down: back off, then ask the server how much it got
+            failures += 1;
+            if (failures > 8) throw err;
+            await sleep(Math.min(30000, 1000 * 2 ** failures));
+            const response = await fetch(`/api/uploads/${upload.upload_id}`, { cache: "no-store" }).catch(() => null);
+            if (response && response.ok) offset = (await response.json()).offset;
+        }
+    }
+    localStorage.removeItem(uploadKey(file));
+}
+
+async function chunkedUpload(files, priority) {
+    const total = files.reduce((sum, f) => sum + f.size, 0);
+    let done = 0;
+    let batchId = null;
+    for (const file of files) {
+        const upload = await openUpload(file, batchId, priority);
+        upload.chunk_size = upload.chunk_size || 8 * 1024 * 1024;
+        batchId = upload.batch_id;
+        await sendFile(file, upload, offset => {
+            const percent = Math.floor(100 * (done + offset) / total);
+            uploadStatus.textContent = `Uploading ${file.name} ... ${percent}%`;
+        });
+        done += file.size;
+        // Each file is queued for analysis as soon as its last chunk arrives
+        window.uploadPending = true;
+    }
+    uploadStatus.textContent = "Processing... the map updates as images finish.";
+}
+
+if (uploadForm && window.fetch && window.Blob && Blob.prototype.slice) {
+    uploadForm.addEventListener("submit", event => {
+        const files = Array.from(document.getElementById("imageUpload").files);
+        if (!files.length) return;
+        event.preventDefault();
+        const modal = bootstrap.Modal.getInstance(document.getElementById("uploadModal"));
+        if (modal) modal.hide();
+        progressSpinner.style.display = "inline-block";
+        chunkedUpload(files, document.getElementById("uploadPriority").value).catch(err => {
+            console.error("Upload failed:", err);
+            uploadStatus.textContent = `Upload interrupted: ${err.message}. Upload the same files again to resume.`;
+            progressSpinner.style.display = "none";
+        });
+    });
+}
+
 
 // === Initial Fetch ===
-fetch('/api/polygons')
-    .then(response => response.json())
-    .then(data => {
-        console.log("Polygon data:", data);
-        renderMap(fixFeatures(data));
-    })
+loadPolygons()
     .catch(err => {
         console.error("Failed to load polygons:", err);
         alert("Failed to load polygon data.");
-    });
+    })
+    .finally(subscribeMapEvents);
@@ -0,0 +1,95 @@
+# benchmarks/georef_bench.py
+"""
+Compares the legacy per-vertex georeferencing loop against the vectorized
+app.core.georef transform, for all features of one image at once. Both sides
+include serializing each feature's coordinates for PolygonFeature.coordinates
+(json.dumps of lists vs orjson straight from the arrays).
+
+    python benchmarks/georef_bench.py --vertices 10000 1000000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.georef import GeoAffine, camera_for, dumps_rings, georeference_rings  # noqa: E402
+
+IMAGE_SIZE = (4000, 3000)
+MODEL_SIZE = (1024, 768)
+CENTER = (29.9517, -85.4289)
+
+
+def legacy_transform(coords, center_lat, center_lon, image_size, model_size):
+    """transform_coordinates_to_geo before vectorization (image size passed in, no file open)."""
+    meters_per_pixel = (6.3 * 120) / (4.73 * 4000)
+    original_width, original_height = image_size
+    scale_x = original_width / float(model_size[0])
+    scale_y = original_height / float(model_size[1])
+    transformed_coords = []
+    for coord_ring in coords:
+        transformed_ring = []
+        for coord_pair in coord_ring:
+            if len(coord_pair) >= 2:
+                pixel_x = float(coord_pair[0]) * scale_x
+                pixel_y = float(coord_pair[1]) * scale_y
+                dx_meters = (pixel_x - original_width / 2) * meters_per_pixel
+                dy_meters = (pixel_y - original_height / 2) * meters_per_pixel
+                lat_offset = dy_meters / 111320.0
+                lon_offset = dx_meters / (111320.0 * math.cos(math.radians(center_lat)))
+                transformed_ring.append([center_lon + lon_offset, center_lat + lat_offset])
+        transformed_coords.append(transformed_ring)
+    return transformed_coords
+
+
+def synthetic_features(vertices, per_ring, rng):
+    """Polygon coordinates (one ring each) totalling ``vertices`` model-pixel vertices."""
+    features = []
+    for _ in range(max(1, vertices // per_ring)):
+        cx, cy = rng.uniform(0, MODEL_SIZE[0]), rng.uniform(0, MODEL_SIZE[1])
+        ring = [[cx + 20 * math.cos(a), cy + 20 * math.sin(a)]
+                for a in (2 * math.pi * k / (per_ring - 1) for k in range(per_ring - 1))]
+        features.append([ring + [ring[0]]])
+    return features
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    affine = GeoAffine.for_image(camera_for(None), IMAGE_SIZE, *CENTER, model_size=MODEL_SIZE)
+    print(f"{'vertices':>10}{'features':>10}{'legacy s':>12}{'numpy s':>12}{'speedup':>10}{'max |diff|':>14}")
+    for vertices in args.vertices:
+        features = synthetic_features(vertices, args.per_ring, rng)
+        repeat = args.repeat if vertices <= 100_000 else min(args.repeat, 2)
+        legacy_s, legacy = best_of(
+            lambda: [json.dumps(legacy_transform(c, *CENTER, IMAGE_SIZE, MODEL_SIZE)) for c in features], repeat)
+        numpy_s, vectorized = best_of(
+            lambda: [dumps_rings(rings) for rings in georeference_rings(features, affine)], repeat)
+        diff = max(float(np.max(np.abs(np.asarray(json.loads(a)) - np.asarray(json.loads(b)))))
+                   for a, b in zip(legacy, vectorized))
+        total = sum(len(c[0]) for c in features)
+        print(f"{total:>10}{len(features):>10}{legacy_s:>12.4f}{numpy_s:>12.4f}"
+              f"{legacy_s / numpy_s:>9.1f}x{diff:>14.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Georeferencing: per-vertex loop vs NumPy")
+    parser.add_argument("--vertices", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--per-ring", type=int, default=40, help="Vertices per polygon")
+    parser.add_argument("--repeat", type=int, default=5, help="Best-of runs (at most 2 above 100k vertices)")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
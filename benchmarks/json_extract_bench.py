@@ -0,0 +1,76 @@
+# benchmarks/json_extract_bench.py
+"""
+Compares the legacy first-"{"/last-"}" slice + json.loads against
+app.core.json_extract on the model-output corpus and on a large synthetic answer.
+
+    python benchmarks/json_extract_bench.py --iterations 2000
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.json_extract import extract_feature_collection  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "model_outputs")
+
+
+def legacy_extract(text):
+    """The parser OllamaGemmaClient used before json_extract."""
+    start_idx = text.find('{')
+    end_idx = text.rfind('}') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        try:
+            return json.loads(text[start_idx:end_idx])
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+def large_answer(features=200):
+    ring = [[i * 1.5, i * 2.5] for i in range(12)]
+    fc = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"id": f"f-{i}", "class": "debris_moderate", "confidence": 0.8,
+                                           "notes": "Debris {scattered} near road"},
+         "geometry": {"type": "Polygon", "coordinates": [ring + [ring[0]]]}}
+        for i in range(features)]}
+    return "```json\n" + json.dumps(fc, indent=4) + "\n```"
+
+
+def time_per_call(fn, text, iterations):
+    """Best of three runs, microseconds per call (timeit keeps GC out of the loop)."""
+    timer = timeit.Timer(lambda: fn(text))
+    return min(timer.repeat(repeat=3, number=iterations)) / iterations * 1e6
+
+
+def feature_count(value):
+    return len(value["features"]) if isinstance(value, dict) and isinstance(value.get("features"), list) else None
+
+
+def main(args):
+    samples = {os.path.basename(p): open(p).read() for p in sorted(glob.glob(os.path.join(CORPUS, "*.txt")))}
+    samples["large_200_features"] = large_answer()
+
+    print(f"{'sample':<32}{'bytes':>8}{'legacy':>10}{'new':>10}{'legacy us':>12}{'new us':>10}")
+    recovered = {"legacy": 0, "new": 0}
+    for name, text in samples.items():
+        legacy = feature_count(legacy_extract(text))
+        new = feature_count(extract_feature_collection(text))
+        recovered["legacy"] += legacy is not None
+        recovered["new"] += new is not None
+        iterations = max(1, args.iterations // (1 + len(text) // 20000))
+        legacy_us = time_per_call(legacy_extract, text, iterations)
+        new_us = time_per_call(extract_feature_collection, text, iterations)
+        print(f"{name:<32}{len(text):>8}{str(legacy):>10}{str(new):>10}{legacy_us:>12.1f}{new_us:>10.1f}")
+    print()
+    print(f"Parsed: legacy {recovered['legacy']}/{len(samples)}, new {recovered['new']}/{len(samples)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model-output JSON extractor benchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+# benchmarks/json_extract_fuzz.py
+"""
+Mutation fuzzing of app.core.json_extract, seeded from the model-output corpus.
+
+Each round takes a corpus sample, applies random faults seen in real Gemma
+output (truncation, trailing commas, comments, prose with braces, fences,
+echoed prompt example) and checks the extractor never raises and never
+invents or loses features it should keep.
+
+    python benchmarks/json_extract_fuzz.py --rounds 20000 --seed 1
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.json_extract import extract_feature_collection  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+def count(value):
+    return None if value is None else len(value["features"])
+
+
+def truncate(text, rng):
+    return text[:rng.randrange(1, len(text))], "truncate"
+
+
+def trailing_comma(text, rng):
+    closers = [i for i, ch in enumerate(text) if ch in "}]"]
+    if not closers:
+        return text, "noop"
+    i = rng.choice(closers)
+    return text[:i] + "," + text[i:], "comma"
+
+
+def comment(text, rng):
+    lines = text.split("\n")
+    i = rng.randrange(len(lines))
+    if '"' in lines[i]:  # keep the comment outside strings
+        lines[i] = lines[i] + " // model remark"
+    return "\n".join(lines), "comment"
+
+
+def prose(text, rng):
+    before = rng.choice(["", "Here is the analysis:\n", "Result (see {notes} below):\n"])
+    after = rng.choice(["", "\nHope this helps! {end}", "\n[1] estimates only"])
+    return before + text + after, "prose"
+
+
+def fence(text, rng):
+    return "```json\n" + text + "\n```", "fence"
+
+
+MUTATIONS = [truncate, trailing_comma, comment, prose, fence]
+PRESERVING = {"comment", "prose", "fence", "noop"}
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    with open(os.path.join(CORPUS, "expected_features.json")) as f:
+        expected = json.load(f)
+    seeds = {os.path.basename(p): open(p).read()
+             for p in sorted(glob.glob(os.path.join(CORPUS, "model_outputs", "*.txt")))}
+
+    # Corpus regression first
+    failures = []
+    for name, text in seeds.items():
+        got = count(extract_feature_collection(text))
+        if got != expected.get(name):
+            failures.append((name, f"expected {expected.get(name)} features, got {got}", text))
+
+    parseable = {name: text for name, text in seeds.items() if expected.get(name)}
+    for round_no in range(args.rounds):
+        name = rng.choice(sorted(parseable))
+        text, applied = parseable[name], []
+        for _ in range(rng.randint(1, 3)):
+            text, kind = rng.choice(MUTATIONS)(text, rng)
+            applied.append(kind)
+        try:
+            got = count(extract_feature_collection(text))
+        except Exception as e:
+            failures.append((name, f"raised {type(e).__name__}: {e} after {applied}", text))
+            continue
+        want = expected[name]
+        if got is not None and got > want:
+            failures.append((name, f"invented features ({got} > {want}) after {applied}", text))
+        elif set(applied) <= PRESERVING and got != want:
+            failures.append((name, f"lost features ({got} != {want}) after {applied}", text))
+
+    print(f"{args.rounds} fuzz rounds over {len(parseable)} seeds, {len(failures)} failures")
+    for name, reason, text in failures[:10]:
+        print(f"- {name}: {reason}\n  {text[:200]!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz the model-output JSON extractor")
+    parser.add_argument("--rounds", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,187 @@
+# benchmarks/mock_ollama.py
+"""
+Stand-in for Ollama's /api/generate, for measuring the pipeline without a GPU.
+
+Returns canned or synthetic FeatureCollections after a configurable latency,
+optionally streamed token by token, and fails a configurable share of requests.
+
+    python benchmarks/mock_ollama.py --port 11435 --latency 2 --jitter 0.5 --failure-rate 0.05
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class MockOllamaConfig:
+    def __init__(self, latency=2.0, jitter=0.5, failure_rate=0.0, features=8, canned=None,
+                 stream_chunk=16, load_duration=0.0, model="gemma3n:e4b", seed=None):
+        self.latency = latency              # mean seconds per generate call
+        self.jitter = jitter                # +/- seconds, uniform
+        self.failure_rate = failure_rate    # share of requests answered with HTTP 500
+        self.features = features            # synthetic features per image
+        self.canned = canned                # FeatureCollection returned verbatim, if set
+        self.stream_chunk = stream_chunk    # characters per streamed token
+        self.load_duration = load_duration  # simulated cold model load on the first call
+        self.model = model
+        self.random = random.Random(seed)
+        self.loaded = False
+        self.requests = 0
+        self.in_flight = 0                  # generate calls being answered right now
+        self.lock = threading.Lock()
+
+
+def synthetic_feature_collection(width, height, count, rng):
+    """Random damage polygons in model pixel space."""
+    classes = ["building_minor_damage", "building_major_damage", "building_total_destruction",
+               "road_partially_blocked", "debris_moderate", "water_minor_flooding"]
+    features = []
+    for i in range(count):
+        w, h = rng.uniform(0.03, 0.15) * width, rng.uniform(0.03, 0.15) * height
+        x, y = rng.uniform(0, width - w), rng.uniform(0, height - h)
+        ring = [[x, y], [x + w, y], [x + w, y + h], [x, y + h], [x, y]]
+        cls = rng.choice(classes)
+        features.append({
+            "type": "Feature",
+            "properties": {"id": f"mock-{i}", "class": cls, "damage_type": cls.split("_", 1)[-1],
+                           "confidence": round(rng.uniform(0.5, 0.99), 2), "notes": "synthetic"},
+            "geometry": {"type": "Polygon", "coordinates": [[[round(a, 1), round(b, 1)] for a, b in ring]]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def make_handler(config: MockOllamaConfig):
+
+    class MockOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": config.model}]})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self._send_json(404, {"error": "not found"})
+                return
+            with config.lock:
+                config.in_flight += 1
+            try:
+                self._generate()
+            finally:
+                with config.lock:
+                    config.in_flight -= 1
+
+        def _generate(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+            with config.lock:
+                config.requests += 1
+                cold = not config.loaded
+                config.loaded = True
+                fail = config.random.random() < config.failure_rate
+                delay = max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter))
+                seed = config.random.random()
+            load_duration = config.load_duration if cold else 0.0
+
+            if fail:
+                time.sleep(delay / 2)
+                self._send_json(500, {"error": "mock failure"})
+                return
+
+            # A warm-up call has no prompt or image: just "load" the model
+            if not payload.get("prompt") and not payload.get("images"):
+                time.sleep(load_duration)
+                self._send_json(200, {"model": config.model, "response": "", "done": True,
+                                      "load_duration": int(load_duration * 1e9)})
+                return
+
+            width, height = 1024, 768
+            if payload.get("images"):
+                with Image.open(io.BytesIO(base64.b64decode(payload["images"][0]))) as img:
+                    width, height = img.size
+            body = config.canned or synthetic_feature_collection(width, height, config.features,
+                                                                 random.Random(seed))
+            text = "```json\n" + json.dumps(body, indent=2) + "\n```"
+            stats = {"load_duration": int(load_duration * 1e9), "total_duration": int((delay + load_duration) * 1e9)}
+
+            if not payload.get("stream", True):
+                time.sleep(load_duration + delay)
+                self._send_json(200, {"model": config.model, "response": text, "done": True, **stats})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(load_duration)
+            tokens = [text[i:i + config.stream_chunk] for i in range(0, len(text), config.stream_chunk)]
+            per_token = delay / max(1, len(tokens))
+            for token in tokens:
+                time.sleep(per_token)
+                self._write_chunk({"model": config.model, "response": token, "done": False})
+            self._write_chunk({"model": config.model, "response": "", "done": True, **stats})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, message):
+            line = json.dumps(message).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+
+    return MockOllamaHandler
+
+
+def serve(host="127.0.0.1", port=11435, config=None, background=False):
+    """Starts the mock server; with background=True returns it running in a daemon thread."""
+    server = ThreadingHTTPServer((host, port), make_handler(config or MockOllamaConfig()))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True).start()
+        return server
+    logger.info(f"Mock Ollama listening on http://{host}:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Ollama /api/generate server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=2.0, help="Mean seconds per generate call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Uniform +/- seconds around the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--features", type=int, default=8, help="Synthetic features per image")
+    parser.add_argument("--canned", help="FeatureCollection JSON file to return instead of synthetic output")
+    parser.add_argument("--stream-chunk", type=int, default=16, help="Characters per streamed token")
+    parser.add_argument("--load-duration", type=float, default=0.0, help="Simulated cold model load, seconds")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    canned = None
+    if args.canned:
+        with open(args.canned) as f:
+            canned = json.load(f)
+    serve(args.host, args.port, MockOllamaConfig(
+        latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, features=args.features,
+        canned=canned, stream_chunk=args.stream_chunk, load_duration=args.load_duration, seed=args.seed))
@@ -0,0 +1,97 @@
+# benchmarks/persistence_bench.py
+"""
+Compares persisting finished images through the ORM (result row, then one
+INSERT per PolygonFeature through the relationship, commit per step) with
+app.persistence (one transaction, polygons bulk-inserted), on SQLite with
+several concurrent writer threads.
+
+    python benchmarks/persistence_bench.py --images 400 --polygons 20 --writers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def orm_path(db, models, batch_id, name, polygons):
+    """What analyze_image_task did before app.persistence."""
+    result = models.AnalysisResult(batch_id=batch_id, image_filename=name, processing_status="processing")
+    db.session.add(result)
+    db.session.commit()
+    result.center_lat, result.center_lon = 29.95, -85.42
+    result.polygons = [models.PolygonFeature(**row) for row in polygons]
+    result.processing_status = "completed"
+    db.session.commit()
+
+
+def bulk_path(db, models, batch_id, name, polygons):
+    from app.persistence import save_result
+    result = models.AnalysisResult(batch_id=batch_id, image_filename=name, processing_status="processing")
+    db.session.add(result)
+    db.session.commit()
+    save_result(result.id, "completed", polygons, 29.95, -85.42)
+
+
+def synthetic_polygons(count):
+    from app.persistence import polygon_row
+    ring = '[[[-85.4289,29.9517],[-85.4288,29.9517],[-85.4288,29.9518],[-85.4289,29.9518],[-85.4289,29.9517]]]'
+    return [polygon_row(f"poly_{i}", "roof_damage", 0.8, "damaged_building", "", ring) for i in range(count)]
+
+
+def run_mode(mode, args):
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from app.extensions import db
+    import app.models as models
+
+    workdir = tempfile.mkdtemp(prefix="gemma-persist-")
+    flask_app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+    })
+    with flask_app.app_context():
+        db.create_all()
+
+    persist = orm_path if mode == "orm" else bulk_path
+    polygons = synthetic_polygons(args.polygons)
+    per_writer = args.images // args.writers
+    locked = []
+
+    def writer(n):
+        with flask_app.app_context():
+            for i in range(per_writer):
+                try:
+                    persist(db, models, f"batch_{n}", f"img_{n}_{i}.jpg", polygons)
+                except OperationalError:
+                    db.session.rollback()
+                    locked.append(1)
+            db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_writer * args.writers, elapsed, len(locked)
+
+
+def run(args):
+    print(f"{args.polygons} polygons/image, {args.writers} writer thread(s)")
+    print(f"{'mode':<8}{'images':>8}{'seconds':>10}{'images/s':>10}{'locked':>8}")
+    for mode in ["orm", "bulk"]:
+        images, elapsed, locked = run_mode(mode, args)
+        print(f"{mode:<8}{images:>8}{elapsed:>10.2f}{images / elapsed:>10.1f}{locked:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORM vs bulk persistence of analysis results")
+    parser.add_argument("--images", type=int, default=400)
+    parser.add_argument("--polygons", type=int, default=20, help="Polygons per image")
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent writer threads")
+    run(parser.parse_args())
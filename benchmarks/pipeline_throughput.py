@@ -0,0 +1,186 @@
+# benchmarks/pipeline_throughput.py
+"""
+End-to-end throughput benchmark against the mock Ollama server.
+
+Pushes N synthetic geotagged images through
+routes.index -> analyze_image_task -> update_combined_polygons -> /api/polygons
+with Celery in eager mode, and reports images per minute, per-stage latency
+percentiles and database growth.
+
+    python benchmarks/pipeline_throughput.py --images 50 --per-upload 5 --latency 0.5
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.mock_ollama import MockOllamaConfig, serve  # noqa: E402
+
+
+class StageTimer:
+    """Collects wall-clock durations per named stage."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def synthetic_image(index, size):
+    """A JPEG with distinct EXIF GPS per image, so content hashes never collide."""
+    image = Image.new("RGB", size, (110 + index % 40, 90, 60))
+    exif = image.getexif()
+    seconds = (index * 0.37) % 60
+    exif[0x8825] = {1: "N", 2: (29.0, 57.0, seconds), 3: "W", 4: (85.0, 25.0, 44.0)}
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def table_counts(db, tables):
+    from sqlalchemy import text
+    return {t: db.session.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar() for t in tables}
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="gemma-bench-")
+    os.chdir(workdir)  # batch status files land here, not in the repo
+
+    mock_config = MockOllamaConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                   features=args.features, seed=args.seed)
+    mock = serve(port=0, background=True, config=mock_config)
+    ollama_url = f"http://127.0.0.1:{mock.server_address[1]}/api/generate"
+
+    from app import create_app
+    from app.extensions import db, gemma
+    import app.tasks as tasks
+
+    db_path = os.path.join(workdir, "bench.db")
+    flask_app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "OLLAMA_URL": args.ollama_url or ollama_url,
+        "OLLAMA_STREAM": args.stream,
+        "PIPELINE_STAGED": not args.monolithic,
+        "SCHEDULER_REDIS_URL": None,    # eager Celery: one process holds the whole schedule
+        "INFERENCE_CACHE_ENABLED": args.cache,
+        "INFERENCE_CACHE_DIR": os.path.join(workdir, "cache"),
+    })
+    celery_app = flask_app.extensions["celery"]
+    celery_app.conf.task_always_eager = True
+    celery_app.conf.task_eager_propagates = False
+
+    timer = StageTimer()
+    gemma.analyze_disaster_image = timer.wrap("inference", gemma.analyze_disaster_image)
+    gemma.analyze_disaster_image_stream = timer.wrap("inference", gemma.analyze_disaster_image_stream)
+    tasks.update_combined_polygons = timer.wrap("aggregate", tasks.update_combined_polygons)
+    tasks.analyze_image_task.run = timer.wrap("task", tasks.analyze_image_task.run)
+    for stage in ["preprocess", "infer", "postprocess"]:
+        task = getattr(tasks, f"{stage}_image_task")
+        task.run = timer.wrap(stage, task.run)
+
+    with flask_app.app_context():
+        db.create_all()
+        db_size_before = os.path.getsize(db_path)
+
+    print(f"Generating {args.images} synthetic {args.width}x{args.height} images...")
+    images = [synthetic_image(i, (args.width, args.height)) for i in range(args.images)]
+    uploads = [images[i:i + args.per_upload] for i in range(0, len(images), args.per_upload)]
+    upload_queue = list(enumerate(uploads))
+    queue_lock = threading.Lock()
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with queue_lock:
+                if not upload_queue:
+                    return
+                n, group = upload_queue.pop(0)
+            files = [(io.BytesIO(data), f"bench_{n}_{i}.jpg") for i, data in enumerate(group)]
+            start = time.perf_counter()
+            client.post("/", data={"images": files}, content_type="multipart/form-data")
+            timer.add("upload_request", time.perf_counter() - start)
+
+            start = time.perf_counter()
+            client.get("/api/polygons")
+            timer.add("api_polygons", time.perf_counter() - start)
+
+    print(f"Running {len(uploads)} uploads on {args.concurrency} client thread(s)...")
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with flask_app.app_context():
+        counts = table_counts(db, ["analysis_results", "polygon_features", "polygon_json"])
+        db.session.remove()
+    db_size_after = os.path.getsize(db_path)
+    mock.shutdown()
+
+    print()
+    print(f"Images:          {args.images} in {elapsed:.1f}s")
+    print(f"Throughput:      {args.images / elapsed * 60:.1f} images/min")
+    print(f"Ollama requests: {mock_config.requests}")
+    print()
+    print(f"{'stage':<16}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage in ["upload_request", "task", "preprocess", "infer", "inference", "postprocess", "aggregate",
+                  "api_polygons"]:
+        values = timer.samples.get(stage)
+        if not values:
+            continue
+        print(f"{stage:<16}{len(values):>6}{statistics.mean(values):>10.3f}{percentile(values, 50):>10.3f}"
+              f"{percentile(values, 95):>10.3f}{percentile(values, 99):>10.3f}{max(values):>10.3f}")
+    print()
+    print(f"DB size:         {db_size_before / 1024:.0f} KiB -> {db_size_after / 1024:.0f} KiB "
+          f"({(db_size_after - db_size_before) / max(1, args.images) / 1024:.1f} KiB/image)")
+    for table, count in counts.items():
+        print(f"  {table:<18}{count:>8} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline throughput benchmark")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--per-upload", type=int, default=5, help="Images per upload request (one batch each)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent uploading clients")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock inference latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--features", type=int, default=8, help="Synthetic features per image")
+    parser.add_argument("--stream", action="store_true", help="Use streaming inference mode")
+    parser.add_argument("--cache", action="store_true", help="Enable the inference cache")
+    parser.add_argument("--monolithic", action="store_true", help="One analyze_image_task per image, no stage chain")
+    parser.add_argument("--ollama-url", help="Benchmark a real Ollama instead of the mock")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
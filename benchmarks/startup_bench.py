@@ -0,0 +1,94 @@
+# benchmarks/startup_bench.py
+"""
+Measures how long the app takes to start, each run in a fresh interpreter,
+and fails (exit status 1) when a scenario goes over its budget:
+
+- import: ``import app`` (must not build an app or touch the disk)
+- web:    ``create_app()``, what ``flask run`` and the CLI pay
+- worker: the make_celery entry point plus importing the tasks, as a worker does
+
+It also fails when a scenario loads a module that should wait for first use
+(e.g. shapely before the first aggregation), or when starting the app deletes
+anything from the upload folder.
+
+    python benchmarks/startup_bench.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY = ("shapely", "numpy", "PIL", "requests", "httpx", "alembic", "redis", "app.tasks")
+
+# Milliseconds, median of the runs; generous enough for a Jetson Nano
+BUDGETS = {"import": 1500, "web": 2000, "worker": 2500}
+# Modules a scenario must not load: they belong to the first task that needs them
+LAZY = {"import": ("shapely", "numpy", "PIL", "alembic", "app.tasks"),
+        "web": ("shapely", "numpy", "PIL", "app.tasks"),
+        "worker": ("shapely", "alembic")}
+
+PROBE = """
+import json, os, sys, time
+scenario, upload_folder = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+import app
+if scenario == "web":
+    app.create_app({"UPLOAD_FOLDER": upload_folder})
+elif scenario == "worker":
+    import make_celery
+    make_celery.celery_app.loader.import_default_modules()
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "modules": [m for m in json.loads(sys.argv[3]) if m in sys.modules]}))
+"""
+
+
+def probe(scenario):
+    """One fresh interpreter: startup time and heavy modules loaded. Fails if uploads were deleted."""
+    with tempfile.TemporaryDirectory() as upload_folder:
+        sentinel = os.path.join(upload_folder, "queued.jpg")
+        open(sentinel, "wb").close()
+        out = subprocess.run([sys.executable, "-c", PROBE, scenario, upload_folder, json.dumps(HEAVY)],
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        result["uploads_kept"] = os.path.exists(sentinel)
+    return result
+
+
+def run(args):
+    failed = False
+    print(f"{'scenario':<8} {'median ms':>10} {'min ms':>8} {'budget':>8}  heavy modules loaded")
+    for scenario in args.scenarios:
+        probes = [probe(scenario) for _ in range(args.runs)]
+        times = [p["ms"] for p in probes]
+        budget = args.budget.get(scenario, BUDGETS[scenario])
+        median = statistics.median(times)
+        over = median > budget
+        kept = all(p["uploads_kept"] for p in probes)
+        eager = [m for m in LAZY[scenario] if m in probes[-1]["modules"]]
+        failed |= over or not kept or bool(eager)
+        print(f"{scenario:<8} {median:>10.0f} {min(times):>8.0f} {budget:>8}  {', '.join(probes[-1]['modules']) or '-'}"
+              f"{'  OVER BUDGET' if over else ''}{'' if kept else '  DELETED UPLOADS'}"
+              f"{'  EAGER: ' + ', '.join(eager) if eager else ''}")
+    return 1 if failed else 0
+
+
+def budget_arg(value):
+    scenario, _, ms = value.partition("=")
+    if scenario not in BUDGETS or not ms.isdigit():
+        raise argparse.ArgumentTypeError(f"expected SCENARIO=MS with SCENARIO in {', '.join(BUDGETS)}")
+    return scenario, int(ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="App startup time against a budget")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=list(BUDGETS), default=list(BUDGETS))
+    parser.add_argument("--budget", type=budget_arg, action="append", default=[],
+                        help="Override a budget, e.g. --budget web=800")
+    args = parser.parse_args()
+    args.budget = dict(args.budget)
+    sys.exit(run(args))
@@ -0,0 +1,257 @@
+# benchmarks/worker_memory_bench.py
+"""
+Memory per in-flight inference: prefork vs thread (and gevent) worker pools.
+
+For each pool and concurrency, starts a real Celery worker on the inference
+queue (filesystem broker, no Redis needed) and sends it ``concurrency``
+images against the mock Ollama server. It waits until all of them are blocked
+in /api/generate, then sums the PSS of the worker's processes. PSS splits
+shared pages between the processes that map them, so forked children are
+not counted again for memory they share with the parent. RSS is shown too,
+for comparison with what ``top`` reports.
+
+    python benchmarks/worker_memory_bench.py --pools prefork threads --concurrency 1 4 8 16
+    python benchmarks/worker_memory_bench.py --pools gevent --concurrency 32   # needs gevent installed
+
+Linux only (reads /proc).
+"""
+import argparse
+import io
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.mock_ollama import MockOllamaConfig, serve  # noqa: E402
+
+MiB = 1024 * 1024
+
+
+def bench_config(workdir, ollama_url):
+    """App overrides shared by the producer and the worker: file broker and backend, no Redis."""
+    from app import create_app
+    celery = dict(create_app({"MIGRATIONS_ENABLED": False}).config["CELERY"])
+    queue_dir = os.path.join(workdir, "broker")
+    os.makedirs(queue_dir, exist_ok=True)
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    celery.update({
+        "broker_url": "filesystem://",
+        "broker_transport_options": {"data_folder_in": queue_dir, "data_folder_out": queue_dir,
+                                     "control_folder": os.path.join(workdir, "control"),
+                                     "store_processed": False},
+        "result_backend": f"file://{os.path.join(workdir, 'results')}",
+    })
+    return {
+        "CELERY": celery,
+        "MIGRATIONS_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "OLLAMA_URL": ollama_url,
+        "OLLAMA_REDIS_URL": None,
+        "OLLAMA_WARMUP_ON_START": False,
+        "OLLAMA_KEEP_WARM_INTERVAL": 0,
+        "OLLAMA_ADAPTIVE_TIMEOUT": False,
+        "SCHEDULER_REDIS_URL": None,
+        "BATCH_STATUS_REDIS_URL": None,
+        "MAP_EVENTS_REDIS_URL": None,
+        "INFERENCE_CACHE_ENABLED": False,
+    }
+
+
+def run_worker(args):
+    """Child process: a Celery worker on the inference queue, as `celery -A make_celery worker` runs it."""
+    if args.pool == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+    from celery.signals import worker_ready
+
+    from app import create_app
+
+    flask_app = create_app(bench_config(args.workdir, args.ollama_url))
+    celery_app = flask_app.extensions["celery"]
+    ready_file = os.path.join(args.workdir, "ready")
+    worker_ready.connect(lambda **kwargs: open(ready_file, "w").close(), weak=False)
+    celery_app.worker_main(["worker", "-P", args.pool, "-c", str(args.concurrency), "-Q", "inference",
+                            "--prefetch-multiplier", "1", "--loglevel", "WARNING", "-n", f"bench-{args.pool}@%h",
+                            "--without-mingle", "--without-gossip", "--without-heartbeat"])
+
+
+def process_tree(pid):
+    """pid and all its descendants."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def memory(pid):
+    """(PSS, RSS) in bytes, summed over the process tree."""
+    pss = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                for line in f:
+                    name, value = line.split(":", 1)
+                    if name == "Pss":
+                        pss += int(value.split()[0]) * 1024
+                    elif name == "Rss":
+                        rss += int(value.split()[0]) * 1024
+        except OSError:
+            pass
+    return pss, rss
+
+
+def synthetic_images(directory, count, size):
+    from PIL import Image
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        image = Image.new("RGB", size, (100 + i % 50, 90, 60))
+        exif = image.getexif()
+        exif[0x8825] = {1: "N", 2: (29.0, 57.0, (i * 0.37) % 60), 3: "W", 4: (85.0, 25.0, 44.0)}
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90, exif=exif)
+        path = os.path.join(directory, f"bench_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+        paths.append(path)
+    return paths
+
+
+def wait_for(predicate, timeout, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def measure(pool, concurrency, mock, ollama_url, args):
+    from app import create_app
+    from app.extensions import db
+
+    workdir = tempfile.mkdtemp(prefix=f"gemma-mem-{pool}-")
+    config = bench_config(workdir, ollama_url)
+    producer = create_app(config)
+    with producer.app_context():
+        db.create_all()
+    images = synthetic_images(config["UPLOAD_FOLDER"], concurrency, (args.width, args.height))
+
+    worker = subprocess.Popen(
+        [sys.executable, __file__, "--worker", "--pool", pool, "--concurrency", str(concurrency),
+         "--workdir", workdir, "--ollama-url", ollama_url],
+        stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        if not wait_for(lambda: os.path.exists(os.path.join(workdir, "ready")), args.startup_timeout):
+            raise RuntimeError(f"{pool} worker did not start")
+        time.sleep(1.0)
+        idle_pss, idle_rss = memory(worker.pid)
+
+        import app.tasks as tasks
+        with producer.app_context():
+            for path in images:
+                tasks.analyze_image_task.apply_async(args=(path, f"mem-{pool}"))
+        if not wait_for(lambda: mock.in_flight >= concurrency, args.latency):
+            raise RuntimeError(f"only {mock.in_flight}/{concurrency} requests reached Ollama")
+        time.sleep(0.5)
+        busy_pss, busy_rss = memory(worker.pid)
+        processes = len(process_tree(worker.pid))
+    finally:
+        worker.send_signal(signal.SIGQUIT)     # cold shutdown: do not wait for the blocked requests
+        try:
+            worker.wait(10)
+        except subprocess.TimeoutExpired:
+            for p in process_tree(worker.pid):
+                try:
+                    os.kill(p, signal.SIGKILL)
+                except OSError:
+                    pass
+            worker.wait()
+        # Let the mock finish answering the cancelled requests before the next run
+        wait_for(lambda: mock.in_flight == 0, args.latency + 5)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"pool": pool, "concurrency": concurrency, "processes": processes,
+            "idle_pss": idle_pss, "busy_pss": busy_pss, "busy_rss": busy_rss}
+
+
+def run(args):
+    mock = MockOllamaConfig(latency=args.latency, jitter=0.0, features=8)
+    server = serve(port=0, background=True, config=mock)
+    server.handle_error = lambda request, client_address: None  # workers are killed mid-request
+    ollama_url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+
+    rows = []
+    for pool in args.pools:
+        if pool == "gevent":
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print("gevent is not installed (pip install gevent): skipped")
+                continue
+        for concurrency in args.concurrency:
+            row = measure(pool, concurrency, mock, ollama_url, args)
+            rows.append(row)
+            print(f"{pool:>8} c={concurrency:<3} PSS {row['busy_pss'] / MiB:7.1f} MiB", flush=True)
+
+    print()
+    print(f"{'pool':<8} {'in-flight':>9} {'procs':>5} {'idle PSS':>9} {'busy PSS':>9} {'busy RSS':>9} "
+          f"{'PSS/req':>8}   (MiB)")
+    for row in rows:
+        print(f"{row['pool']:<8} {row['concurrency']:>9} {row['processes']:>5} {row['idle_pss'] / MiB:>9.1f} "
+              f"{row['busy_pss'] / MiB:>9.1f} {row['busy_rss'] / MiB:>9.1f} "
+              f"{row['busy_pss'] / row['concurrency'] / MiB:>8.1f}")
+
+    print()
+    print(f"Marginal memory per extra in-flight request, and in-flight requests that fit in {args.budget_mib} MiB:")
+    for pool in args.pools:
+        points = sorted((r["concurrency"], r["busy_pss"]) for r in rows if r["pool"] == pool)
+        if len(points) < 2:
+            continue
+        (c0, m0), (c1, m1) = points[0], points[-1]
+        marginal = (m1 - m0) / (c1 - c0)
+        base = m0 - marginal * c0
+        fits = int((args.budget_mib * MiB - base) // marginal) if marginal > 0 else None
+        print(f"  {pool:<8} {marginal / MiB:6.1f} MiB/request, base {base / MiB:6.1f} MiB -> {fits} in flight")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker memory per in-flight inference, by Celery pool")
+    parser.add_argument("--pools", nargs="+", default=["prefork", "threads"],
+                        choices=["prefork", "threads", "gevent"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency", type=float, default=20.0,
+                        help="Seconds the mock holds each request (long enough to sample)")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--budget-mib", type=int, default=1536,
+                        help="Memory left for workers (a 4 GB Jetson also holds the OS and the model)")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--verbose", action="store_true", help="Show the workers' logs")
+    # Internal: run as the worker subprocess
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--pool", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--ollama-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        args.concurrency = args.concurrency[0]
+        run_worker(args)
+    else:
+        run(args)
@@ -1,10 +1,3 @@
 # celery_worker.py
-
-from app import create_app
-from app.extensions import celery_init_app
-
-# Create Flask app instance
-flask_app = create_app()
-
-# Bind Celery with app context
-celery = celery_init_app(flask_app)
+# Older name of the worker entry point (celery -A celery_worker.celery worker); same app as make_celery
+from make_celery import celery_app as celery, flask_app  # noqa: F401
@@ -1,4 +1,7 @@
+# make_celery.py
+# Worker entry point: celery -A make_celery worker --loglevel=info
 from app import create_app
 
-flask_app = create_app()
-celery_app = flask_app.extensions["celery"]
\ No newline at end of file
+# Workers never run `flask db`, so they skip loading alembic
+flask_app = create_app({"MIGRATIONS_ENABLED": False})
+celery_app = flask_app.extensions["celery"]
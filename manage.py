@@ -1,8 +1,28 @@
+import os
+
+import click
+from flask import current_app
 from flask.cli import FlaskGroup
-from app import create_app, db
 
-app = create_app()
-cli = FlaskGroup(app)
+from app import create_app
+
+# The app is built when a command runs, not when this module is imported
+cli = FlaskGroup(create_app=create_app)
+
+
+@cli.command("clear-uploads")
+@click.confirmation_option(prompt="Delete every uploaded image, including images with queued tasks?")
+def clear_uploads():
+    """Deletes the files in UPLOAD_FOLDER (dev only; the app no longer does this on start)."""
+    folder = current_app.config["UPLOAD_FOLDER"]
+    removed = 0
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            os.remove(path)
+            removed += 1
+    click.echo(f"Removed {removed} files from {folder}")
+
 
 if __name__ == "__main__":
     cli()
@@ -90,9 +90,17 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the polygon_features R*Tree (a virtual table plus its shadow tables) is
+    # not in the models' metadata: keep autogenerate from dropping it
+    def include_name(name, type_, parent_names):
+        if type_ == "table":
+            return not name.startswith("polygon_features_rtree")
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_name", include_name)
 
     connectable = get_engine()
 
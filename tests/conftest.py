@@ -0,0 +1,62 @@
+import io
+import socket
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+
+
+def closed_port() -> int:
+    """A local port nothing listens on: connections to it are refused at once."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on a fresh SQLite file, per-process state instead of Redis, and eager Celery."""
+    app = create_app({
+        "TESTING": True,
+        "MIGRATIONS_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "UPLOAD_FOLDER": str(tmp_path / "uploads"),
+        "OLLAMA_URL": f"http://127.0.0.1:{closed_port()}/api/generate",
+        "OLLAMA_REDIS_URL": None,
+        "OLLAMA_WARMUP_ON_START": False,
+        "OLLAMA_KEEP_WARM_INTERVAL": 0,
+        "OLLAMA_HEALTH_INTERVAL": 0,
+        "SCHEDULER_REDIS_URL": None,
+        "BATCH_STATUS_REDIS_URL": None,
+        "MAP_EVENTS_REDIS_URL": None,
+        "INFERENCE_CACHE_ENABLED": False,
+        "TASK_RETRY_BACKOFF": 0,
+        "TASK_RETRY_BACKOFF_MAX": 0,
+    })
+    celery_app = app.extensions["celery"]
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://", task_always_eager=True)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    """A small geotagged JPEG on disk."""
+    from PIL import Image
+    image = Image.new("RGB", (64, 48), (120, 90, 60))
+    exif = image.getexif()
+    exif[0x8825] = {1: "N", 2: (29.0, 57.0, 10.0), 3: "W", 4: (85.0, 25.0, 44.0)}
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+    path = tmp_path / "survey.jpg"
+    path.write_bytes(buffer.getvalue())
+    return str(path)
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from app.core.batch_status import BatchStatusStore
+from app.persistence import create_result
+
+
+@pytest.fixture
+def store():
+    return BatchStatusStore(redis_url=None, ttl=60)
+
+
+def test_counters(store):
+    store.start("b1", 3)
+    store.record_result("b1", "completed", 4)
+    store.record_result("b1", "partial", 1)
+    store.record_result("b1", "dead_letter")
+
+    status = store.get("b1")
+
+    assert status["status"] == "processing"
+    assert (status["total_expected"], status["completed_count"], status["failed_count"],
+            status["total_polygons"]) == (3, 2, 1, 5)
+
+
+def test_expired_status_is_unknown(store):
+    store.start("b1", 1)
+    store.ttl = 0
+    store.set("b1", status="updated")
+
+    assert store.get("b1") == {}
+
+
+def test_seed_skips_unknown_batches(store):
+    assert store.seed("nope", {}) == {"total_expected": 0, "completed_count": 0, "failed_count": 0,
+                                      "total_polygons": 0}
+    assert store.get("nope") == {}
+
+
+def test_snapshot_export(store, tmp_path):
+    store.start("b1", 2)
+
+    path = store.export_snapshot("b1", tmp_path)
+
+    assert json.loads(path.read_text())["total_expected"] == 2
+    assert store.export_snapshot("unknown", tmp_path) is None
+
+
+def test_status_endpoint_rebuilds_expired_counters(client):
+    create_result("b1", "a.jpg", "completed")
+    create_result("b1", "b.jpg", "failed")
+
+    body = client.get("/api/batch/b1/status").get_json()
+
+    assert (body["completed"], body["failed"]) == (1, 1)
+    assert [r["filename"] for r in body["results"]] == ["a.jpg", "b.jpg"]
+    assert body["has_more"] is False
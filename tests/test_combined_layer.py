@@ -0,0 +1,35 @@
+import orjson
+
+from app.models import PolygonJSON, combined_layer_name
+from app.persistence import create_result, polygon_row
+from app.tasks import update_combined_polygons
+
+SQUARE = "[[[-85.0, 29.0], [-84.9, 29.0], [-84.9, 29.1], [-85.0, 29.1], [-85.0, 29.0]]]"
+
+
+def combined_layer(batch_id):
+    return orjson.loads(PolygonJSON.query.filter_by(name=combined_layer_name(batch_id)).one().geojson)
+
+
+def test_centers_include_results_without_polygons(app):
+    create_result("b1", "a.jpg", "completed", [polygon_row(1, "roof", 0.9, "damaged", "", SQUARE)], 29.0, -85.0)
+    update_combined_polygons("b1")
+    create_result("b1", "b.jpg", "completed", [], 31.0, -83.0)
+    update_combined_polygons("b1")
+
+    layer = combined_layer("b1")
+    assert len(layer["features"]) == 1
+    assert layer["properties"]["aggregate"]["center_count"] == 2
+    assert (layer["properties"]["center_lat"], layer["properties"]["center_lon"]) == (30.0, -84.0)
+
+
+def test_update_appends_only_new_polygons(app):
+    create_result("b1", "a.jpg", "completed", [polygon_row(1, "roof", 0.9, "damaged", "", SQUARE)], 29.0, -85.0)
+    update_combined_polygons("b1")
+    create_result("b1", "b.jpg", "completed", [polygon_row(1, "road", 0.8, "blocked", "", SQUARE)], 29.0, -85.0)
+    update_combined_polygons("b1")
+    update_combined_polygons("b1")
+
+    layer = combined_layer("b1")
+    assert [f["properties"]["damage_type"] for f in layer["features"]] == ["roof", "road"]
+    assert layer["properties"]["aggregate"]["center_count"] == 2
@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.core.json_extract import extract_feature_collection
+
+CORPUS = Path(__file__).resolve().parent.parent / "benchmarks" / "corpus"
+EXPECTED = json.loads((CORPUS / "expected_features.json").read_text())
+
+FEATURE = '{"type": "Feature", "properties": {"notes": "%s"}, "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}}'
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_corpus(name):
+    value = extract_feature_collection((CORPUS / "model_outputs" / name).read_text())
+
+    if EXPECTED[name] is None:
+        assert value is None
+    else:
+        assert len(value["features"]) == EXPECTED[name]
+
+
+def test_well_formed_output_needs_no_repair():
+    repairs = []
+    value = extract_feature_collection('{"type": "FeatureCollection", "features": [%s]}' % FEATURE % "ok", repairs)
+
+    assert len(value["features"]) == 1
+    assert repairs == []
+
+
+def test_truncated_answer_keeps_complete_features():
+    text = '```json\n{"type": "FeatureCollection", "features": [%s, %s, {"type": "Feature", "prop' % (
+        FEATURE % "a", FEATURE % "b")
+    repairs = []
+
+    value = extract_feature_collection(text, repairs)
+
+    assert [f["properties"]["notes"] for f in value["features"]] == ["a", "b"]
+    assert repairs == ["truncated"]
+
+
+def test_trailing_commas_and_braces_in_strings():
+    text = 'Here you go: {"type": "FeatureCollection", "features": [%s,],} thanks' % (FEATURE % "roof {collapsed}")
+    repairs = []
+
+    value = extract_feature_collection(text, repairs)
+
+    assert value["features"][0]["properties"]["notes"] == "roof {collapsed}"
+    assert repairs == ["trailing_commas_or_comments"]
+
+
+def test_echoed_example_loses_to_the_answer():
+    example = '{"type": "FeatureCollection", "features": [%s]}' % (FEATURE % "example")
+    answer = '{"type": "FeatureCollection", "features": [%s, %s]}' % (FEATURE % "a", FEATURE % "b")
+
+    value = extract_feature_collection(f"Example:\n{example}\nAnswer:\n{answer}")
+
+    assert len(value["features"]) == 2
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"type": "Feature"}', "{{{"])
+def test_no_feature_collection(text):
+    assert extract_feature_collection(text) is None
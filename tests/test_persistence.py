@@ -0,0 +1,112 @@
+import json
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.persistence import (batch_polygons, batch_results_page, batch_summary, claim_result, create_result,
+                             discard_polygons, polygon_row, save_result)
+
+
+def add_results(batch_id, count):
+    return [create_result(batch_id, f"img_{i}.jpg", "completed") for i in range(count)]
+
+
+def test_results_page_limit_does_not_move_offset(app):
+    ids = add_results("b1", 5)
+
+    page = batch_results_page("b1", page=2, per_page=2, limit=3)
+
+    assert [r["id"] for r in page] == ids[2:5]
+
+
+def test_status_pages_cover_every_result_once(client):
+    ids = add_results("b1", 7)
+
+    seen, page, has_more = [], 1, True
+    while has_more:
+        body = client.get(f"/api/batch/b1/status?page={page}&per_page=2").get_json()
+        seen += [r["id"] for r in body["results"]]
+        has_more, page = body["has_more"], page + 1
+
+    assert seen == ids
+    assert page - 1 == 4
+
+
+def square(west, south, size=0.01):
+    ring = [[west, south], [west + size, south], [west + size, south + size], [west, south + size], [west, south]]
+    return polygon_row(1, "roof", 0.9, "damaged", "", json.dumps([ring]))
+
+
+def rtree_ids():
+    return {row[0] for row in db.session.execute(text("SELECT id FROM polygon_features_rtree"))}
+
+
+def test_polygon_rows_carry_their_bbox(app):
+    row = square(-85.0, 29.0)
+
+    assert (row["minx"], row["miny"], row["maxx"], row["maxy"]) == (-85.0, 29.0, -84.99, 29.01)
+    assert polygon_row(1, "roof", 0.9, "", "", "not json")["minx"] is None
+
+
+def test_bbox_query_returns_polygons_in_view(app):
+    create_result("b1", "a.jpg", "completed", [square(-85.0, 29.0), square(-80.0, 25.0)])
+    create_result("b2", "b.jpg", "completed", [square(-85.0, 29.0)])
+
+    inside = batch_polygons("b1", bbox=(-85.5, 28.5, -84.5, 29.5))
+    edge = batch_polygons("b1", bbox=(-84.995, 29.005, -84.0, 30.0))
+    empty = batch_polygons("b1", bbox=(0.0, 0.0, 1.0, 1.0))
+
+    assert [p.minx for p in inside] == [-85.0]
+    assert [p.minx for p in edge] == [-85.0]
+    assert empty == []
+    assert len(batch_polygons(None, bbox=(-85.5, 28.5, -84.5, 29.5))) == 2
+
+
+def test_rtree_follows_inserts_and_deletes(app):
+    result_id = create_result("b1", "a.jpg", "completed", [square(-85.0, 29.0), square(-80.0, 25.0)])
+    assert rtree_ids() == {p.id for p in batch_polygons("b1")}
+
+    discard_polygons(result_id)
+
+    assert rtree_ids() == set()
+    assert batch_polygons("b1", bbox=(-90.0, 20.0, -70.0, 35.0)) == []
+
+
+def test_bbox_endpoint(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "MAP_VIEWPORT_MAX_FEATURES", 1)
+    create_result("b1", "a.jpg", "completed", [square(-85.0, 29.0), square(-84.98, 29.0)])
+
+    body = client.get("/api/polygons?bbox=-85.5,28.5,-84.5,29.5&batch_id=b1").get_json()
+
+    assert len(body["features"]) == 1
+    assert body["properties"]["truncated"] is True
+    assert client.get("/api/polygons?bbox=10,0,5,1").status_code == 400
+    assert client.get("/api/polygons?bbox=a,b,c,d").status_code == 400
+
+
+def test_batch_summary_counts(app):
+    create_result("b1", "a.jpg", "completed", [square(-85.0, 29.0), square(-85.0, 29.0)])
+    create_result("b1", "b.jpg", "partial", [square(-85.0, 29.0)])
+    create_result("b1", "c.jpg", "failed")
+    claim_result("b1", "d.jpg", "b1:d")
+    create_result("b2", "e.jpg", "completed", [square(-85.0, 29.0)])
+
+    summary = batch_summary("b1")
+
+    assert summary["total_results"] == 4
+    assert summary["completed_count"] == 2
+    assert summary["failed_count"] == 1
+    assert summary["total_polygons"] == 3
+    assert summary["status_counts"]["processing"] == 1
+
+
+def test_claim_result_is_idempotent(app):
+    result_id, stage, response = claim_result("b1", "a.jpg", "b1:a")
+    save_result(result_id, "processing", [square(-85.0, 29.0)])
+
+    # A redelivery before the checkpoint drops what the dead attempt streamed
+    again = claim_result("b1", "a.jpg", "b1:a")
+
+    assert again == (result_id, "created", None)
+    assert batch_polygons("b1") == []
+    assert create_result("b1", "a.jpg", "completed", key="b1:a") is None
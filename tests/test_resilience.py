@@ -0,0 +1,135 @@
+import pytest
+import requests
+
+import app.core.resilience as resilience
+from app.core.resilience import AdaptiveTimeout, CircuitBreaker, CircuitOpenError, is_backend_failure
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, failure_window=60, cooldown=30, half_open_ttl=120)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state() == "closed"
+    breaker.check()
+
+    breaker.record_failure()
+
+    assert breaker.state() == "open"
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert error.value.retry_in == 30
+
+
+def test_failures_outside_the_window_do_not_add_up(breaker, clock):
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 61
+
+    breaker.record_failure()
+
+    assert breaker.state() == "closed"
+
+
+def test_half_open_lets_one_trial_through(breaker, clock):
+    trip(breaker)
+    clock.now += 31
+    assert breaker.state() == "half_open"
+
+    # The fail-fast check ahead of the request leaves the trial to the request itself
+    breaker.check(claim=False)
+    breaker.check()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check(claim=False)
+
+
+def test_trial_success_closes(breaker, clock):
+    trip(breaker)
+    clock.now += 31
+    breaker.check()
+
+    breaker.record_success()
+
+    assert breaker.state() == "closed"
+    breaker.check()
+
+
+def test_trial_failure_reopens(breaker, clock):
+    trip(breaker)
+    clock.now += 31
+    breaker.check()
+
+    breaker.record_failure()
+
+    assert breaker.state() == "open"
+
+
+def test_lost_trial_is_given_to_another_request(breaker, clock):
+    trip(breaker)
+    clock.now += 31
+    breaker.check(trial_timeout=10)
+
+    clock.now += 11
+
+    breaker.check()
+
+
+def test_half_open_without_verdict_closes_after_ttl(breaker, clock):
+    trip(breaker)
+    clock.now += 30 + 120
+
+    assert breaker.state() == "closed"
+
+
+def test_backend_failures():
+    assert is_backend_failure(requests.exceptions.ReadTimeout())
+    assert is_backend_failure(requests.exceptions.ConnectionError())
+    assert not is_backend_failure(CircuitOpenError(5))
+    assert not is_backend_failure(ValueError("bad JSON"))
+
+    response = requests.Response()
+    response.status_code = 503
+    assert is_backend_failure(requests.exceptions.HTTPError(response=response))
+    response.status_code = 404
+    assert not is_backend_failure(requests.exceptions.HTTPError(response=response))
+
+
+def test_adaptive_timeout(clock):
+    timeouts = AdaptiveTimeout(minimum=10, maximum=600, min_samples=5, multiplier=2.0, refresh_interval=0)
+    bucket = timeouts.bucket("gemma3n", {"model": (1024, 768)})
+    assert bucket == "gemma3n:1024"
+    assert timeouts.timeout_for(bucket) == 600
+
+    for seconds in (3, 4, 5, 6, 20):
+        timeouts.observe(bucket, seconds)
+
+    assert timeouts.timeout_for(bucket) == 40
@@ -0,0 +1,111 @@
+from collections import Counter
+
+import pytest
+from PIL import Image
+
+from app.core.scheduler import FairShareScheduler
+
+
+@pytest.fixture
+def scheduler():
+    return FairShareScheduler(redis_url=None, max_in_flight=2, small_first=False)
+
+
+def drain(scheduler, limit=100):
+    """Dispatches and finishes images one at a time; returns the batch of each, in dispatch order."""
+    order = []
+    for _ in range(limit):
+        sent = []
+        scheduler.dispatch(lambda path, batch_id: sent.append((path, batch_id)))
+        if not sent:
+            break
+        for path, batch_id in sent:
+            order.append(batch_id)
+            scheduler.finished(batch_id, path)
+    return order
+
+
+def test_equal_priorities_alternate(scheduler):
+    scheduler.submit("big", [f"big_{i}.jpg" for i in range(6)])
+    scheduler.submit("small", ["small_0.jpg", "small_1.jpg"])
+
+    order = drain(scheduler)
+
+    assert order[:4] in (["big", "small"] * 2, ["small", "big"] * 2)
+    assert Counter(order) == {"big": 6, "small": 2}
+
+
+def test_priority_sets_the_share(scheduler):
+    scheduler.submit("normal", [f"n_{i}.jpg" for i in range(10)])
+    scheduler.submit("urgent", [f"u_{i}.jpg" for i in range(8)], priority=4)
+
+    order = drain(scheduler)
+
+    assert Counter(order[:10]) == {"urgent": 8, "normal": 2}
+
+
+def test_priority_is_clamped(scheduler):
+    assert scheduler.clamp_priority("99") == scheduler.max_priority
+    assert scheduler.clamp_priority(0) == 1
+    assert scheduler.clamp_priority("urgent") == scheduler.default_priority
+
+
+def test_in_flight_cap_and_release(scheduler):
+    scheduler.submit("b1", [f"img_{i}.jpg" for i in range(5)])
+    sent = []
+
+    assert scheduler.dispatch(lambda path, batch_id: sent.append(path)) == 2
+    assert scheduler.dispatch(lambda path, batch_id: sent.append(path)) == 0
+
+    scheduler.finished("b1", sent[0])
+    assert scheduler.dispatch(lambda path, batch_id: sent.append(path)) == 1
+    assert sent == ["img_0.jpg", "img_1.jpg", "img_2.jpg"]
+
+
+def test_failed_send_frees_the_slot(scheduler):
+    scheduler.submit("b1", ["a.jpg", "b.jpg", "c.jpg"])
+
+    def send(path, batch_id):
+        raise ConnectionError("broker down")
+
+    scheduler.dispatch(send)
+
+    assert scheduler.estimate("b1")["in_flight"] == 0
+
+
+def test_lost_slots_expire(scheduler):
+    scheduler.submit("b1", ["a.jpg", "b.jpg", "c.jpg"])
+    sent = []
+    scheduler.dispatch(lambda path, batch_id: sent.append(path))
+    assert len(sent) == 2
+
+    # Neither image reported back; once their slots time out the last one goes
+    scheduler.in_flight_timeout = 0
+    scheduler.dispatch(lambda path, batch_id: sent.append(path))
+
+    assert sent == ["a.jpg", "b.jpg", "c.jpg"]
+
+
+def test_small_images_first(tmp_path):
+    paths = []
+    for name, size in (("large.jpg", (400, 300)), ("small.jpg", (40, 30)), ("medium.jpg", (200, 150))):
+        Image.new("RGB", size).save(tmp_path / name)
+        paths.append(str(tmp_path / name))
+    scheduler = FairShareScheduler(redis_url=None, max_in_flight=3, small_first=True)
+    scheduler.submit("b1", paths)
+    sent = []
+
+    scheduler.dispatch(lambda path, batch_id: sent.append(path))
+
+    assert [p.rsplit("/", 1)[1] for p in sent] == ["small.jpg", "medium.jpg", "large.jpg"]
+
+
+def test_estimate_counts_other_batches_ahead(scheduler):
+    scheduler.submit("big", [f"big_{i}.jpg" for i in range(10)])
+    scheduler.submit("b1", ["a.jpg", "b.jpg"])
+
+    estimate = scheduler.estimate("b1")
+
+    assert estimate["queued"] == 2
+    assert estimate["images_ahead"] == 2
+    assert estimate["expected_wait_s"] == round(4 * scheduler.default_service_time / 2)
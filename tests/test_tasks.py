@@ -0,0 +1,82 @@
+import pytest
+
+import app.tasks as tasks
+from app.extensions import batch_status, gemma
+from app.models import AnalysisResult
+from app.persistence import batch_polygons
+
+RESPONSE = {
+    "type": "FeatureCollection",
+    "image_size": {"model": [64, 48]},
+    "features": [
+        {"type": "Feature", "properties": {"id": "p1", "damage_type": "roof", "confidence": 0.9},
+         "geometry": {"type": "Polygon", "coordinates": [[[10, 10], [30, 10], [30, 30], [10, 30], [10, 10]]]}},
+        {"type": "Feature", "properties": {"id": "p2", "damage_type": "road", "confidence": 0.7},
+         "geometry": {"type": "Polygon", "coordinates": [[[40, 20], [60, 20], [60, 40], [40, 20]]]}},
+    ],
+}
+
+
+@pytest.fixture
+def dead_letters(monkeypatch):
+    calls = []
+    original = tasks._dead_letter
+
+    def counting(task, result, exc):
+        calls.append(task.name)
+        return original(task, result, exc)
+
+    monkeypatch.setattr(tasks, "_dead_letter", counting)
+    return calls
+
+
+def test_unreachable_ollama_dead_letters_once(app, image_file, dead_letters):
+    batch_status.start("b1", 1)
+    tasks.analyze_image_task.apply(args=(image_file, "b1"))
+
+    assert dead_letters == ["app.tasks.analyze_image_task"]
+    assert batch_status.get("b1")["failed_count"] == 1
+
+
+def test_unreachable_ollama_dead_letters_once_in_staged_chain(app, image_file, dead_letters):
+    batch_status.start("b2", 1)
+    # An eager chain re-raises the failed link's result, as a worker would not
+    with pytest.raises(tasks.DeadLettered):
+        tasks.analyze_image_pipeline(image_file, "b2").apply()
+
+    assert dead_letters == ["app.tasks.infer_image_task"]
+    assert batch_status.get("b2")["failed_count"] == 1
+
+
+@pytest.fixture
+def ollama_calls(monkeypatch):
+    calls = []
+
+    def analyze(image_path, cache_key=None):
+        calls.append(image_path)
+        return RESPONSE
+
+    monkeypatch.setattr(gemma, "analyze_disaster_image", analyze)
+    return calls
+
+
+def test_staged_pipeline_runs_every_stage(app, image_file, ollama_calls):
+    batch_status.start("b3", 1)
+
+    summary = tasks.analyze_image_pipeline(image_file, "b3").apply().get()
+
+    result = AnalysisResult.query.one()
+    assert summary["status"] == "completed" and summary["polygons_count"] == 2
+    assert (result.processing_status, result.stage) == ("completed", "aggregated")
+    assert len(batch_polygons("b3")) == 2
+    assert batch_status.get("b3")["completed_count"] == 1
+    assert ollama_calls == [image_file]
+
+
+def test_redelivered_image_resumes_from_its_checkpoint(app, image_file, ollama_calls):
+    tasks.analyze_image_pipeline(image_file, "b4").apply()
+    tasks.analyze_image_pipeline(image_file, "b4").apply()
+
+    assert AnalysisResult.query.count() == 1
+    assert len(batch_polygons("b4")) == 2
+    assert ollama_calls == [image_file]
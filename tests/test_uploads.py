@@ -0,0 +1,83 @@
+import hashlib
+import io
+
+import pytest
+
+import app.tasks as tasks
+from app.core.uploads import ChunkedUploadStore, UploadError, content_path, save_stream
+from app.extensions import batch_status
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(directory=tmp_path, max_chunk_bytes=4096)
+
+
+def test_wrong_offset_is_409_with_current_offset(store):
+    upload = store.create("a.jpg", len(DATA), "b1")
+    store.append(upload["upload_id"], 0, io.BytesIO(DATA[:1000]), 1000)
+
+    with pytest.raises(UploadError) as error:
+        store.append(upload["upload_id"], 0, io.BytesIO(DATA[:1000]), 1000)
+
+    assert error.value.status == 409
+    assert error.value.offset == 1000
+
+
+def test_resume_after_cut_off_chunk(store):
+    upload_id = store.create("a.jpg", len(DATA), "b1")["upload_id"]
+    # The connection drops after 700 of the 3000 bytes sent: what arrived stays
+    store.append(upload_id, 0, io.BytesIO(DATA[:700]), 3000)
+    assert store.status(upload_id)["offset"] == 700
+
+    offset = 700
+    while True:
+        state = store.append(upload_id, offset, io.BytesIO(DATA[offset:offset + 4096]))
+        offset = state["offset"]
+        if state["complete"]:
+            break
+
+    assert state["finished"]
+    assert state["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert open(state["path"], "rb").read() == DATA
+
+
+def test_only_the_completing_call_is_finished(store):
+    upload_id = store.create("a.jpg", 100, "b1")["upload_id"]
+    assert store.append(upload_id, 0, io.BytesIO(DATA[:100]), 100)["finished"]
+
+    again = store.append(upload_id, 100, io.BytesIO(b""), 0)
+
+    assert again["complete"] and not again["finished"]
+
+
+def test_uploads_are_content_addressed(store, tmp_path):
+    first = store.create("IMG_0001.jpg", 100, "b1")["upload_id"]
+    second = store.create("IMG_0001.jpg", 100, "b2")["upload_id"]
+
+    path_a = store.append(first, 0, io.BytesIO(DATA[:100]), 100)["path"]
+    path_b = store.append(second, 0, io.BytesIO(DATA[100:200]), 100)["path"]
+    path_c = save_stream(io.BytesIO(DATA[:100]), tmp_path, "other-name.jpg")
+
+    assert path_a != path_b
+    assert str(path_c) == path_a == str(content_path(tmp_path, hashlib.sha256(DATA[:100]).hexdigest(), "x.jpg"))
+
+
+def test_total_expected_counts_each_finished_upload_once(client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(tasks, "schedule_images", lambda paths, batch_id, priority=None: scheduled.extend(paths))
+
+    created = client.post("/api/uploads", json={"filename": "a.jpg", "size": 100}).get_json()
+    # A retried POST for the same file, then abandoned
+    client.post("/api/uploads", json={"filename": "a.jpg", "size": 100, "batch_id": created["batch_id"]})
+    assert batch_status.get(created["batch_id"])["total_expected"] == 0
+
+    response = client.patch(f"/api/uploads/{created['upload_id']}", data=DATA[:100],
+                            headers={"Upload-Offset": "0"})
+    client.patch(f"/api/uploads/{created['upload_id']}", data=b"", headers={"Upload-Offset": "100"})
+
+    assert response.get_json()["complete"]
+    assert len(scheduled) == 1
+    assert batch_status.get(created["batch_id"])["total_expected"] == 1